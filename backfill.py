@@ -0,0 +1,238 @@
+"""
+Backfill storico a blocchi mensili, riprendibile dopo un errore.
+
+Caricare anni di storico TLC con un solo `dbt run` significa una transazione enorme su
+ods_taxi_trip e dm_fact_taxi_trip: memoria e WAL crescono con l'intero storico e un errore
+alla terza ora fa ripartire da zero. Qui il caricamento è pianificato per mese di pickup:
+
+    setup      dbt run dei modelli non a valle dei trip (lookup ODS, meteo, dimensioni)
+    YYYY-MM    ods:      il mese in ods_taxi_trip (build_ods_parallel, DELETE + INSERT del mese)
+               datamart: dbt run della catena a valle (ods_taxi_trip+), incrementale: solo il mese
+    finalize   dbt run dei modelli ricostruiti per intero (dm_fact_taxi_trip_sample)
+
+Ogni passo concluso viene registrato in main.backfill_checkpoint (nello stesso file DuckDB);
+rilanciando il comando si riparte dal primo passo non concluso. Ogni blocco è una transazione
+limitata a un mese: memoria e WAL restano quelli di un mese.
+Per ogni blocco si stampano righe, righe/s e ETA (dalle righe raw dei mesi rimanenti).
+
+    python backfill.py --plan                       # piano e stato, senza eseguire
+    python backfill.py [--from 2019-01] [--to 2024-12]
+    python backfill.py --restart                    # ignora i checkpoint precedenti
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+import duckdb
+
+from build_ods_parallel import MIN_PICKUP, ODS_TABLE, _parse_month, build_ods_parallel
+from init_duckdb import DATA_DIR, DB_PATH
+
+CHECKPOINT_TABLE = "main.backfill_checkpoint"
+SETUP, FINALIZE = "setup", "finalize"
+# modelli ricostruiti per intero a ogni run: una volta sola, alla fine (come in refresh_watch.py)
+FULL_REBUILD_MODELS = ["dm_fact_taxi_trip_sample"]
+
+
+@dataclass
+class Chunk:
+    month: date
+    raw_rows: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.month:%Y-%m}"
+
+
+def plan_chunks(data_dir: Path = DATA_DIR, start: Optional[date] = None, end: Optional[date] = None) -> List[Chunk]:
+    """Mesi di pickup dei parquet raw, con il numero di righe (solo la colonna del pickup viene letta)."""
+    raw_glob = (data_dir / "taxi_trip" / "*.parquet").as_posix()
+    con = duckdb.connect()
+    try:
+        rows = con.execute(f"""
+            SELECT CAST(date_trunc('month', tpep_pickup_datetime) AS DATE) AS month, COUNT(*)
+            FROM read_parquet('{raw_glob}')
+            WHERE tpep_pickup_datetime >= TIMESTAMP '{MIN_PICKUP}'
+            GROUP BY ALL
+            ORDER BY month
+        """).fetchall()
+    finally:
+        con.close()
+    return [
+        Chunk(month, n) for month, n in rows
+        if (start is None or month >= start) and (end is None or month <= end)
+    ]
+
+
+# ----------------------------
+# CHECKPOINT
+# ----------------------------
+
+def _checkpoint_con(db_path: Path) -> duckdb.DuckDBPyConnection:
+    con = duckdb.connect(str(db_path))
+    con.execute(f"""
+        CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+            chunk VARCHAR,
+            stage VARCHAR,
+            rows BIGINT,
+            elapsed_s DOUBLE,
+            finished_at TIMESTAMP
+        )
+    """)
+    return con
+
+
+def completed_steps(db_path: Path) -> Set[Tuple[str, str]]:
+    if not db_path.exists():
+        return set()
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        exists = con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = 'main' AND table_name = 'backfill_checkpoint'"
+        ).fetchone()[0]
+        if not exists:
+            return set()
+        return set(con.execute(f"SELECT chunk, stage FROM {CHECKPOINT_TABLE}").fetchall())
+    finally:
+        con.close()
+
+
+def record_step(db_path: Path, chunk: str, stage: str, rows: int, elapsed_s: float) -> None:
+    con = _checkpoint_con(db_path)
+    try:
+        con.execute(
+            f"INSERT INTO {CHECKPOINT_TABLE} VALUES (?, ?, ?, ?, ?)",
+            [chunk, stage, rows, round(elapsed_s, 3), datetime.now()],
+        )
+    finally:
+        con.close()
+
+
+def clear_checkpoints(db_path: Path) -> None:
+    if not db_path.exists():
+        return
+    con = _checkpoint_con(db_path)
+    try:
+        con.execute(f"DELETE FROM {CHECKPOINT_TABLE}")
+    finally:
+        con.close()
+
+
+# ----------------------------
+# ESECUZIONE
+# ----------------------------
+
+def _format_eta(seconds: float) -> str:
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{secs:02d}s"
+
+
+def _dbt(select: Optional[List[str]], exclude: Optional[List[str]], profiles_dir: Optional[Path]) -> None:
+    from cli import run_dbt
+
+    returncode = run_dbt(select, exclude, profiles_dir=profiles_dir)
+    if returncode != 0:
+        raise RuntimeError(f"dbt run fallito (codice {returncode})")
+
+
+def backfill(
+    db_path: Path = DB_PATH,
+    data_dir: Path = DATA_DIR,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    restart: bool = False,
+    memory_limit: Optional[str] = None,
+    profiles_dir: Optional[Path] = None,
+    plan_only: bool = False,
+) -> List[Chunk]:
+    """
+    Esegue (o con plan_only stampa) il piano a blocchi mensili, saltando i passi già conclusi.
+    Un errore interrompe il backfill: il rilancio riprende dal passo fallito.
+    """
+    chunks = plan_chunks(data_dir, start, end)
+    if restart and not plan_only:
+        clear_checkpoints(db_path)
+    done = set() if restart else completed_steps(db_path)
+
+    steps = [(SETUP, "dbt")] + [(c.name, s) for c in chunks for s in ("ods", "datamart")] + [(FINALIZE, "dbt")]
+    pending = [s for s in steps if s not in done]
+    total_raw = sum(c.raw_rows for c in chunks)
+    print(f"Backfill di {len(chunks)} mesi ({total_raw:,} righe raw): "
+          f"{len(steps) - len(pending)} passi su {len(steps)} già conclusi.")
+    if plan_only:
+        for c in chunks:
+            status = "fatto" if (c.name, "datamart") in done else "ods fatto" if (c.name, "ods") in done else "da fare"
+            print(f"  {c.name}: {c.raw_rows:>12,} righe raw  {status}")
+        return chunks
+
+    t0 = time.perf_counter()
+    if (SETUP, "dbt") not in done:
+        t = time.perf_counter()
+        _dbt(None, [f"{ODS_TABLE}+"], profiles_dir)
+        record_step(db_path, SETUP, "dbt", 0, time.perf_counter() - t)
+
+    # throughput sulle righe raw dei blocchi eseguiti in questo run (non di quelli saltati)
+    raw_done, run_s = 0, 0.0
+    remaining_raw = sum(c.raw_rows for c in chunks if (c.name, "datamart") not in done)
+    for c in chunks:
+        if (c.name, "datamart") in done:
+            continue
+        t = time.perf_counter()
+        rows = c.raw_rows
+        if (c.name, "ods") not in done:
+            results = build_ods_parallel(db_path, data_dir, months=[c.month], workers=1, memory_limit=memory_limit)
+            rows = sum(r.rows for r in results)
+            record_step(db_path, c.name, "ods", rows, time.perf_counter() - t)
+        t_dm = time.perf_counter()
+        # la catena a valle è incrementale: lavora solo sulle righe ODS appena caricate
+        _dbt([f"{ODS_TABLE}+"], [ODS_TABLE, *FULL_REBUILD_MODELS], profiles_dir)
+        record_step(db_path, c.name, "datamart", rows, time.perf_counter() - t_dm)
+
+        elapsed = time.perf_counter() - t
+        raw_done += c.raw_rows
+        run_s += elapsed
+        remaining_raw -= c.raw_rows
+        rate = raw_done / run_s if run_s else 0.0
+        eta = _format_eta(remaining_raw / rate) if rate else "?"
+        print(f"[{c.name}] {rows:,} righe in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:,.0f} righe/s); "
+              f"ETA {eta} per {remaining_raw:,} righe raw rimanenti")
+
+    if (FINALIZE, "dbt") not in done:
+        t = time.perf_counter()
+        _dbt(FULL_REBUILD_MODELS, None, profiles_dir)
+        record_step(db_path, FINALIZE, "dbt", 0, time.perf_counter() - t)
+    print(f"Backfill completato in {_format_eta(time.perf_counter() - t0)}.")
+    return chunks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Backfill storico a blocchi mensili, riprendibile.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--from", dest="start", type=_parse_month, default=None, help="primo mese (YYYY-MM)")
+    parser.add_argument("--to", dest="end", type=_parse_month, default=None, help="ultimo mese (YYYY-MM)")
+    parser.add_argument("--restart", action="store_true", help="ignora i checkpoint e riparte dall'inizio")
+    parser.add_argument("--memory-limit", default=None, help="memory_limit DuckDB del build ODS (es. 4GB)")
+    parser.add_argument("--profiles-dir", type=Path, default=None)
+    parser.add_argument("--plan", action="store_true", help="stampa il piano e lo stato, senza eseguire")
+    args = parser.parse_args()
+    backfill(
+        db_path=args.db,
+        data_dir=args.data_dir,
+        start=args.start,
+        end=args.end,
+        restart=args.restart,
+        memory_limit=args.memory_limit,
+        profiles_dir=args.profiles_dir,
+        plan_only=args.plan,
+    )
+
+
+if __name__ == "__main__":
+    main()
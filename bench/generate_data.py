@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import argparse
+import shutil
+from pathlib import Path
+from typing import List, Tuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+REPO_DATA_DIR = BASE_DIR / "data"
+
+# Stesse cartelle lette da init_duckdb.init_weather
+WEATHER_DIRS = {
+    "Manhattan": "Weather_Manhattan",
+    "Brooklyn": "Weather_Brooklyn",
+    "Bronx": "Weather_Bronx",
+    "Queens": "Weather_Queens",
+    "Staten Island": "Weather_StatenIsland",
+    "EWR": "Weather_EWR",
+}
+WEATHER_COORDS = {
+    "Manhattan": (40.78, -73.97),
+    "Brooklyn": (40.65, -73.95),
+    "Bronx": (40.84, -73.86),
+    "Queens": (40.73, -73.79),
+    "Staten Island": (40.58, -74.15),
+    "EWR": (40.69, -74.17),
+}
+
+# Peso relativo dei pickup per borough (ordine di grandezza dei dati TLC yellow)
+BOROUGH_WEIGHTS = {
+    "Manhattan": 0.85, "Queens": 0.09, "Brooklyn": 0.04, "Bronx": 0.01,
+    "Staten Island": 0.002, "EWR": 0.002, "Unknown": 0.004, "N/A": 0.002,
+}
+# Distribuzione oraria dei pickup (0..23)
+HOUR_WEIGHTS = np.array([
+    3.0, 2.0, 1.3, 0.9, 0.7, 0.8, 1.8, 3.2, 4.2, 4.4, 4.5, 4.8,
+    5.1, 5.2, 5.6, 5.9, 6.0, 6.3, 6.6, 6.2, 5.6, 5.3, 5.0, 4.0,
+])
+
+TRIP_COLUMNS = [
+    "VendorID", "tpep_pickup_datetime", "tpep_dropoff_datetime", "passenger_count",
+    "trip_distance", "RatecodeID", "store_and_fwd_flag", "PULocationID", "DOLocationID",
+    "payment_type", "fare_amount", "extra", "mta_tax", "tip_amount", "tolls_amount",
+    "improvement_surcharge", "total_amount", "congestion_surcharge", "Airport_fee",
+]
+WEATHER_COLUMNS = [
+    "time", "temperature_2m (°C)", "relative_humidity_2m (%)", "apparent_temperature (°C)",
+    "rain (mm)", "snowfall (cm)", "wind_speed_10m (km/h)",
+]
+
+
+def month_range(start: str, months: int) -> List[Tuple[int, int]]:
+    """'2024-01', 3 -> [(2024, 1), (2024, 2), (2024, 3)]"""
+    year, month = (int(x) for x in start.split("-"))
+    out = []
+    for _ in range(months):
+        out.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return out
+
+
+def _rng(seed: int, year: int, month: int, stream: int) -> np.random.Generator:
+    # un generatore per (mese, flusso): ogni file è riproducibile da solo
+    return np.random.default_rng([seed, year, month, stream])
+
+
+def _zone_weights(zones: pd.DataFrame) -> np.ndarray:
+    counts = zones["Borough"].value_counts()
+    w = zones["Borough"].map(lambda b: BOROUGH_WEIGHTS.get(b, 0.001) / counts[b]).to_numpy(dtype=float)
+    # qualche zona molto più frequentata delle altre (code lunghe come nei dati reali)
+    w *= np.random.default_rng(0).pareto(2.0, len(w)) + 0.2
+    return w / w.sum()
+
+
+def generate_trips(
+    year: int,
+    month: int,
+    n_trips: int,
+    zones: pd.DataFrame,
+    seed: int,
+    part: int = 0,
+) -> pd.DataFrame:
+    """Un blocco di trip con lo schema dei parquet TLC yellow (colonne lette da ods_taxi_trip)."""
+    rng = _rng(seed, year, month, 100 + part)
+    loc_ids = zones["LocationID"].to_numpy()
+    zone_p = _zone_weights(zones)
+
+    start = pd.Timestamp(year=year, month=month, day=1)
+    days = start.days_in_month
+    day = rng.integers(0, days, n_trips)
+    hour = rng.choice(24, n_trips, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    second = rng.integers(0, 3600, n_trips)
+    pickup_s = start.value // 10**9 + day * 86400 + hour * 3600 + second
+
+    distance = np.round(np.clip(rng.lognormal(0.55, 0.85, n_trips), 0.0, 150.0), 2)
+    # velocità media più bassa nelle ore di punta
+    speed_kmh = np.where((hour >= 7) & (hour <= 19), 14.0, 22.0) * rng.lognormal(0.0, 0.25, n_trips)
+    duration_s = np.maximum(60, distance * 1.609 / speed_kmh * 3600 + rng.integers(0, 240, n_trips))
+    dropoff_s = pickup_s + duration_s.astype(np.int64)
+
+    vendor = rng.choice([1, 2, 6, 7], n_trips, p=[0.27, 0.72, 0.005, 0.005]).astype(np.int32)
+    ratecode = rng.choice([1, 2, 3, 4, 5, 99], n_trips, p=[0.93, 0.04, 0.005, 0.003, 0.012, 0.01])
+    payment = rng.choice([0, 1, 2, 3, 4], n_trips, p=[0.03, 0.78, 0.15, 0.02, 0.02])
+    pu = rng.choice(loc_ids, n_trips, p=zone_p).astype(np.int32)
+    do = rng.choice(loc_ids, n_trips, p=zone_p).astype(np.int32)
+
+    fare = np.round(3.0 + distance * 2.5 + duration_s / 60 * 0.5, 2)
+    extra = np.where((hour >= 16) & (hour <= 19), 2.5, np.where(hour >= 20, 1.0, 0.0))
+    tip = np.where(payment == 1, np.round(fare * rng.uniform(0.0, 0.3, n_trips), 2), 0.0)
+    tolls = np.where(rng.random(n_trips) < 0.05, 6.94, 0.0)
+    airport_fee = np.where(np.isin(pu, (132, 138)), 1.75, 0.0)
+    congestion = np.where(rng.random(n_trips) < 0.9, 2.5, 0.0)
+    total = np.round(fare + extra + 0.5 + tip + tolls + 1.0 + congestion + airport_fee, 2)
+
+    passengers = rng.choice([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, np.nan], n_trips,
+                            p=[0.72, 0.14, 0.04, 0.02, 0.03, 0.02, 0.03])
+
+    return pd.DataFrame({
+        "VendorID": vendor,
+        "tpep_pickup_datetime": pd.to_datetime(pickup_s, unit="s"),
+        "tpep_dropoff_datetime": pd.to_datetime(dropoff_s, unit="s"),
+        "passenger_count": passengers,
+        "trip_distance": distance,
+        "RatecodeID": ratecode.astype(float),
+        "store_and_fwd_flag": np.where(rng.random(n_trips) < 0.005, "Y", "N"),
+        "PULocationID": pu,
+        "DOLocationID": do,
+        "payment_type": payment.astype(np.int64),
+        "fare_amount": fare,
+        "extra": extra,
+        "mta_tax": np.full(n_trips, 0.5),
+        "tip_amount": tip,
+        "tolls_amount": tolls,
+        "improvement_surcharge": np.full(n_trips, 1.0),
+        "total_amount": total,
+        "congestion_surcharge": congestion,
+        "Airport_fee": airport_fee,
+    })[TRIP_COLUMNS]
+
+
+def generate_weather(year: int, month: int, borough: str, seed: int) -> pd.DataFrame:
+    """Dati orari di un mese nel formato CSV di Open-Meteo (colonne lette da ods_weather_dt)."""
+    rng = _rng(seed, year, month, 1 + list(WEATHER_DIRS).index(borough))
+    start = pd.Timestamp(year=year, month=month, day=1)
+    times = pd.date_range(start, start + pd.offsets.MonthBegin(1), freq="h", inclusive="left")
+    n = len(times)
+    doy = times.dayofyear.to_numpy()
+    hod = times.hour.to_numpy()
+
+    temp = (12.5 - 12.0 * np.cos(2 * np.pi * (doy - 20) / 365.25)
+            - 3.5 * np.cos(2 * np.pi * (hod - 3) / 24) + rng.normal(0, 2.0, n))
+    wind = np.clip(rng.gamma(2.2, 6.0, n), 0, 90)
+    humidity = np.clip(rng.normal(65, 15, n), 15, 100)
+    # precipitazione a episodi: pochi giorni bagnati, ore consecutive
+    wet_day = np.repeat(rng.random(n // 24 + 1) < 0.3, 24)[:n]
+    precip = np.where(wet_day & (rng.random(n) < 0.35), rng.gamma(0.8, 2.0, n), 0.0)
+    snow = np.where(temp < 0.5, precip * 0.7, 0.0)
+    rain = np.where(temp < 0.5, 0.0, precip)
+    apparent = temp - 0.08 * wind + 0.02 * (humidity - 50)
+
+    return pd.DataFrame({
+        "time": times.strftime("%Y-%m-%dT%H:%M"),
+        "temperature_2m (°C)": np.round(temp, 1),
+        "relative_humidity_2m (%)": np.round(humidity).astype(int),
+        "apparent_temperature (°C)": np.round(apparent, 1),
+        "rain (mm)": np.round(rain, 2),
+        "snowfall (cm)": np.round(snow, 2),
+        "wind_speed_10m (km/h)": np.round(wind, 1),
+    })[WEATHER_COLUMNS]
+
+
+def write_weather_csv(df: pd.DataFrame, path: Path, borough: str, seed: int) -> None:
+    # intestazione di 3 righe come negli export Open-Meteo (init_weather usa skip=3).
+    # La terza riga non è vuota: alcune versioni di DuckDB non contano le righe vuote in skip.
+    lat, lon = WEATHER_COORDS[borough]
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        fh.write("latitude,longitude,elevation,utc_offset_seconds,timezone,timezone_abbreviation\n")
+        fh.write(f"{lat},{lon},10.0,0,GMT,GMT\n")
+        fh.write(f"# dati sintetici (bench/generate_data.py) seed={seed}\n")
+        df.to_csv(fh, index=False)
+
+
+def write_parquet(df: pd.DataFrame, path: Path) -> None:
+    con = duckdb.connect()
+    try:
+        con.register("trips", df)
+        con.execute(f"COPY trips TO '{path.as_posix()}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+    finally:
+        con.close()
+
+
+def copy_dictionaries(out_dir: Path) -> None:
+    """Zone e dizionari (vendor, ratecode, payment_type) sono piccoli: si copiano quelli del repo."""
+    (out_dir / "zones").mkdir(parents=True, exist_ok=True)
+    (out_dir / "taxi_trip").mkdir(parents=True, exist_ok=True)
+    for name in ("borough.csv", "taxi_zone_lookup.csv"):
+        shutil.copy2(REPO_DATA_DIR / "zones" / name, out_dir / "zones" / name)
+    for name in ("vendor_id.csv", "ratecode_id.csv", "payment_type.csv"):
+        shutil.copy2(REPO_DATA_DIR / "taxi_trip" / name, out_dir / "taxi_trip" / name)
+
+
+def generate_month(
+    out_dir: Path,
+    year: int,
+    month: int,
+    n_trips: int,
+    seed: int = 42,
+    chunk_rows: int = 5_000_000,
+) -> int:
+    """Scrive trip e meteo di un mese; ritorna il numero di trip scritti."""
+    zones = pd.read_csv(out_dir / "zones" / "taxi_zone_lookup.csv", keep_default_na=False)
+    trip_dir = out_dir / "taxi_trip"
+    n_parts = max(1, -(-n_trips // chunk_rows))
+    for part in range(n_parts):
+        rows = n_trips // n_parts + (1 if part < n_trips % n_parts else 0)
+        suffix = "" if n_parts == 1 else f"_part{part:02d}"
+        df = generate_trips(year, month, rows, zones, seed, part)
+        write_parquet(df, trip_dir / f"yellow_tripdata_{year}-{month:02d}{suffix}.parquet")
+
+    for borough, folder in WEATHER_DIRS.items():
+        weather_dir = out_dir / "weather_dt" / folder
+        weather_dir.mkdir(parents=True, exist_ok=True)
+        write_weather_csv(
+            generate_weather(year, month, borough, seed),
+            weather_dir / f"open-meteo_{year}-{month:02d}.csv",
+            borough,
+            seed,
+        )
+    return n_trips
+
+
+def generate(
+    out_dir: Path,
+    trips: int,
+    start: str = "2024-01",
+    months: int = 12,
+    seed: int = 42,
+    chunk_rows: int = 5_000_000,
+) -> List[Tuple[int, int]]:
+    """
+    Genera un data dir completo (stessa struttura di data/) con `trips` trip
+    distribuiti sui mesi in proporzione ai giorni. Stesso seed -> stessi file.
+    """
+    out_dir = Path(out_dir)
+    copy_dictionaries(out_dir)
+    periods = month_range(start, months)
+    days = np.array([pd.Timestamp(year=y, month=m, day=1).days_in_month for y, m in periods])
+    per_month = np.floor(trips * days / days.sum()).astype(int)
+    per_month[: trips - per_month.sum()] += 1
+    for (year, month), n in zip(periods, per_month):
+        generate_month(out_dir, year, month, int(n), seed, chunk_rows)
+        print(f"  {year}-{month:02d}: {n:,} trip")
+    return periods
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Genera dati sintetici TLC/Open-Meteo per i benchmark.")
+    parser.add_argument("--out", type=Path, required=True, help="data dir di output (struttura di data/)")
+    parser.add_argument("--scale-factor", type=float, default=1.0, help="1 = 1M trip")
+    parser.add_argument("--start", default="2024-01", help="primo mese (YYYY-MM)")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-rows", type=int, default=5_000_000, help="righe max per file parquet")
+    args = parser.parse_args()
+
+    trips = int(args.scale_factor * 1_000_000)
+    print(f"Generazione di {trips:,} trip in {args.out} ...")
+    generate(args.out, trips, args.start, args.months, args.seed, args.chunk_rows)
+    print("Fine generazione.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+from __future__ import annotations
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import duckdb
+
+BASE_DIR = Path(__file__).resolve().parents[1]
+# init_duckdb.py è nel root, le classi dei grafici in plots/ (import per nome modulo)
+sys.path[:0] = [str(BASE_DIR), str(BASE_DIR / "plots")]
+
+import init_duckdb  # noqa: E402
+from generate_data import generate, generate_month, month_range  # noqa: E402
+
+DBT_PROJECT_DIR = BASE_DIR / "dwh"
+PROFILE_TEMPLATE = """\
+dwh:
+  target: bench
+  outputs:
+    bench:
+      type: duckdb
+      path: "{db_path}"
+      schema: dwh
+      threads: {threads}
+"""
+
+
+def _timed(fn: Callable, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+
+# ----------------------------
+# DATI
+# ----------------------------
+
+def prepare_data(work_dir: Path, scale_factor: float, start: str, months: int, seed: int) -> Dict[str, Any]:
+    """Genera (o riusa, se i parametri coincidono) il data dir sintetico di uno scale factor."""
+    data_dir = work_dir / f"sf{scale_factor:g}" / "data"
+    params = {"scale_factor": scale_factor, "start": start, "months": months, "seed": seed}
+    params_file = data_dir / "params.json"
+    if params_file.exists() and json.loads(params_file.read_text()) == params:
+        return {"data_dir": data_dir, "generate_s": None, "cached": True}
+
+    if data_dir.exists():
+        shutil.rmtree(data_dir)
+    _, elapsed = _timed(generate, data_dir, int(scale_factor * 1_000_000), start, months, seed)
+    params_file.write_text(json.dumps(params))
+    return {"data_dir": data_dir, "generate_s": round(elapsed, 3), "cached": False}
+
+
+def _remove_month(data_dir: Path, year: int, month: int) -> None:
+    pattern = f"*{year}-{month:02d}*"
+    for path in list((data_dir / "taxi_trip").glob(pattern + ".parquet")) + list(
+        (data_dir / "weather_dt").glob(f"*/{pattern}.csv")
+    ):
+        path.unlink()
+
+
+# ----------------------------
+# FASI MISURATE
+# ----------------------------
+
+def time_init(db_path: Path, data_dir: Path) -> Dict[str, float]:
+    timings = {}
+    con, timings["init_duckdb"] = _timed(init_duckdb.init_duckdb, db_path)
+    try:
+        for fn in (init_duckdb.init_zones, init_duckdb.init_taxi_trips,
+                   init_duckdb.init_weather, init_duckdb.init_files_dictionary):
+            _, timings[fn.__name__] = _timed(fn, con, data_dir)
+    finally:
+        con.close()
+    return {k: round(v, 4) for k, v in timings.items()}
+
+
+def run_dbt(db_path: Path, run_dir: Path, label: str, threads: int) -> Dict[str, Any]:
+    """
+    `dbt run` completo con un profiles.yml temporaneo che punta a `db_path`.
+    I tempi per modello vengono da run_results.json (nessun overhead di avvio per modello).
+    """
+    dbt = shutil.which("dbt")
+    if dbt is None:
+        return {"status": "skipped", "reason": "dbt non trovato nel PATH (pip install dbt-duckdb)"}
+
+    target_path = run_dir / f"dbt_target_{label}"
+    with tempfile.TemporaryDirectory() as profiles_dir:
+        Path(profiles_dir, "profiles.yml").write_text(
+            PROFILE_TEMPLATE.format(db_path=db_path.as_posix(), threads=threads)
+        )
+        cmd = [
+            dbt, "run",
+            "--project-dir", str(DBT_PROJECT_DIR),
+            "--profiles-dir", profiles_dir,
+            "--target-path", str(target_path),
+            "--log-path", str(run_dir / "dbt_logs"),
+        ]
+        proc, elapsed = _timed(subprocess.run, cmd, capture_output=True, text=True)
+
+    models: Dict[str, Any] = {}
+    results_file = target_path / "run_results.json"
+    if results_file.exists():
+        for res in json.loads(results_file.read_text()).get("results", []):
+            models[res["unique_id"].split(".")[-1]] = {
+                "status": res.get("status"),
+                "execution_time_s": round(res.get("execution_time") or 0.0, 4),
+                "rows_affected": (res.get("adapter_response") or {}).get("rows_affected"),
+            }
+    out = {"status": "ok" if proc.returncode == 0 else "error", "total_s": round(elapsed, 3), "models": models}
+    if proc.returncode != 0:
+        # i modelli saltati sono a valle di un errore: total_s non è il tempo della pipeline completa
+        failed = sorted(m for m, r in models.items() if r["status"] == "error")
+        skipped = sorted(m for m, r in models.items() if r["status"] == "skipped")
+        out["failed_models"] = failed
+        out["skipped_models"] = skipped
+        out["log_tail"] = proc.stdout[-4000:] + proc.stderr[-2000:]
+        print(f"  dbt run ({label}) fallito: errore in {', '.join(failed) or '?'}; "
+              f"{len(skipped)} modelli saltati (log in {run_dir / 'dbt_logs'})")
+    return out
+
+
+def table_rows(db_path: Path) -> Dict[str, int]:
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        tables = con.execute("""
+            SELECT schema_name, table_name FROM duckdb_tables()
+            WHERE schema_name IN ('dwh_ods', 'dwh_datamart')
+        """).fetchall()
+        return {
+            f"{s}.{t}": con.execute(f'SELECT COUNT(*) FROM "{s}"."{t}"').fetchone()[0]
+            for s, t in tables
+        }
+    finally:
+        con.close()
+
+
+def time_queries(db_path: Path, repeat: int) -> Dict[str, Any]:
+    """Tutte le query del registry (e la variante approx=True, dove esiste)."""
+    from chart_registry import QUERIES
+
+    results: Dict[str, Any] = {}
+    charts: Dict[tuple, Any] = {}
+    for spec in QUERIES:
+        key = (spec.module, spec.chart_class)
+        if key not in charts:
+            charts[key] = spec.build(db_filename=str(db_path), show=False)
+        method = getattr(charts[key], spec.method)
+        accepted = inspect.signature(method).parameters
+        kwargs = dict(spec.kwargs)
+        if "intensity_col" in accepted and "intensity_col" not in kwargs:
+            kwargs["intensity_col"] = "rain_intensity"
+
+        variants = [(spec.name, kwargs)]
+        if "approx" in accepted:
+            variants.append((f"{spec.name}[approx]", {**kwargs, "approx": True}))
+        for name, kw in variants:
+            times: List[float] = []
+            try:
+                for _ in range(repeat):
+                    df, elapsed = _timed(method, **kw)
+                    times.append(elapsed)
+                results[name] = {
+                    "status": "ok",
+                    "rows": len(df),
+                    "min_s": round(min(times), 4),
+                    "median_s": round(statistics.median(times), 4),
+                    "runs": len(times),
+                }
+            except Exception as exc:  # noqa: BLE001 - si registra e si prosegue
+                results[name] = {"status": "error", "error": f"{type(exc).__name__}: {exc}"}
+    return results
+
+
+# ----------------------------
+# ORCHESTRAZIONE
+# ----------------------------
+
+def bench_scale_factor(
+    scale_factor: float,
+    work_dir: Path,
+    start: str,
+    months: int,
+    seed: int,
+    threads: int,
+    repeat: int,
+    skip_dbt: bool,
+    keep_db: bool,
+) -> Dict[str, Any]:
+    run_dir = work_dir / f"sf{scale_factor:g}"
+    print(f"[sf={scale_factor:g}] dati sintetici...")
+    data = prepare_data(work_dir, scale_factor, start, months, seed)
+    data_dir = data["data_dir"]
+    result: Dict[str, Any] = {
+        "scale_factor": scale_factor,
+        "trips": int(scale_factor * 1_000_000),
+        "months": months,
+        "generate_s": data["generate_s"],
+        "data_cached": data["cached"],
+    }
+
+    db_path = run_dir / "taxi_trips.duckdb"
+    for stale in (db_path, db_path.with_name(db_path.name + ".wal")):
+        if stale.exists():
+            stale.unlink()
+
+    print(f"[sf={scale_factor:g}] init_duckdb...")
+    result["init_duckdb"] = time_init(db_path, data_dir)
+
+    if skip_dbt:
+        result["dbt_full"] = {"status": "skipped", "reason": "--skip-dbt"}
+    else:
+        print(f"[sf={scale_factor:g}] dbt run (full)...")
+        result["dbt_full"] = run_dbt(db_path, run_dir, "full", threads)
+        print(f"[sf={scale_factor:g}] dbt run (incrementale, nessun dato nuovo)...")
+        result["dbt_incremental_noop"] = run_dbt(db_path, run_dir, "noop", threads)
+
+        # un mese in più (stessa densità media) e rerun incrementale
+        year, month = month_range(start, months + 1)[-1]
+        extra = max(1, int(scale_factor * 1_000_000 / months))
+        print(f"[sf={scale_factor:g}] dbt run (incrementale, +{extra:,} trip in {year}-{month:02d})...")
+        _, result["generate_increment_s"] = _timed(generate_month, data_dir, year, month, extra, seed)
+        try:
+            result["init_duckdb_increment"] = time_init(db_path, data_dir)
+            result["dbt_incremental_month"] = run_dbt(db_path, run_dir, "month", threads)
+        finally:
+            # il data dir in cache resta quello dei parametri di params.json
+            _remove_month(data_dir, year, month)
+
+    if db_path.exists():
+        result["db_size_bytes"] = db_path.stat().st_size
+        result["table_rows"] = table_rows(db_path)
+        print(f"[sf={scale_factor:g}] query dei grafici (x{repeat})...")
+        result["queries"] = time_queries(db_path, repeat)
+        if not keep_db:
+            db_path.unlink()
+    return result
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline (init, dbt, query) su dati sintetici.")
+    parser.add_argument("--scale-factors", type=float, nargs="+", default=[1.0], help="1 = 1M trip (es. 1 10 100)")
+    parser.add_argument("--start", default="2024-01", help="primo mese dei dati (YYYY-MM)")
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 4, help="thread dbt")
+    parser.add_argument("--repeat", type=int, default=3, help="esecuzioni per query")
+    parser.add_argument("--work-dir", type=Path, default=BASE_DIR / "bench" / "work")
+    parser.add_argument("--out", type=Path, default=None, help="file JSON dei risultati")
+    parser.add_argument("--skip-dbt", action="store_true")
+    parser.add_argument("--keep-db", action="store_true", help="non cancellare il DuckDB a fine run")
+    args = parser.parse_args()
+
+    started = datetime.now()
+    report: Dict[str, Any] = {
+        "meta": {
+            "started_at": started.isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "duckdb": duckdb.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        },
+        "runs": [],
+    }
+    out = args.out or BASE_DIR / "bench" / "results" / f"bench_{started:%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+
+    for sf in args.scale_factors:
+        report["runs"].append(bench_scale_factor(
+            sf, args.work_dir, args.start, args.months, args.seed,
+            args.threads, args.repeat, args.skip_dbt, args.keep_db,
+        ))
+        # scritto dopo ogni scale factor: un run lungo interrotto lascia comunque i risultati parziali
+        out.write_text(json.dumps(report, indent=2))
+    print(f"Risultati in {out}")
+
+
+if __name__ == "__main__":
+    main()
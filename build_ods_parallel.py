@@ -0,0 +1,319 @@
+"""
+Build parallelo per mese di dwh_ods.ods_taxi_trip.
+
+`dbt run -s ods_taxi_trip` trasforma tutti i trip raw in un'unica query di un solo processo:
+su un backfill di più anni la durata e il picco di memoria crescono con l'intero storico.
+Qui il lavoro è diviso per mese di pickup:
+
+1. il processo principale legge l'elenco dei mesi dai parquet raw ed esporta la lookup
+   ods_neighborhood (piccola) in un parquet di staging;
+2. un pool di processi trasforma un mese per worker, ognuno con il proprio DuckDB in memoria,
+   applicando lo stesso SQL del modello dbt (dwh/models/ods/ods_taxi_trip.sql, senza Jinja)
+   e scrivendo una partizione `ods_taxi_trip_YYYY-MM.parquet`;
+3. solo se tutti i mesi sono andati a buon fine, le partizioni entrano in ods_taxi_trip con
+   un'unica transazione: tabella sostituita (build completo) oppure DELETE + INSERT dei soli
+   mesi richiesti (--months). In caso di errore la tabella resta quella di prima.
+
+La tabella ha le stesse colonne del modello dbt: i run incrementali successivi proseguono
+normalmente dal max(pickup_datetime) caricato. Su una ODS già caricata i trip ricostruiti
+mantengono il last_update di prima, così dm_fact_taxi_trip (append su ods_update_time) riceve
+solo i trip nuovi. Una correzione di trip già caricati (es. lookup dei quartieri cambiata)
+arriva quindi al datamart solo con `dbt run --full-refresh` dei modelli a valle.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date
+from pathlib import Path
+from typing import List, Optional
+
+import duckdb
+
+from init_duckdb import BASE_DIR, DATA_DIR, DB_PATH
+
+MODEL_PATH = BASE_DIR / "dwh" / "models" / "ods" / "ods_taxi_trip.sql"
+STAGING_DIR = BASE_DIR / "staging" / "ods_taxi_trip"
+ODS_SCHEMA = "dwh_ods"
+ODS_TABLE = "ods_taxi_trip"
+NEIGHBORHOOD_FILE = "ods_neighborhood.parquet"
+# stesso limite inferiore del modello dbt (tpep_pickup_datetime >= '2000-01-01')
+MIN_PICKUP = "2000-01-01"
+
+
+@dataclass
+class MonthResult:
+    month: date
+    path: Path
+    rows: int
+    elapsed_s: float
+
+
+def render_model_sql(source_relation: str, neighborhood_relation: str) -> str:
+    """
+    SQL del modello ods_taxi_trip senza Jinja: config e blocco is_incremental() rimossi,
+    source/ref sostituiti dalle relazioni del worker. Il modello resta l'unica definizione
+    della trasformazione: se cambia, il build parallelo lo segue.
+    """
+    sql = MODEL_PATH.read_text(encoding="utf-8")
+    sql = re.sub(r"\{\{\s*config\(.*?\)\s*\}\}", "", sql, flags=re.S)
+    sql = re.sub(r"\{%\s*if is_incremental\(\)\s*%\}.*?\{%\s*endif\s*%\}", "", sql, flags=re.S)
+    sql = re.sub(r"\{\{\s*source\(\s*'raw'\s*,\s*'taxi_trip'\s*\)\s*\}\}", source_relation, sql)
+    sql = re.sub(r"\{\{\s*ref\(\s*'ods_neighborhood'\s*\)\s*\}\}", neighborhood_relation, sql)
+    if "{{" in sql or "{%" in sql:
+        raise ValueError(f"Jinja non gestito in {MODEL_PATH.name}: aggiornare render_model_sql")
+    return sql
+
+
+def _month_bounds(month: date) -> tuple:
+    nxt = date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+    return month.isoformat(), nxt.isoformat()
+
+
+def _parse_month(value: str) -> date:
+    try:
+        year, month = value.split("-")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"mese non valido: {value!r} (atteso YYYY-MM)")
+
+
+# ----------------------------
+# PREPARAZIONE (processo principale)
+# ----------------------------
+
+def list_months(raw_glob: str) -> List[date]:
+    """Mesi di pickup presenti nei parquet raw (solo la colonna del pickup viene letta)."""
+    con = duckdb.connect()
+    try:
+        rows = con.execute(f"""
+            SELECT DISTINCT CAST(date_trunc('month', tpep_pickup_datetime) AS DATE) AS month
+            FROM read_parquet('{raw_glob}')
+            WHERE tpep_pickup_datetime >= TIMESTAMP '{MIN_PICKUP}'
+            ORDER BY month
+        """).fetchall()
+    finally:
+        con.close()
+    return [r[0] for r in rows]
+
+
+def export_neighborhood(db_path: Path, staging_dir: Path) -> Path:
+    """Copia di ods_neighborhood per i worker (il DuckDB principale non va aperto da più processi)."""
+    out = staging_dir / NEIGHBORHOOD_FILE
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        exists = con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = ? AND table_name = 'ods_neighborhood'",
+            [ODS_SCHEMA],
+        ).fetchone()[0]
+        if not exists:
+            raise RuntimeError(
+                f"{ODS_SCHEMA}.ods_neighborhood non esiste: eseguire prima `dbt run -s +ods_neighborhood`"
+            )
+        con.execute(f"""
+            COPY (SELECT id_neighborhood, borough_fk FROM {ODS_SCHEMA}.ods_neighborhood)
+            TO '{out.as_posix()}' (FORMAT PARQUET)
+        """)
+    finally:
+        con.close()
+    return out
+
+
+# ----------------------------
+# WORKER
+# ----------------------------
+
+def build_month(
+    month: date,
+    raw_glob: str,
+    neighborhood_path: str,
+    staging_dir: str,
+    threads: int,
+    memory_limit: Optional[str],
+) -> MonthResult:
+    """Trasforma i trip di un mese di pickup e li scrive in una partizione parquet."""
+    t0 = time.perf_counter()
+    start, end = _month_bounds(month)
+    out = Path(staging_dir) / f"{ODS_TABLE}_{month:%Y-%m}.parquet"
+    tmp = out.with_suffix(".parquet.tmp")
+
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET threads = {threads}")
+        if memory_limit:
+            con.execute(f"SET memory_limit = '{memory_limit}'")
+        # filtro sul pickup spinto nello scan: si leggono solo i row group del mese
+        con.execute(f"""
+            CREATE VIEW raw_month AS
+            SELECT *
+            FROM read_parquet('{raw_glob}')
+            WHERE tpep_pickup_datetime >= TIMESTAMP '{start}'
+              AND tpep_pickup_datetime < TIMESTAMP '{end}'
+        """)
+        con.execute(f"CREATE TABLE lookup_neighborhood AS SELECT * FROM read_parquet('{neighborhood_path}')")
+        sql = render_model_sql("raw_month", "lookup_neighborhood")
+        # ordinato per pickup: zone map utili al filtro incrementale e al DELETE per mese
+        con.execute(f"""
+            COPY (SELECT * FROM ({sql}) ORDER BY pickup_datetime)
+            TO '{tmp.as_posix()}' (FORMAT PARQUET)
+        """)
+        rows = con.execute(f"SELECT COUNT(*) FROM read_parquet('{tmp.as_posix()}')").fetchone()[0]
+    finally:
+        con.close()
+    os.replace(tmp, out)
+    return MonthResult(month, out, rows, time.perf_counter() - t0)
+
+
+# ----------------------------
+# SWAP NELLA ODS
+# ----------------------------
+
+def swap_into_ods(db_path: Path, results: List[MonthResult], replace_months: bool) -> int:
+    """
+    Carica le partizioni in dwh_ods.ods_taxi_trip in un'unica transazione.
+    - replace_months=False: la tabella viene sostituita per intero (CREATE OR REPLACE);
+    - replace_months=True: solo i mesi elaborati (DELETE + INSERT BY NAME), il resto non cambia.
+
+    I trip già presenti (stesso id_trip) mantengono il loro last_update: dm_fact_taxi_trip è
+    incrementale in append su ods_update_time, e un last_update nuovo li farebbe accodare
+    una seconda volta al run dbt successivo. Solo i trip nuovi arrivano al datamart.
+    """
+    files = ", ".join(f"'{r.path.as_posix()}'" for r in sorted(results, key=lambda r: r.month))
+    con = duckdb.connect(str(db_path))
+    try:
+        con.execute(f"CREATE SCHEMA IF NOT EXISTS {ODS_SCHEMA}")
+        exists = con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?",
+            [ODS_SCHEMA, ODS_TABLE],
+        ).fetchone()[0]
+        rebuilt = "TRUE"
+        if replace_months:
+            rebuilt = " OR ".join(
+                f"(pickup_datetime >= TIMESTAMP '{start}' AND pickup_datetime < TIMESTAMP '{end}')"
+                for start, end in (_month_bounds(r.month) for r in results)
+            )
+        new_rows = f"SELECT * FROM read_parquet([{files}])"
+        con.execute("BEGIN TRANSACTION")
+        try:
+            if exists:
+                con.execute(f"""
+                    CREATE TEMP TABLE ods_previous AS
+                    SELECT id_trip, MIN(last_update) AS last_update
+                    FROM {ODS_SCHEMA}.{ODS_TABLE}
+                    WHERE {rebuilt}
+                    GROUP BY id_trip
+                """)
+                new_rows = f"""
+                    SELECT n.* REPLACE (COALESCE(p.last_update, n.last_update) AS last_update)
+                    FROM read_parquet([{files}]) n
+                    LEFT JOIN ods_previous p ON n.id_trip = p.id_trip
+                """
+            if replace_months and exists:
+                con.execute(f"DELETE FROM {ODS_SCHEMA}.{ODS_TABLE} WHERE {rebuilt}")
+                con.execute(f"INSERT INTO {ODS_SCHEMA}.{ODS_TABLE} BY NAME {new_rows}")
+            else:
+                con.execute(f"CREATE OR REPLACE TABLE {ODS_SCHEMA}.{ODS_TABLE} AS {new_rows}")
+            total = con.execute(f"SELECT COUNT(*) FROM {ODS_SCHEMA}.{ODS_TABLE}").fetchone()[0]
+            con.execute("DROP TABLE IF EXISTS ods_previous")
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        con.close()
+    return total
+
+
+# ----------------------------
+# ORCHESTRAZIONE
+# ----------------------------
+
+def build_ods_parallel(
+    db_path: Path = DB_PATH,
+    data_dir: Path = DATA_DIR,
+    months: Optional[List[date]] = None,
+    workers: Optional[int] = None,
+    threads_per_worker: Optional[int] = None,
+    memory_limit: Optional[str] = None,
+    staging_dir: Path = STAGING_DIR,
+    keep_staging: bool = False,
+) -> List[MonthResult]:
+    raw_glob = (data_dir / "taxi_trip" / "*.parquet").as_posix()
+    available = list_months(raw_glob)
+    selected = available if months is None else [m for m in available if m in set(months)]
+    missing = [] if months is None else sorted(set(months) - set(available))
+    if missing:
+        print(f"Mesi senza trip nei dati raw (ignorati): {', '.join(f'{m:%Y-%m}' for m in missing)}")
+    if not selected:
+        print("Nessun mese da elaborare.")
+        return []
+
+    workers = max(1, min(workers or os.cpu_count() or 1, len(selected)))
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+
+    if staging_dir.exists():
+        shutil.rmtree(staging_dir)
+    staging_dir.mkdir(parents=True)
+    neighborhood = export_neighborhood(db_path, staging_dir)
+
+    print(f"Build di {ODS_SCHEMA}.{ODS_TABLE}: {len(selected)} mesi, {workers} worker x {threads} thread")
+    t0 = time.perf_counter()
+    results: List[MonthResult] = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(build_month, m, raw_glob, neighborhood.as_posix(),
+                            str(staging_dir), threads, memory_limit): m
+                for m in selected
+            }
+            for fut in as_completed(futures):
+                res = fut.result()
+                results.append(res)
+                print(f"  {res.month:%Y-%m}: {res.rows:,} righe in {res.elapsed_s:.1f}s")
+
+        t_swap = time.perf_counter()
+        total = swap_into_ods(db_path, results, replace_months=months is not None)
+        # i mesi riscritti invalidano i Bloom filter del caricamento incrementale
+        from ods_trip_dedup import invalidate
+        invalidate(r.month for r in results)
+        print(f"Swap in {ODS_SCHEMA}.{ODS_TABLE}: {time.perf_counter() - t_swap:.1f}s "
+              f"({total:,} righe totali)")
+    finally:
+        if not keep_staging:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f"Fine build parallelo in {time.perf_counter() - t0:.1f}s.")
+    return sorted(results, key=lambda r: r.month)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build parallelo per mese di dwh_ods.ods_taxi_trip.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--months", type=_parse_month, nargs="+", default=None,
+                        help="ricostruisce solo questi mesi (YYYY-MM); senza, tabella intera")
+    parser.add_argument("--workers", type=int, default=None, help="processi (default: numero di CPU)")
+    parser.add_argument("--threads-per-worker", type=int, default=None)
+    parser.add_argument("--memory-limit", default=None, help="memory_limit DuckDB per worker (es. 2GB)")
+    parser.add_argument("--staging-dir", type=Path, default=STAGING_DIR)
+    parser.add_argument("--keep-staging", action="store_true", help="non cancellare le partizioni parquet")
+    args = parser.parse_args()
+
+    build_ods_parallel(
+        db_path=args.db,
+        data_dir=args.data_dir,
+        months=args.months,
+        workers=args.workers,
+        threads_per_worker=args.threads_per_worker,
+        memory_limit=args.memory_limit,
+        staging_dir=args.staging_dir,
+        keep_staging=args.keep_staging,
+    )
+
+
+if __name__ == "__main__":
+    main()
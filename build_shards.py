@@ -0,0 +1,137 @@
+"""
+Shard Parquet di dm_trip_narrow per anno (o mese) di pickup, per le query scatter-gather.
+
+Le query esatte dei grafici leggono dm_trip_narrow da un solo file DuckDB, in un solo
+processo. Con `ChartBase(use_shards=True)` le aggregazioni pesanti vengono invece scomposte
+in aggregati parziali per shard, eseguiti in un pool di processi e uniti
+(plots/sharded.py). Questo script prepara gli shard:
+
+    shards/<db>/dm_trip_narrow/<anno>.parquet        (--by year, default)
+    shards/<db>/dm_trip_narrow/<anno>-<mese>.parquet (--by month)
+    shards/<db>/dm_trip_narrow/unknown.parquet       (trip senza data di pickup)
+    shards/<db>/dm_trip_narrow/manifest.json
+
+Ogni shard è ordinato per (key_date_pickup, key_zone_pickup), con statistiche min/max per row
+group; il manifest tiene l'intervallo di key_date_pickup di ogni shard (gli shard fuori dal
+periodo del filtro non vengono letti) e un'impronta (righe, max key_taxi_trip, checksum di
+key_weather/outlier_flags): a ogni run si riscrivono solo gli shard cambiati.
+Sono file Parquet semplici: i worker possono girare anche su altre macchine che vedono
+la stessa cartella.
+"""
+from __future__ import annotations
+
+import argparse
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import duckdb
+
+from export_parquet import _copy_to_parquet, read_manifest, write_manifest
+from init_duckdb import BASE_DIR, DB_PATH
+
+SHARD_DIR = BASE_DIR / "shards"
+SCHEMA = "dwh_datamart"
+TABLE = "dm_trip_narrow"
+SHARD_ORDER = "key_date_pickup, key_zone_pickup"
+# granularità -> espressione della chiave di shard su dm_trip_narrow
+SHARD_KEYS = {
+    "year": "COALESCE(year::VARCHAR, 'unknown')",
+    "month": "COALESCE(strftime(pickup_date, '%Y-%m'), 'unknown')",
+}
+
+
+def shard_dir(db_path: Path, root: Path = SHARD_DIR) -> Path:
+    return root / db_path.stem / TABLE
+
+
+def shard_fingerprints(con: duckdb.DuckDBPyConnection, by: str) -> Dict[str, Dict]:
+    # hash(hash(...)): come in export_parquet.fact_fingerprints, un cambio ripetuto su un numero
+    # pari di righe non deve annullarsi nello XOR; plots/chart_base.py usa la stessa impronta
+    rows = con.execute(f"""
+        SELECT
+            {SHARD_KEYS[by]} AS shard,
+            COUNT(*) AS n,
+            MAX(key_taxi_trip) AS max_key,
+            bit_xor(hash(hash(key_taxi_trip, key_weather, outlier_flags))) AS checksum,
+            MIN(key_date_pickup) AS min_date_key,
+            MAX(key_date_pickup) AS max_date_key
+        FROM {SCHEMA}.{TABLE}
+        GROUP BY ALL
+    """).fetchall()
+    return {
+        shard: {"fingerprint": [int(n), int(k), int(c)], "min_date_key": int(lo), "max_date_key": int(hi)}
+        for shard, n, k, c, lo, hi in rows
+    }
+
+
+def build_shards(
+    db_path: Path = DB_PATH,
+    root: Path = SHARD_DIR,
+    by: str = "year",
+    full: bool = False,
+) -> Dict:
+    """Scrive (incrementalmente, salvo full=True) gli shard di dm_trip_narrow; ritorna il manifest."""
+    if by not in SHARD_KEYS:
+        raise ValueError(f"by deve essere uno di {list(SHARD_KEYS)}")
+    t0 = time.perf_counter()
+    db_path = db_path.resolve()
+    out_dir = shard_dir(db_path, root)
+    manifest = read_manifest(out_dir)
+    if full or manifest.get("by") != by:
+        shutil.rmtree(out_dir, ignore_errors=True)
+        manifest = {}
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shards = manifest.get("shards", {})
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    written: List[str] = []
+    try:
+        current = shard_fingerprints(con, by)
+        for key, info in sorted(current.items()):
+            path = out_dir / f"{key}.parquet"
+            entry = shards.get(key)
+            if entry is not None and entry["fingerprint"] == info["fingerprint"] and path.exists():
+                continue
+            rows = _copy_to_parquet(con, f"""
+                SELECT * FROM {SCHEMA}.{TABLE}
+                WHERE {SHARD_KEYS[by]} = '{key}'
+                ORDER BY {SHARD_ORDER}
+            """, path)
+            shards[key] = {"file": path.name, "rows": rows, **info}
+            written.append(key)
+        removed = sorted(set(shards) - set(current))
+        for key in removed:
+            (out_dir / shards.pop(key)["file"]).unlink(missing_ok=True)
+    finally:
+        con.close()
+
+    manifest = {
+        "table": TABLE,
+        "by": by,
+        "source": str(db_path),
+        "rows": sum(s["rows"] for s in shards.values()),
+        "max_key": max((s["fingerprint"][1] for s in shards.values()), default=-1),
+        "shards": shards,
+        "built_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    write_manifest(out_dir, manifest)
+    print(f"Shard in {out_dir} aggiornati in {time.perf_counter() - t0:.1f}s: "
+          f"{len(written)} riscritti, {len(removed)} rimossi, {len(shards) - len(written)} invariati.")
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Shard Parquet di dm_trip_narrow per le query scatter-gather.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--out", type=Path, default=SHARD_DIR, help="cartella radice degli shard")
+    parser.add_argument("--by", choices=list(SHARD_KEYS), default="year", help="granularità degli shard")
+    parser.add_argument("--full", action="store_true", help="riscrive tutti gli shard")
+    args = parser.parse_args()
+    build_shards(args.db, args.out, args.by, args.full)
+
+
+if __name__ == "__main__":
+    main()
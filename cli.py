@@ -0,0 +1,368 @@
+"""
+Punto di ingresso unico della pipeline.
+
+    python cli.py init                      # viste raw su data/ (init_duckdb.py)
+    python cli.py build [--score-outliers] [--publish] [--export] [--shards]
+    python cli.py query <nome> [--borough manhattan] [--exclude-outliers] [--shards] [--format csv]
+    python cli.py query --list
+    python cli.py sql "SELECT ..." [--format csv]
+    python cli.py report [--charts ...] [--combined]
+    python cli.py maintenance report|compact|checkpoint|copy
+    python cli.py backfill [--from 2019-01] [--to 2024-12] [--plan] [--restart]
+
+All'avvio si importa solo argparse: duckdb, pandas e plotly vengono caricati dai soli
+sottocomandi che li usano. `sql` stampa il risultato direttamente da DuckDB (niente pandas);
+`query` usa i metodi del registry: quelli che ritornano il risultato SQL così com'è
+(QuerySpec.sql_only) stampano le righe DuckDB senza importare pandas, gli altri (bootstrap,
+cubo, matrice OD, ...) elaborano un DataFrame. Solo `report` carica plotly.
+Pensato per i job schedulati che lanciano molte invocazioni brevi.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+BASE_DIR = Path(__file__).resolve().parent
+PLOTS_DIR = BASE_DIR / "plots"
+DBT_DIR = BASE_DIR / "dwh"
+DEFAULT_DB = "taxi_trips.duckdb"
+FORMATS = ["table", "csv", "json"]
+
+
+def _use_plots() -> None:
+    """I moduli di plots/ si importano tra loro come fratelli (from chart_base import ...)."""
+    if str(PLOTS_DIR) not in sys.path:
+        sys.path.insert(0, str(PLOTS_DIR))
+
+
+# ----------------------------
+# SOTTOCOMANDI
+# ----------------------------
+
+def cmd_init(args: argparse.Namespace) -> int:
+    from init_duckdb import init_duckdb, init_files_dictionary, init_taxi_trips, init_weather, init_zones
+
+    con = init_duckdb(BASE_DIR / args.db)
+    try:
+        init_zones(con, args.data_dir)
+        init_taxi_trips(con, args.data_dir)
+        init_weather(con, args.data_dir)
+        init_files_dictionary(con, args.data_dir)
+    finally:
+        con.close()
+    print(f"Viste raw create in {BASE_DIR / args.db}")
+    return 0
+
+
+def run_dbt(
+    select: Optional[List[str]] = None,
+    exclude: Optional[List[str]] = None,
+    full_refresh: bool = False,
+    dbt_vars: Optional[str] = None,
+    profiles_dir: Optional[Path] = None,
+) -> int:
+    """`dbt run` sul progetto dwh/; ritorna il codice di uscita (usato anche da refresh_watch.py)."""
+    command = ["dbt", "run", "--project-dir", str(DBT_DIR)]
+    if profiles_dir:
+        command += ["--profiles-dir", str(profiles_dir)]
+    if select:
+        command += ["--select", *select]
+    if exclude:
+        command += ["--exclude", *exclude]
+    if full_refresh:
+        command.append("--full-refresh")
+    if dbt_vars:
+        command += ["--vars", dbt_vars]
+    return subprocess.run(command, cwd=DBT_DIR).returncode
+
+
+def cmd_build(args: argparse.Namespace) -> int:
+    returncode = run_dbt(args.select, args.exclude, args.full_refresh, args.vars, args.profiles_dir)
+    if returncode != 0:
+        return returncode
+
+    db_path = BASE_DIR / args.db
+    if args.score_outliers:
+        from score_outliers import score_outliers
+        score_outliers(db_path)
+    if args.publish:
+        from publish_snapshot import publish_snapshot
+        publish_snapshot(db_path)
+    if args.export:
+        from export_parquet import export_parquet
+        export_parquet(db_path)
+    if args.shards:
+        from build_shards import build_shards
+        build_shards(db_path)
+    return 0
+
+
+def cmd_query(args: argparse.Namespace) -> int:
+    _use_plots()
+    from chart_registry import QUERIES, get_query
+
+    if args.list or not args.name:
+        for spec in QUERIES:
+            print(f"{spec.name:32} {spec.module}.{spec.chart_class}.{spec.method}")
+        return 0
+
+    import inspect
+
+    from chart_filters import ChartFilter
+
+    try:
+        spec = get_query(args.name)
+    except KeyError as exc:
+        print(exc.args[0], file=sys.stderr)
+        return 2
+    # sql_only: righe direttamente da DuckDB, pandas non viene importato
+    charts = spec.build(db_filename=args.db, show=False, use_shards=args.shards, timeout_s=args.timeout,
+                        as_rows=spec.sql_only)
+    method = getattr(charts, spec.method)
+    accepted = inspect.signature(method).parameters
+
+    kwargs = dict(spec.kwargs)
+    filter_opts = {
+        field: value
+        for field, value in (
+            ("start_date", args.start_date),
+            ("end_date", args.end_date),
+            ("pickup_borough", args.borough),
+            ("dropoff_borough", args.dropoff_borough),
+            ("vendor", args.vendor),
+            ("exclude_outliers", args.exclude_outliers or None),
+        )
+        if value is not None
+    }
+    if filter_opts:
+        if "filters" not in accepted:
+            print(f"{args.name} non supporta i filtri {sorted(filter_opts)}", file=sys.stderr)
+            return 2
+        kwargs["filters"] = ChartFilter(**filter_opts)
+    if args.approx:
+        if "approx" not in accepted:
+            print(f"{args.name} non ha una modalità approssimata", file=sys.stderr)
+            return 2
+        kwargs["approx"] = True
+    if args.weather_category:
+        if "intensity_col" not in accepted:
+            print(f"{args.name} non supporta --weather-category", file=sys.stderr)
+            return 2
+        kwargs["intensity_col"] = args.weather_category
+    elif "intensity_col" in accepted and "intensity_col" not in kwargs:
+        print(f"{args.name} richiede --weather-category", file=sys.stderr)
+        return 2
+
+    from query_governor import QueryTimeout
+
+    try:
+        df = method(**kwargs)
+    except QueryTimeout as exc:
+        print(exc, file=sys.stderr)
+        return 3
+    if spec.sql_only:
+        _write_rows(df.columns, df.rows, args.format)
+    elif args.format == "csv":
+        df.to_csv(sys.stdout, index=False)
+    elif args.format == "json":
+        print(df.to_json(orient="records", date_format="iso"))
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+
+def _write_rows(columns: List[str], rows: List[tuple], fmt: str) -> None:
+    """Stampa righe DuckDB (tuple) come tabella allineata, CSV o JSON, senza pandas."""
+    if fmt == "csv":
+        import csv
+
+        writer = csv.writer(sys.stdout)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    elif fmt == "json":
+        print(json.dumps([dict(zip(columns, row)) for row in rows], default=str))
+    else:
+        cells = [list(map(str, columns))] + [["" if v is None else str(v) for v in row] for row in rows]
+        widths = [max(len(r[i]) for r in cells) for i in range(len(columns))]
+        for r in cells:
+            print(" ".join(v.rjust(w) for v, w in zip(r, widths)))
+
+
+def cmd_sql(args: argparse.Namespace) -> int:
+    import csv
+
+    import duckdb
+
+    _use_plots()
+    from chart_base import SNAPSHOT_DIR, SNAPSHOT_POINTER, read_snapshot_pointer
+
+    db_path = (BASE_DIR / args.db).resolve()
+    path = read_snapshot_pointer(BASE_DIR / SNAPSHOT_DIR / db_path.stem / SNAPSHOT_POINTER, db_path)
+    con = duckdb.connect(str(path or db_path), read_only=True)
+    try:
+        if args.schema:
+            con.execute(f'SET schema = "{args.schema}"')
+        if args.format == "table":
+            relation = con.sql(args.query)
+            if relation is not None:
+                relation.show(max_rows=args.max_rows)
+            return 0
+        cursor = con.execute(args.query)
+        if cursor.description is None:
+            return 0
+        columns = [d[0] for d in cursor.description]
+        if args.format == "csv":
+            writer = csv.writer(sys.stdout)
+            writer.writerow(columns)
+            while rows := cursor.fetchmany(10_000):
+                writer.writerows(rows)
+        else:
+            _write_rows(columns, cursor.fetchall(), args.format)
+    finally:
+        con.close()
+    return 0
+
+
+def cmd_maintenance(args: argparse.Namespace) -> int:
+    import duckdb
+
+    import maintenance
+
+    db_path = BASE_DIR / args.db
+    if args.action == "report":
+        con = duckdb.connect(str(db_path), read_only=True)
+        try:
+            maintenance.print_report(con, maintenance.storage_report(con))
+        finally:
+            con.close()
+    elif args.action == "compact":
+        maintenance.compact(db_path, args.tables, args.all)
+    elif args.action == "checkpoint":
+        maintenance.checkpoint(db_path)
+    else:
+        maintenance.compact_copy(db_path, backup=not args.no_backup)
+    return 0
+
+
+def cmd_backfill(args: argparse.Namespace) -> int:
+    from backfill import backfill
+
+    backfill(
+        db_path=BASE_DIR / args.db,
+        data_dir=args.data_dir,
+        start=args.start,
+        end=args.end,
+        restart=args.restart,
+        memory_limit=args.memory_limit,
+        profiles_dir=args.profiles_dir,
+        plan_only=args.plan,
+    )
+    return 0
+
+
+def cmd_report(args: argparse.Namespace) -> int:
+    _use_plots()
+    from report_export import main as report_main
+
+    return report_main(args.report_args)
+
+
+# ----------------------------
+# PARSER
+# ----------------------------
+
+def _month(value: str):
+    # build_ods_parallel importa duckdb: solo quando l'argomento viene davvero passato
+    from build_ods_parallel import _parse_month
+
+    return _parse_month(value)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="cli.py", description="Pipeline taxi NYC: init, build, query, report, maintenance, backfill.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="crea le viste raw su data/")
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--data-dir", type=Path, default=BASE_DIR / "data")
+    p.set_defaults(func=cmd_init)
+
+    p = sub.add_parser("build", help="dbt run (+ snapshot / export Parquet)")
+    p.add_argument("--db", default=DEFAULT_DB, help="file DuckDB del profilo dbt (per --publish/--export)")
+    p.add_argument("--select", nargs="+", default=None)
+    p.add_argument("--exclude", nargs="+", default=None)
+    p.add_argument("--full-refresh", action="store_true")
+    p.add_argument("--vars", default=None, help="YAML passato a dbt --vars")
+    p.add_argument("--profiles-dir", type=Path, default=None)
+    p.add_argument("--score-outliers", action="store_true", help="segnala i trip nuovi anomali (score_outliers.py)")
+    p.add_argument("--publish", action="store_true", help="pubblica lo snapshot read-only (publish_snapshot.py)")
+    p.add_argument("--export", action="store_true", help="export Parquet incrementale (export_parquet.py)")
+    p.add_argument("--shards", action="store_true", help="shard Parquet di dm_trip_narrow (build_shards.py)")
+    p.set_defaults(func=cmd_build)
+
+    p = sub.add_parser("query", help="query del registry (stessi nomi dell'API)")
+    p.add_argument("name", nargs="?")
+    p.add_argument("--list", action="store_true", help="elenca le query disponibili")
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--format", choices=FORMATS, default="table")
+    p.add_argument("--start-date")
+    p.add_argument("--end-date")
+    p.add_argument("--borough")
+    p.add_argument("--dropoff-borough")
+    p.add_argument("--vendor")
+    p.add_argument("--exclude-outliers", action="store_true", help="esclude i trip segnalati da score_outliers.py")
+    p.add_argument("--approx", action="store_true")
+    p.add_argument("--shards", action="store_true", help="aggregazioni scatter-gather sugli shard (build_shards.py)")
+    p.add_argument("--timeout", type=float, default=None, help="interrompe la query dopo N secondi")
+    p.add_argument("--weather-category")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser("sql", help="SQL libero sul datamart, stampato da DuckDB")
+    p.add_argument("query")
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--schema", default="dwh_datamart")
+    p.add_argument("--format", choices=FORMATS, default="table")
+    p.add_argument("--max-rows", type=int, default=40)
+    p.set_defaults(func=cmd_sql)
+
+    p = sub.add_parser("report", help="report HTML headless (argomenti di plots/report_export.py)")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser("maintenance", help="storage DuckDB: report, compact, checkpoint, copia compatta")
+    p.add_argument("action", choices=["report", "compact", "checkpoint", "copy"])
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--tables", nargs="+", default=None, help="compact: tabelle schema.tabella da riscrivere")
+    p.add_argument("--all", action="store_true", help="compact: riscrive tutte le tabelle")
+    p.add_argument("--no-backup", action="store_true", help="copy: non conserva il vecchio file come .bak")
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser("backfill", help="backfill storico a blocchi mensili, riprendibile (backfill.py)")
+    p.add_argument("--db", default=DEFAULT_DB)
+    p.add_argument("--data-dir", type=Path, default=BASE_DIR / "data")
+    p.add_argument("--from", dest="start", type=_month, default=None, help="primo mese (YYYY-MM)")
+    p.add_argument("--to", dest="end", type=_month, default=None, help="ultimo mese (YYYY-MM)")
+    p.add_argument("--restart", action="store_true", help="ignora i checkpoint e riparte dall'inizio")
+    p.add_argument("--memory-limit", default=None, help="memory_limit DuckDB del build ODS (es. 4GB)")
+    p.add_argument("--profiles-dir", type=Path, default=None)
+    p.add_argument("--plan", action="store_true", help="stampa il piano e lo stato, senza eseguire")
+    p.set_defaults(func=cmd_backfill)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    # gli argomenti sconosciuti di `report` passano invariati a report_export.main
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "report":
+        args.report_args = extra
+    elif extra:
+        parser.error(f"argomenti non riconosciuti: {' '.join(extra)}")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
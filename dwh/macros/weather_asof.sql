@@ -0,0 +1,141 @@
+{#-
+    Aggancio del meteo ai trip con ASOF join per borough (merge ordinato di DuckDB, non
+    una join riga per riga). Il timestamp del trip è l'ora di pickup troncata
+    (date_trunc('hour', ...)): se esiste il record meteo di quell'ora è sempre lui il
+    più vicino, quindi la semantica del vecchio join per uguaglianza resta invariata.
+    Le ore mancanti ricadono sul record più vicino entro `weather_max_gap_hours`:
+
+    - weather_asof_mode = 'preceding': ultimo record meteo <= ora del trip;
+    - weather_asof_mode = 'nearest': il più vicino tra precedente e successivo
+      (a parità di distanza vince il precedente).
+
+    Oltre la distanza massima (o borough sconosciuto) key_weather_asof è NULL.
+    Con weather_max_gap_hours = 0 si ottiene esattamente il join per ora di prima.
+-#}
+
+{% macro weather_points() %}
+    SELECT
+        key_weather,
+        borough_name,
+        weather_date + weather_time AS weather_ts
+    FROM {{ ref('dm_weather_dt') }}
+{% endmacro %}
+
+
+{% macro weather_asof_select(trips, borough_col, hour_ts_col, points='weather_points') %}
+{%- set mode = var('weather_asof_mode', 'preceding') -%}
+{%- set max_gap = var('weather_max_gap_hours', 3) | int -%}
+{%- if mode not in ['preceding', 'nearest'] -%}
+    {{ exceptions.raise_compiler_error("weather_asof_mode deve essere 'preceding' o 'nearest', non '" ~ mode ~ "'") }}
+{%- endif -%}
+    SELECT
+        t.*,
+        {%- if mode == 'nearest' %}
+        CASE
+            WHEN wp.key_weather IS NOT NULL
+                 AND (wn.key_weather IS NULL OR t.{{ hour_ts_col }} - wp.weather_ts <= wn.weather_ts - t.{{ hour_ts_col }})
+                THEN CASE WHEN t.{{ hour_ts_col }} - wp.weather_ts <= INTERVAL {{ max_gap }} HOUR THEN wp.key_weather END
+            WHEN wn.weather_ts - t.{{ hour_ts_col }} <= INTERVAL {{ max_gap }} HOUR
+                THEN wn.key_weather
+        END AS key_weather_asof
+        {%- else %}
+        CASE
+            WHEN t.{{ hour_ts_col }} - wp.weather_ts <= INTERVAL {{ max_gap }} HOUR THEN wp.key_weather
+        END AS key_weather_asof
+        {%- endif %}
+    FROM {{ trips }} AS t
+    ASOF LEFT JOIN {{ points }} AS wp
+        ON t.{{ borough_col }} = wp.borough_name
+        AND t.{{ hour_ts_col }} >= wp.weather_ts
+    {%- if mode == 'nearest' %}
+    ASOF LEFT JOIN {{ points }} AS wn
+        ON t.{{ borough_col }} = wn.borough_name
+        AND t.{{ hour_ts_col }} <= wn.weather_ts
+    {%- endif %}
+{% endmacro %}
+
+
+{#-
+    Post-hook di dm_fact_taxi_trip: i trip già caricati con key_weather = -1 (meteo arrivato
+    dopo i trip, oppure distanza massima aumentata) vengono ricollegati senza full-refresh.
+    La fact è in append, quindi qui si aggiorna solo key_weather delle righe ancora senza meteo.
+-#}
+{% macro repair_missing_weather_fact() %}
+    UPDATE {{ this }} AS f
+    SET key_weather = r.key_weather_asof
+    FROM (
+        WITH weather_points AS (
+            {{ weather_points() }}
+        ),
+        missing AS (
+            SELECT
+                f.key_taxi_trip,
+                z.borough_name,
+                date_trunc('hour', d.date + f.pickup_time) AS pickup_hour_ts
+            FROM {{ this }} AS f
+            JOIN {{ ref('dm_zone') }} AS z ON f.key_zone_pickup = z.key_zone
+            JOIN {{ ref('dm_date') }} AS d ON f.key_date_pickup = d.key_date
+            WHERE f.key_weather = -1
+        )
+        {{ weather_asof_select('missing', 'borough_name', 'pickup_hour_ts') }}
+    ) AS r
+    WHERE f.key_taxi_trip = r.key_taxi_trip
+      AND r.key_weather_asof IS NOT NULL
+{% endmacro %}
+
+
+{#-
+    Date di pickup dei trip a cui il post-hook di dm_trip_narrow ha ricollegato il meteo,
+    con l'istante (UTC) della build: i modelli giornalieri raggruppati per key_weather
+    (dm_daily_quantile_sketch) ricalcolano le date registrate dopo il loro ultimo run
+    (last_execution_times), altrimenti resterebbero nel bucket key_weather = -1.
+    Stesso orologio del post-hook di last_execution_times: ogni riparazione è letta una volta.
+-#}
+{% macro weather_repaired_dates_table() %}
+    CREATE TABLE IF NOT EXISTS weather_repaired_dates (key_date_pickup INTEGER NOT NULL, repaired_at DATETIME NOT NULL)
+{% endmacro %}
+
+
+{% macro log_weather_repaired_dates() %}
+    INSERT INTO weather_repaired_dates (key_date_pickup, repaired_at)
+    SELECT DISTINCT n.key_date_pickup, timezone('UTC', current_timestamp)
+    FROM {{ this }} AS n
+    JOIN {{ ref('dm_fact_taxi_trip') }} AS f ON f.key_taxi_trip = n.key_taxi_trip
+    WHERE n.key_weather = -1
+      AND f.key_weather <> -1
+{% endmacro %}
+
+
+{#- Date riparate dopo l'ultimo run del modello corrente (vedi weather_repaired_dates_table). -#}
+{% macro weather_repaired_dates_since_last_run() %}
+    SELECT key_date_pickup
+    FROM weather_repaired_dates
+    WHERE repaired_at > (
+        SELECT COALESCE(MAX(time), '1900-01-01 00:00:00')
+        FROM last_execution_times
+        WHERE target_table = '{{ this.identifier }}'
+    )
+{% endmacro %}
+
+
+{#-
+    Post-hook di dm_trip_narrow: riporta sull'estratto i key_weather riparati nella fact
+    (dm_trip_narrow accoda solo le chiavi nuove e non rilegge le righe esistenti).
+    Va eseguito dopo log_weather_repaired_dates, che legge le righe ancora a -1.
+-#}
+{% macro repair_missing_weather_narrow() %}
+    UPDATE {{ this }} AS n
+    SET
+        key_weather = w.key_weather::INTEGER,
+        temperature_category = w.temperature_category,
+        apparent_temperature_category = w.apparent_temperature_category,
+        rain_intensity = w.rain_intensity,
+        snow_intensity = w.snow_intensity,
+        wind_intensity = w.wind_intensity,
+        is_rainy = w.is_rainy,
+        is_snowy = w.is_snowy
+    FROM {{ ref('dm_fact_taxi_trip') }} AS f
+    JOIN {{ ref('dm_weather_dt') }} AS w ON f.key_weather = w.key_weather
+    WHERE n.key_weather = -1
+      AND f.key_taxi_trip = n.key_taxi_trip
+{% endmacro %}
@@ -0,0 +1,49 @@
+{{ config(
+    materialized='incremental',
+    unique_key=['pickup_date', 'borough'],
+    incremental_strategy='delete+insert',
+    on_schema_change='fail'
+) }}
+
+-- Metriche giornaliere per borough di pickup (trip, revenue, mance, durata, distanza).
+-- Le somme sono additive: totali per mese / anno / tutti i borough si ottengono sommando
+-- poche migliaia di righe invece di scansionare dm_trip_narrow.
+-- Incrementale: si ricalcolano per intero solo le date che hanno ricevuto trip nuovi
+-- (key_taxi_trip oltre il massimo già aggregato) e delete+insert sostituisce quelle righe.
+
+WITH
+{% if is_incremental() %}
+touched_dates AS (
+    SELECT DISTINCT key_date_pickup
+    FROM {{ ref('dm_trip_narrow') }}
+    WHERE key_taxi_trip > (SELECT COALESCE(MAX(max_key_taxi_trip), -1) FROM {{ this }})
+),
+{% endif %}
+
+trips AS (
+    SELECT t.*
+    FROM {{ ref('dm_trip_narrow') }} AS t
+    WHERE t.pickup_date IS NOT NULL
+    {% if is_incremental() %}
+      AND t.key_date_pickup IN (SELECT key_date_pickup FROM touched_dates)
+    {% endif %}
+)
+
+SELECT
+    t.pickup_date,
+    t.key_date_pickup,
+    t.year,
+    t.month,
+    t.month_name,
+    COALESCE(lower(t.pickup_borough), 'unknown') AS borough,
+    COUNT(*) AS trips,
+    SUM(t.total_amount) AS revenue,
+    SUM(t.fare_amount) AS fare,
+    SUM(t.tip_amount) AS tips,
+    SUM(t.trip_duration_minutes) AS duration_minutes,
+    SUM(t.trip_distance) AS distance,
+    MAX(t.key_taxi_trip) AS max_key_taxi_trip,
+    current_timestamp AS last_update
+FROM trips AS t
+GROUP BY ALL
+ORDER BY t.pickup_date, borough
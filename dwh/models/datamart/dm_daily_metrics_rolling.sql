@@ -0,0 +1,109 @@
+{{ config(
+    materialized='incremental',
+    unique_key=['pickup_date', 'borough'],
+    incremental_strategy='delete+insert',
+    on_schema_change='fail'
+) }}
+
+-- Finestre mobili (7 e 28 giorni) e confronto anno su anno sulle metriche giornaliere.
+-- - griglia densa data x borough (giorni senza trip = 0): le finestre ROWS coprono giorni di calendario;
+-- - anno precedente = stessa data - 364 giorni (stesso giorno della settimana);
+-- - colonne *_7d / *_28d / *_py sono somme (additive tra borough); i rapporti si calcolano a valle.
+-- Incrementale: dalla prima data di dm_daily_metrics aggiornata dopo l'ultimo run
+-- (last_update oltre il massimo daily_last_update già elaborato) in poi si
+-- ricalcolano le righe (finestre e anno dopo dipendono solo da date precedenti); la griglia parte
+-- 364 + 27 giorni prima per avere tutte le date che entrano nelle finestre dell'anno precedente.
+
+WITH daily AS (
+    SELECT pickup_date, borough, trips, revenue, tips, duration_minutes, distance, last_update
+    FROM {{ ref('dm_daily_metrics') }}
+),
+
+bounds AS (
+    SELECT
+        {% if is_incremental() %}
+        (
+            SELECT MIN(pickup_date) FROM daily
+            WHERE last_update > (SELECT COALESCE(MAX(daily_last_update), TIMESTAMPTZ '1900-01-01') FROM {{ this }})
+        ) AS first_affected,
+        {% else %}
+        MIN(pickup_date) AS first_affected,
+        {% endif %}
+        MIN(pickup_date) AS first_date,
+        MAX(pickup_date) AS last_date
+    FROM daily
+),
+
+grid AS (
+    -- calendario da dm_date; prima di first_date le finestre sommerebbero solo zeri
+    SELECT dt.date AS pickup_date, b.borough
+    FROM {{ ref('dm_date') }} AS dt
+    CROSS JOIN bounds
+    CROSS JOIN (SELECT DISTINCT borough FROM daily) AS b
+    WHERE dt.date >= GREATEST(bounds.first_affected - 391, bounds.first_date)
+      AND dt.date <= bounds.last_date
+),
+
+dense AS (
+    SELECT
+        g.pickup_date,
+        g.borough,
+        COALESCE(d.trips, 0) AS trips,
+        COALESCE(d.revenue, 0) AS revenue,
+        COALESCE(d.tips, 0) AS tips,
+        COALESCE(d.duration_minutes, 0) AS duration_minutes,
+        COALESCE(d.distance, 0) AS distance,
+        d.last_update AS daily_last_update
+    FROM grid AS g
+    LEFT JOIN daily AS d
+        ON d.pickup_date = g.pickup_date AND d.borough = g.borough
+),
+
+rolled AS (
+    SELECT
+        *,
+        CAST(SUM(trips) OVER w7 AS BIGINT) AS trips_7d,
+        SUM(revenue) OVER w7 AS revenue_7d,
+        CAST(SUM(trips) OVER w28 AS BIGINT) AS trips_28d,
+        SUM(revenue) OVER w28 AS revenue_28d,
+        SUM(tips) OVER w28 AS tips_28d,
+        SUM(duration_minutes) OVER w28 AS duration_minutes_28d,
+        SUM(distance) OVER w28 AS distance_28d
+    FROM dense
+    WINDOW
+        w7 AS (PARTITION BY borough ORDER BY pickup_date ROWS BETWEEN 6 PRECEDING AND CURRENT ROW),
+        w28 AS (PARTITION BY borough ORDER BY pickup_date ROWS BETWEEN 27 PRECEDING AND CURRENT ROW)
+)
+
+SELECT
+    r.pickup_date,
+    r.borough,
+    r.trips,
+    r.revenue,
+    r.tips,
+    r.duration_minutes,
+    r.distance,
+    r.trips_7d,
+    r.revenue_7d,
+    r.trips_28d,
+    r.revenue_28d,
+    r.tips_28d,
+    r.duration_minutes_28d,
+    r.distance_28d,
+    py.trips AS trips_py,
+    py.revenue AS revenue_py,
+    py.trips_7d AS trips_7d_py,
+    py.revenue_7d AS revenue_7d_py,
+    py.trips_28d AS trips_28d_py,
+    py.revenue_28d AS revenue_28d_py,
+    r.daily_last_update,
+    current_timestamp AS last_update
+FROM rolled AS r
+CROSS JOIN bounds
+LEFT JOIN rolled AS py
+    ON py.borough = r.borough
+   AND py.pickup_date = r.pickup_date - 364
+   -- prima dell'inizio dei dati l'anno precedente è ignoto (NULL), non zero
+   AND py.pickup_date >= bounds.first_date
+WHERE r.pickup_date >= bounds.first_affected
+ORDER BY r.pickup_date, r.borough
@@ -0,0 +1,96 @@
+{{ config(
+    materialized='incremental',
+    unique_key='key_date_pickup',
+    incremental_strategy='delete+insert',
+    on_schema_change='fail',
+    pre_hook=["{{ weather_repaired_dates_table() }}"]
+) }}
+
+-- Sketch di quantili (stile DDSketch) per giorno x borough di pickup x ora x meteo, per
+-- total_amount, trip_duration_minutes, trip_distance e tip_percentage.
+-- Ogni valore cade in un bucket logaritmico: bucket k > 0 copre (m*g^(k-2), m*g^(k-1)]
+-- con g = (1 + a) / (1 - a) e m = sketch_min_value; i negativi sono speculari (k < 0),
+-- |x| < m va nel bucket 0. bucket_value (2*m*g^(k-1) / (g + 1)) ha errore relativo <= a
+-- rispetto a qualsiasi valore del bucket.
+-- Gli sketch si uniscono sommando n per bucket: quantili per qualsiasi periodo e
+-- raggruppamento senza rileggere i trip (plots/quantile_sketch.py).
+-- Cambiare sketch_relative_accuracy o sketch_min_value richiede --full-refresh.
+-- Incrementale come dm_daily_metrics: si ricalcolano solo le date con trip nuovi, più le
+-- date i cui trip hanno appena ricevuto il meteo (key_weather da -1 a un record vero,
+-- weather_repaired_dates scritta dal post-hook di dm_trip_narrow).
+
+{% set alpha = var('sketch_relative_accuracy', 0.01) %}
+{% set min_value = var('sketch_min_value', 0.01) %}
+{% set gamma = (1 + alpha) / (1 - alpha) %}
+
+WITH
+{% if is_incremental() %}
+touched_dates AS (
+    SELECT key_date_pickup
+    FROM {{ ref('dm_trip_narrow') }}
+    WHERE key_taxi_trip > (SELECT COALESCE(MAX(max_key_taxi_trip), -1) FROM {{ this }})
+    UNION
+    {{ weather_repaired_dates_since_last_run() }}
+),
+{% endif %}
+
+trips AS (
+    SELECT
+        t.key_date_pickup,
+        t.pickup_date,
+        COALESCE(lower(t.pickup_borough), 'unknown') AS borough,
+        t.pickup_hour,
+        t.key_weather,
+        t.key_taxi_trip,
+        t.total_amount::DOUBLE AS total_amount,
+        t.trip_duration_minutes::DOUBLE AS trip_duration_minutes,
+        t.trip_distance::DOUBLE AS trip_distance,
+        t.tip_percentage::DOUBLE AS tip_percentage
+    FROM {{ ref('dm_trip_narrow') }} AS t
+    WHERE t.pickup_date IS NOT NULL
+    {% if is_incremental() %}
+      AND t.key_date_pickup IN (SELECT key_date_pickup FROM touched_dates)
+    {% endif %}
+),
+
+day_max_key AS (
+    SELECT key_date_pickup, MAX(key_taxi_trip) AS max_key_taxi_trip
+    FROM trips
+    GROUP BY key_date_pickup
+),
+
+measure_values AS (
+    UNPIVOT (
+        SELECT key_date_pickup, pickup_date, borough, pickup_hour, key_weather,
+               total_amount, trip_duration_minutes, trip_distance, tip_percentage
+        FROM trips
+    )
+    ON total_amount, trip_duration_minutes, trip_distance, tip_percentage
+    INTO NAME measure VALUE value
+),
+
+bucketed AS (
+    SELECT
+        v.*,
+        CASE
+            WHEN abs(v.value) < {{ min_value }} THEN 0
+            ELSE sign(v.value) * (ceil(ln(abs(v.value) / {{ min_value }}) / ln({{ gamma }})) + 1)
+        END::SMALLINT AS bucket
+    FROM measure_values AS v
+)
+
+SELECT
+    b.pickup_date,
+    b.key_date_pickup,
+    b.borough,
+    b.pickup_hour,
+    b.key_weather,
+    b.measure::ENUM('total_amount', 'trip_duration_minutes', 'trip_distance', 'tip_percentage') AS measure,
+    b.bucket,
+    sign(b.bucket) * {{ min_value }} * 2 * pow({{ gamma }}, abs(b.bucket) - 1) / ({{ gamma }} + 1) AS bucket_value,
+    COUNT(*)::INTEGER AS n,
+    d.max_key_taxi_trip
+FROM bucketed AS b
+JOIN day_max_key AS d ON b.key_date_pickup = d.key_date_pickup
+GROUP BY ALL
+ORDER BY 2, 3, 6, 7  -- key_date_pickup, borough, measure, bucket
@@ -2,7 +2,8 @@
     materialized='incremental',
     unique_key='key_trip',
     incremental_strategy='append',
-    on_schema_change='fail'
+    on_schema_change='fail',
+    post_hook=["{{ repair_missing_weather_fact() }}"]
 ) }}
 
 {% set initialize %}
@@ -37,8 +38,9 @@ WITH from_ods AS (
         o.payment_type_fk
     FROM {{ ref('ods_taxi_trip') }} as o
     {% if is_incremental() %}
+    -- last_execution_times.time è in UTC senza fuso; last_update è TIMESTAMPTZ
     WHERE ods_update_time > (
-                SELECT COALESCE(MAX(time), '1900-01-01 00:00:00')
+                SELECT timezone('UTC', COALESCE(MAX(time), '1900-01-01 00:00:00'))
                 FROM last_execution_times
                 WHERE target_table = '{{this.identifier}}')
 
@@ -149,32 +151,38 @@ SELECT
     FROM {{ ref('dm_date') }}
 ),
 
-weather_lookup AS (
-    SELECT
-        id_weather,
-        key_weather,
-        borough_name,
-        weather_date,
-        weather_time
-    FROM {{ref('dm_weather_dt')}}
+weather_points AS (
+    {{ weather_points() }}
 ),
 
 payment_type_lookup AS (
     SELECT
-        id_payment_type,
-        payment_type
-    FROM {{ ref('ods_payment_type')}}
+        key_payment_type
+    FROM {{ ref('dm_payment_type')}}
 ),
 
 ratecode_lookup AS (
     SELECT
-        id_ratecode,
-        ratecode_name
-    FROM {{ ref('ods_ratecode')}}
+        key_ratecode
+    FROM {{ ref('dm_ratecode')}}
 ),
 
 ----------------------------
 
+-- meteo: ASOF join per borough sull'ora di pickup (macros/weather_asof.sql)
+trips_with_borough AS (
+    SELECT
+        o.*,
+        zp.borough_name AS pickup_borough_name,
+        date_trunc('hour', o.pickup_datetime) AS pickup_hour_ts
+    FROM with_pickup_hour AS o
+    LEFT JOIN zone_pickup_lookup AS zp ON o.pickup_neighborhood_fk = zp.id_neighborhood
+),
+
+trips_with_weather AS (
+    {{ weather_asof_select('trips_with_borough', 'pickup_borough_name', 'pickup_hour_ts') }}
+),
+
 fact_data AS (
 SELECT
 NEXTVAL('trip_seq') AS key_taxi_trip,
@@ -185,33 +193,39 @@ COALESCE(zp.key_zone, -1) AS key_zone_pickup,
 COALESCE(zd.key_zone, -1) AS key_zone_dropoff,
 COALESCE(dp.key_date, -1) AS key_date_pickup,
 COALESCE(dd.key_date, -1) AS key_date_dropoff,
-COALESCE(wl.key_weather, -1) AS key_weather,
+COALESCE(o.key_weather_asof, -1) AS key_weather,
 ---- TEMPORAL ATTRIBUTES ----
 o.pickup_time,
 o.dropoff_time,
 
 ---- DEGENERATE DIMENSIONS ----
-COALESCE(pt.payment_type, 'Unknown') AS payment_type,
-COALESCE(rl.ratecode_name, 'Unknown') AS ratecode_name,
-o.store_and_fwd_flag,
+-- codici compatti: nomi in dm_payment_type / dm_ratecode (vista dm_fact_taxi_trip_readable),
+-- i domini fissi sono ENUM (1 byte, letti come testo)
+COALESCE(pt.key_payment_type, -1)::TINYINT AS key_payment_type,
+COALESCE(rl.key_ratecode, -1)::TINYINT AS key_ratecode,
+CASE upper(trim(o.store_and_fwd_flag))
+    WHEN 'Y' THEN 'Y'
+    WHEN 'N' THEN 'N'
+END::ENUM('N', 'Y') AS store_and_fwd_flag,
 
 ---- MEASURES ----
-o.passenger_count,
-o.trip_distance,
-o.fare_amount,
-o.extra,
-o.mta_tax,
-o.tip_amount,
-o.tolls_amount,
-o.improvement_surcharge,
-o.congestion_surcharge,
-o.airport_fee,
-o.total_amount,
+-- DECIMAL(9,2) = intero a 32 bit (DECIMAL(10,2) ne usa 64)
+o.passenger_count::TINYINT AS passenger_count,
+o.trip_distance::DECIMAL(9,2) AS trip_distance,
+o.fare_amount::DECIMAL(9,2) AS fare_amount,
+o.extra::DECIMAL(9,2) AS extra,
+o.mta_tax::DECIMAL(9,2) AS mta_tax,
+o.tip_amount::DECIMAL(9,2) AS tip_amount,
+o.tolls_amount::DECIMAL(9,2) AS tolls_amount,
+o.improvement_surcharge::DECIMAL(9,2) AS improvement_surcharge,
+o.congestion_surcharge::DECIMAL(9,2) AS congestion_surcharge,
+o.airport_fee::DECIMAL(9,2) AS airport_fee,
+o.total_amount::DECIMAL(9,2) AS total_amount,
 ---- CALCULATED MEASURE ----
-CAST(EXTRACT(EPOCH FROM (o.dropoff_datetime - o.pickup_datetime)) / 60 AS DECIMAL(10,2)) AS trip_duration_minutes,
+CAST(EXTRACT(EPOCH FROM (o.dropoff_datetime - o.pickup_datetime)) / 60 AS DECIMAL(9,2)) AS trip_duration_minutes,
 CASE
     WHEN o.fare_amount > 0 THEN
-        CAST((o.tip_amount / o.fare_amount * 100) AS DECIMAL(10,2))
+        CAST((o.tip_amount / o.fare_amount * 100) AS DECIMAL(9,2))
     ELSE 0.00
 END AS tip_percentage,
 CASE
@@ -224,19 +238,21 @@ CASE
     WHEN o.pickup_hour BETWEEN 16 AND 19 THEN 'Evening Rush'
     WHEN o.pickup_hour BETWEEN 20 AND 23 THEN 'Night'
     ELSE 'Late Night'
-END AS time_of_day_category
+END::ENUM('Late Night', 'Morning Rush', 'Midday', 'Evening Rush', 'Night') AS time_of_day_category,
+
+---- QUALITÀ ----
+-- bitmask degli outlier (velocità / tariffa per miglio / durata), scritta dopo il run da
+-- score_outliers.py; NULL = non ancora valutato
+NULL::UTINYINT AS outlier_flags
 
-FROM with_pickup_hour as o
+FROM trips_with_weather as o
 LEFT JOIN vendor_lookup as v ON o.vendor_fk = v.id_vendor
 LEFT JOIN zone_pickup_lookup AS zp ON o.pickup_neighborhood_fk = zp.id_neighborhood
 LEFT JOIN zone_dropoff_lookup AS zd ON o.dropoff_neighborhood_fk = zd.id_neighborhood
 LEFT JOIN date_pickup_lookup AS dp ON o.pickup_date = dp.date
 LEFT JOIN date_dropoff_lookup AS dd ON o.dropoff_date = dd.date
-LEFT JOIN weather_lookup AS wl ON zp.borough_name = wl.borough_name
-        AND o.pickup_date = wl.weather_date
-        AND o.pickup_hour = HOUR(wl.weather_time)
-LEFT JOIN payment_type_lookup AS pt ON pt.id_payment_type = o.payment_type_fk
-LEFT JOIN ratecode_lookup AS rl ON rl.id_ratecode = o.rate_code_fk
+LEFT JOIN payment_type_lookup AS pt ON pt.key_payment_type = o.payment_type_fk
+LEFT JOIN ratecode_lookup AS rl ON rl.key_ratecode = o.rate_code_fk
 
 )
 
@@ -0,0 +1,13 @@
+{{ config(materialized='view') }}
+
+-- dm_fact_taxi_trip con i codici delle dimensioni degeneri decodificati: stesse colonne
+-- leggibili di prima (payment_type, ratecode_name). time_of_day_category e
+-- store_and_fwd_flag sono ENUM e si leggono già come testo.
+
+SELECT
+    f.* EXCLUDE (key_payment_type, key_ratecode),
+    COALESCE(pt.payment_type, 'Unknown') AS payment_type,
+    COALESCE(rc.ratecode_name, 'Unknown') AS ratecode_name
+FROM {{ ref('dm_fact_taxi_trip') }} AS f
+LEFT JOIN {{ ref('dm_payment_type') }} AS pt ON f.key_payment_type = pt.key_payment_type
+LEFT JOIN {{ ref('dm_ratecode') }} AS rc ON f.key_ratecode = rc.key_ratecode
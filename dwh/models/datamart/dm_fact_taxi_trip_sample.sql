@@ -0,0 +1,43 @@
+{{ config(
+    materialized='table',
+    schema='datamart'
+) }}
+
+-- Campione stratificato di dm_fact_taxi_trip per le query approssimate (plots/approx.py).
+-- Strato = giorno di pickup x borough di pickup. Dentro ogni strato si tiene ogni trip
+-- con probabilita' p_h = max(sample_rate, sample_min_rows / N_h) (Bernoulli su hash della
+-- chiave: deterministico tra un run e l'altro); gli strati piccoli vengono presi interi.
+-- stratum_rows (N_h) e stratum_sample_rows (n_h) servono a pesare e a stimare la varianza.
+
+{% set sample_rate = var('sample_rate', 0.01) %}
+{% set sample_min_rows = var('sample_min_rows', 50) %}
+
+WITH fact AS (
+    SELECT
+        f.*,
+        COALESCE(z.borough_name, 'unknown') AS stratum_borough
+    FROM {{ ref('dm_fact_taxi_trip') }} AS f
+    LEFT JOIN {{ ref('dm_zone') }} AS z
+        ON f.key_zone_pickup = z.key_zone
+),
+
+with_strata AS (
+    SELECT
+        *,
+        COUNT(*) OVER (PARTITION BY key_date_pickup, stratum_borough) AS stratum_rows
+    FROM fact
+),
+
+sampled AS (
+    SELECT *
+    FROM with_strata
+    WHERE (hash(key_taxi_trip) % 1000000) / 1000000.0
+          < GREATEST({{ sample_rate }}, {{ sample_min_rows }} / stratum_rows)
+)
+
+SELECT
+    *,
+    COUNT(*) OVER (PARTITION BY key_date_pickup, stratum_borough) AS stratum_sample_rows
+FROM sampled
+-- ordinato per data: le query filtrate per periodo saltano i row group (zone map)
+ORDER BY key_date_pickup, stratum_borough
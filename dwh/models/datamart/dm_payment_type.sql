@@ -0,0 +1,16 @@
+{{ config(materialized='table') }}
+
+-- Dizionario di key_payment_type (TINYINT) di dm_fact_taxi_trip: la fact conserva il codice,
+-- il nome si legge da qui o dalla vista dm_fact_taxi_trip_readable.
+-- -1 = codice assente in ods_payment_type.
+
+SELECT
+    id_payment_type::TINYINT AS key_payment_type,
+    payment_type
+FROM {{ ref('ods_payment_type') }}
+
+UNION ALL
+
+SELECT -1, 'Unknown'
+
+ORDER BY key_payment_type
@@ -0,0 +1,17 @@
+{{ config(materialized='table') }}
+
+-- Dizionario di key_ratecode (TINYINT) di dm_fact_taxi_trip: la fact conserva il codice,
+-- il nome si legge da qui o dalla vista dm_fact_taxi_trip_readable.
+-- -1 = codice assente in ods_ratecode (che può avere più nomi per id: si tiene il minimo).
+
+SELECT
+    id_ratecode::TINYINT AS key_ratecode,
+    MIN(ratecode_name) AS ratecode_name
+FROM {{ ref('ods_ratecode') }}
+GROUP BY id_ratecode
+
+UNION ALL
+
+SELECT -1, 'Unknown'
+
+ORDER BY key_ratecode
@@ -0,0 +1,96 @@
+{{ config(
+    materialized='incremental',
+    unique_key='key_taxi_trip',
+    incremental_strategy='append',
+    on_schema_change='fail',
+    post_hook=[
+        "{{ weather_repaired_dates_table() }}",
+        "{{ log_weather_repaired_dates() }}",
+        "{{ repair_missing_weather_narrow() }}"
+    ]
+) }}
+
+-- Estratto "narrow" pre-joinato per i grafici (plots/): una riga per trip con le sole
+-- colonne usate dalle query, già risolte su dm_date, dm_zone (pickup e dropoff),
+-- dm_vendor e dm_weather_dt. Le query dei grafici diventano scansioni di una sola tabella.
+-- - chiavi intere della fact conservate: i filtri (ChartFilter) restano sulle chiavi;
+-- - tipi compatti (INTEGER / UTINYINT / DECIMAL(9,2)) per ridurre il volume scansionato;
+-- - ogni batch è ordinato per (key_date_pickup, key_zone_pickup): zone map efficaci.
+-- Le chiavi di dm_zone/dm_vendor sono versionate (SCD2), quindi gli attributi di una riga
+-- già inserita non cambiano: basta accodare i trip con key_taxi_trip nuova.
+-- Unica eccezione il meteo: i key_weather = -1 riparati nella fact vengono riportati
+-- qui dal post-hook repair_missing_weather_narrow (macros/weather_asof.sql), che registra
+-- le date toccate in weather_repaired_dates per dm_daily_quantile_sketch.
+-- outlier_flags viene aggiornato da score_outliers.py su entrambe le tabelle.
+
+WITH fact AS (
+    SELECT *
+    FROM {{ ref('dm_fact_taxi_trip') }}
+    {% if is_incremental() %}
+    WHERE key_taxi_trip > (SELECT COALESCE(MAX(key_taxi_trip), -1) FROM {{ this }})
+    {% endif %}
+)
+
+SELECT
+    ---- CHIAVI (filtri) ----
+    f.key_taxi_trip,
+    f.key_date_pickup::INTEGER AS key_date_pickup,
+    f.key_date_dropoff::INTEGER AS key_date_dropoff,
+    f.key_zone_pickup::INTEGER AS key_zone_pickup,
+    f.key_zone_dropoff::INTEGER AS key_zone_dropoff,
+    f.key_vendor::INTEGER AS key_vendor,
+    f.key_weather::INTEGER AS key_weather,
+
+    ---- TEMPO ----
+    dp.date AS pickup_date,
+    HOUR(f.pickup_time)::UTINYINT AS pickup_hour,
+    dp.day_name,
+    dp.month_name,
+    EXTRACT(MONTH FROM dp.date)::UTINYINT AS month,
+    dp.year,
+    dp.is_weekend,
+    dp.season,
+    dp.is_holiday,
+    dp.holiday_name,
+    dd.is_holiday AS dropoff_is_holiday,
+    dd.holiday_name AS dropoff_holiday_name,
+    f.time_of_day_category,
+
+    ---- LUOGHI / VENDOR ----
+    zp.borough_name AS pickup_borough,
+    zp.neighborhood_name AS pickup_neighborhood,
+    zd.borough_name AS dropoff_borough,
+    zd.neighborhood_name AS dropoff_neighborhood,
+    f.is_cross_borough,
+    v.vendor_name,
+
+    ---- METEO (NULL se key_weather = -1) ----
+    w.temperature_category,
+    w.apparent_temperature_category,
+    w.rain_intensity,
+    w.snow_intensity,
+    w.wind_intensity,
+    w.is_rainy,
+    w.is_snowy,
+
+    ---- MISURE ----
+    f.passenger_count::TINYINT AS passenger_count,
+    f.trip_distance::DECIMAL(9,2) AS trip_distance,
+    f.fare_amount::DECIMAL(9,2) AS fare_amount,
+    f.tip_amount::DECIMAL(9,2) AS tip_amount,
+    f.total_amount::DECIMAL(9,2) AS total_amount,
+    f.trip_duration_minutes::DECIMAL(9,2) AS trip_duration_minutes,
+    f.tip_percentage::DECIMAL(9,2) AS tip_percentage,
+    f.airport_fee::DECIMAL(9,2) AS airport_fee,
+
+    ---- QUALITÀ (filtro ChartFilter.exclude_outliers) ----
+    f.outlier_flags
+
+FROM fact AS f
+LEFT JOIN {{ ref('dm_date') }} AS dp ON f.key_date_pickup = dp.key_date
+LEFT JOIN {{ ref('dm_date') }} AS dd ON f.key_date_dropoff = dd.key_date
+LEFT JOIN {{ ref('dm_zone') }} AS zp ON f.key_zone_pickup = zp.key_zone
+LEFT JOIN {{ ref('dm_zone') }} AS zd ON f.key_zone_dropoff = zd.key_zone
+LEFT JOIN {{ ref('dm_vendor') }} AS v ON f.key_vendor = v.key_vendor
+LEFT JOIN {{ ref('dm_weather_dt') }} AS w ON f.key_weather = w.key_weather
+ORDER BY f.key_date_pickup, f.key_zone_pickup
@@ -15,10 +15,10 @@ WITH from_ods AS (
     SELECT o.id_vendor,
             o.vendor_name,
             o.last_update as ods_update_time
-    FROM {{ source("ods","ods_vendor") }} AS o
+    FROM {{ ref('ods_vendor') }} AS o
     {% if is_incremental() %}
     WHERE o.last_update > (
-        SELECT COALESCE(MAX(time), '1900-01-01 00:00:00')
+        SELECT timezone('UTC', COALESCE(MAX(time), '1900-01-01 00:00:00'))
         FROM last_execution_times
         WHERE target_table = '{{ this.identifier }}'
     )
@@ -51,7 +51,7 @@ new_records as (
         o.id_vendor,
         o.vendor_name,
         o.ods_update_time as valid_from,
-        CAST(NULL AS TIMESTAMP) AS valid_to,
+        CAST(NULL AS TIMESTAMPTZ) AS valid_to,
         TRUE AS is_current
     FROM from_ods as o LEFT JOIN {{this}} as t
     ON o.id_vendor = t.id_vendor
@@ -70,7 +70,7 @@ SELECT * FROM new_records
              o.id_vendor,
              o.vendor_name,
              o.ods_update_time as valid_from,
-             CAST(NULL AS TIMESTAMP) AS valid_to,
+             CAST(NULL AS TIMESTAMPTZ) AS valid_to,
              TRUE AS is_current
          FROM from_ods as o
 
@@ -22,7 +22,7 @@ WITH from_ods AS (
     FROM {{ ref('ods_weather_dt')}} as o
     {% if is_incremental()%}
     WHERE o.last_update > (
-        SELECT COALESCE(MAX(time), '1900-01-01 00:00:00')
+        SELECT timezone('UTC', COALESCE(MAX(time), '1900-01-01 00:00:00'))
         FROM last_execution_times
         WHERE target_table = '{{ this.identifier }}')
 
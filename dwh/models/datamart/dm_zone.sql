@@ -24,7 +24,7 @@ WITH from_ods AS (
         ON b.id_borough = n.borough_fk
     {% if is_incremental() %}
     WHERE n.last_update > (
-        SELECT COALESCE(MAX(time), '1900-01-01 00:00:00')
+        SELECT timezone('UTC', COALESCE(MAX(time), '1900-01-01 00:00:00'))
         FROM last_execution_times
         WHERE target_table = '{{ this.identifier }}'
     )
@@ -33,15 +33,17 @@ WITH from_ods AS (
 {% if is_incremental() %}
 
 ,changed_records AS (
+    -- chiave naturale: id_neighborhood (LocationID TLC). Il nome non è univoco
+    -- (es. "Corona" 56/57): sul nome ogni run chiuderebbe e riaprirebbe quelle zone
     SELECT t.key_zone
     FROM {{ this }} AS t
     INNER JOIN from_ods AS o
-        ON t.neighborhood_name = o.neighborhood_name
-        AND t.borough_name = o.borough_name
+        ON t.id_neighborhood = o.id_neighborhood
         AND t.is_current = TRUE
         AND (
-            t.id_neighborhood <> o.id_neighborhood  -- ID cambiato
-            OR t.service_zone <> o.service_zone     -- service_zone cambiato
+            t.neighborhood_name <> o.neighborhood_name  -- nome cambiato
+            OR t.borough_name <> o.borough_name         -- borough cambiato
+            OR t.service_zone <> o.service_zone         -- service_zone cambiato
         )
 ),
 
@@ -58,8 +60,7 @@ records_to_close AS (
         FALSE AS is_current
     FROM {{ this }} AS t
     INNER JOIN from_ods AS o
-        ON t.neighborhood_name = o.neighborhood_name
-        AND t.borough_name = o.borough_name
+        ON t.id_neighborhood = o.id_neighborhood
         AND is_current = true
     WHERE t.key_zone IN (SELECT key_zone FROM changed_records)
 ),
@@ -72,16 +73,14 @@ new_records AS (
         o.borough_name,
         o.service_zone,
         o.ods_update_time AS valid_from,
-        CAST(NULL AS TIMESTAMP) AS valid_to,
+        CAST(NULL AS TIMESTAMPTZ) AS valid_to,
         TRUE AS is_current
     FROM from_ods AS o
     LEFT JOIN {{ this }} AS t
-        ON t.neighborhood_name = o.neighborhood_name
-        AND t.borough_name = o.borough_name
+        ON t.id_neighborhood = o.id_neighborhood
         AND t.is_current = TRUE
     WHERE t.key_zone IS NULL  -- Nuovi record (quartiere mai visto)
-       OR t.id_neighborhood <> o.id_neighborhood  -- ID cambiato
-       OR t.service_zone <> o.service_zone        -- service_zone cambiato
+       OR t.key_zone IN (SELECT key_zone FROM changed_records)
 )
 SELECT * FROM records_to_close
 UNION ALL
@@ -96,7 +95,7 @@ SELECT
     borough_name,
     service_zone,
     ods_update_time AS valid_from,
-    CAST(NULL AS TIMESTAMP) AS valid_to,
+    CAST(NULL AS TIMESTAMPTZ) AS valid_to,
     TRUE AS is_current
 FROM from_ods
 
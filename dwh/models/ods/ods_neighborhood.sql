@@ -42,7 +42,7 @@ hash_borough as (
            sha256(s.borough_name) as borough_fk,
            s.service_zone
     from src_dedup s
-)
+),
 
 joined as (
     select s.id_neighborhood,
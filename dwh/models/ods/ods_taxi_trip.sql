@@ -72,4 +72,26 @@ transformed as (
         on cast(f.DOLocationID as integer) = dof.id_neighborhood
 )
 
+{% if is_incremental() %}
+
+-- i trip già caricati della finestra riletta (1 giorno) mantengono il loro last_update:
+-- dm_fact_taxi_trip è in append su last_update e li accoderebbe di nuovo (come swap_into_ods)
+,previous as (
+    select id_trip, min(last_update) as last_update
+    from {{ this }}
+    where pickup_datetime >= (
+        select coalesce(max(pickup_datetime), timestamp '2000-01-01') - interval '1 day'
+        from {{ this }}
+    )
+    group by id_trip
+)
+
+select t.* replace (coalesce(p.last_update, t.last_update) as last_update)
+from transformed t
+left join previous p on t.id_trip = p.id_trip
+
+{% else %}
+
 select * from transformed
+
+{% endif %}
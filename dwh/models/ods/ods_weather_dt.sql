@@ -7,7 +7,11 @@
 with src as (
     SELECT
         lower(trim(borough_name)) as borough_name,
-        cast(time as datetime) as weather_datetime,
+        -- gli export Open-Meteo scrivono 'YYYY-MM-DDTHH:MM' (senza secondi), che il cast rifiuta
+        coalesce(
+            try_cast(time as datetime),
+            strptime(cast(time as varchar), '%Y-%m-%dT%H:%M')
+        ) as weather_datetime,
         cast("temperature_2m (°C)" as double) as temperature,
 
         cast("apparent_temperature (°C)" as double) as apparent_temperature,
@@ -24,8 +28,10 @@ with src as (
         select *
         from src
         {% if is_incremental() %}
+            -- la tabella salva data e ora separate: il watermark si ricostruisce da entrambe
             where weather_datetime > (
-                select max(weather_datetime) from {{ this }}
+                select coalesce(max(weather_date + weather_time), timestamp '1900-01-01')
+                from {{ this }}
                 )
         {% endif %}
     ),
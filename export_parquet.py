@@ -0,0 +1,234 @@
+"""
+Export incrementale del datamart in Parquet, leggibile senza il file DuckDB.
+
+Struttura di `export/<db>/`:
+
+- `dm_fact_taxi_trip/year=YYYY/month=M/data.parquet`: la fact partizionata (hive) per anno
+  e mese di pickup (year=0/month=0 per i trip senza data), ordinata per
+  (key_date_pickup, key_zone_pickup, pickup_time) con statistiche min/max per row group;
+- `<dimensione>.parquet`: le dimensioni piccole, un file ciascuna;
+- `manifest.json`: file, righe e impronte di ogni partizione e tabella.
+
+A ogni run si riscrive solo ciò che è cambiato dall'export precedente:
+
+- se last_execution_times di una dimensione coincide con quello nel manifest è saltata;
+- per la fact (a ogni run, anche senza un run dbt: score_outliers.py aggiorna outlier_flags
+  fuori da dbt) si confronta l'impronta di ogni mese (righe, max key_taxi_trip e checksum
+  di key_taxi_trip/key_weather/outlier_flags, le colonne aggiornate dopo l'append) e si riscrivono
+  solo i mesi diversi; i mesi spariti dalla fact vengono cancellati.
+
+Ogni file è scritto come .tmp e rinominato; il manifest per ultimo. Lettura di un mese:
+    SELECT * FROM read_parquet('export/taxi_trips/dm_fact_taxi_trip/*/*/*.parquet',
+                               hive_partitioning = true)
+    WHERE year = 2024 AND month = 3
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+
+from init_duckdb import BASE_DIR, DB_PATH
+
+EXPORT_DIR = BASE_DIR / "export"
+MANIFEST = "manifest.json"
+SCHEMA = "dwh_datamart"
+FACT_TABLE = "dm_fact_taxi_trip"
+DIMENSIONS = ["dm_date", "dm_zone", "dm_vendor", "dm_weather_dt", "dm_payment_type", "dm_ratecode"]
+FACT_ORDER = "key_date_pickup, key_zone_pickup, pickup_time"
+ROW_GROUP_SIZE = 122_880
+COMPRESSION = "zstd"
+
+Partition = Tuple[int, int]
+
+
+def export_dir(db_path: Path, root: Path = EXPORT_DIR) -> Path:
+    return root / db_path.stem
+
+
+def partition_path(out_dir: Path, year: int, month: int) -> Path:
+    return out_dir / FACT_TABLE / f"year={year}" / f"month={month}" / "data.parquet"
+
+
+def read_manifest(out_dir: Path) -> Dict:
+    path = out_dir / MANIFEST
+    if not path.exists():
+        return {"tables": {}, "partitions": {}}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_manifest(out_dir: Path, manifest: Dict) -> None:
+    tmp = out_dir / (MANIFEST + ".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    os.replace(tmp, out_dir / MANIFEST)
+
+
+def _copy_to_parquet(con: duckdb.DuckDBPyConnection, query: str, path: Path) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    con.execute(f"""
+        COPY ({query}) TO '{tmp.as_posix()}'
+        (FORMAT PARQUET, COMPRESSION {COMPRESSION}, ROW_GROUP_SIZE {ROW_GROUP_SIZE})
+    """)
+    os.replace(tmp, path)
+    return con.execute(f"SELECT COUNT(*) FROM read_parquet('{path.as_posix()}')").fetchone()[0]
+
+
+# ----------------------------
+# RILEVAMENTO DELLE MODIFICHE
+# ----------------------------
+
+def last_execution_times(con: duckdb.DuckDBPyConnection) -> Dict[str, str]:
+    """Ultimo run dbt per tabella; vuoto se la tabella dei run non esiste (es. snapshot)."""
+    found = con.execute("""
+        SELECT schema_name FROM duckdb_tables() WHERE table_name = 'last_execution_times' LIMIT 1
+    """).fetchone()
+    if found is None:
+        return {}
+    rows = con.execute(f'SELECT target_table, time FROM "{found[0]}".last_execution_times').fetchall()
+    return {table: str(ts) for table, ts in rows}
+
+
+def existing_tables(con: duckdb.DuckDBPyConnection) -> List[str]:
+    return [r[0] for r in con.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE schema_name = ?", [SCHEMA]
+    ).fetchall()]
+
+
+def fact_fingerprints(con: duckdb.DuckDBPyConnection) -> Dict[Partition, List[int]]:
+    """
+    Impronta per (anno, mese) di pickup: [righe, max key_taxi_trip, checksum].
+    L'hash a più colonne di DuckDB combina gli hash delle colonne quasi linearmente: nello XOR
+    un numero pari di righe con lo stesso cambio (es. outlier_flags NULL -> 1) si annullerebbe.
+    Il secondo hash() rimescola ogni riga.
+    """
+    rows = con.execute(f"""
+        SELECT
+            COALESCE(d.year, 0) AS year,
+            COALESCE(EXTRACT(MONTH FROM d.date), 0) AS month,
+            COUNT(*) AS n,
+            MAX(f.key_taxi_trip) AS max_key,
+            bit_xor(hash(hash(f.key_taxi_trip, f.key_weather, f.outlier_flags))) AS checksum
+        FROM {SCHEMA}.{FACT_TABLE} AS f
+        LEFT JOIN {SCHEMA}.dm_date AS d ON f.key_date_pickup = d.key_date
+        GROUP BY ALL
+    """).fetchall()
+    return {(int(y), int(m)): [int(n), int(k), int(c)] for y, m, n, k, c in rows}
+
+
+def _partition_query(con: duckdb.DuckDBPyConnection, year: int, month: int) -> str:
+    if year == 0:
+        where = f"key_date_pickup NOT IN (SELECT key_date FROM {SCHEMA}.dm_date)"
+    else:
+        keys = [r[0] for r in con.execute(f"""
+            SELECT key_date FROM {SCHEMA}.dm_date
+            WHERE year = {year} AND EXTRACT(MONTH FROM date) = {month}
+        """).fetchall()]
+        where = f"key_date_pickup IN ({', '.join(str(k) for k in keys)})"
+    return f"SELECT * FROM {SCHEMA}.{FACT_TABLE} WHERE {where} ORDER BY {FACT_ORDER}"
+
+
+# ----------------------------
+# EXPORT
+# ----------------------------
+
+def export_parquet(
+    db_path: Path = DB_PATH,
+    root: Path = EXPORT_DIR,
+    dimensions: Optional[List[str]] = None,
+    full: bool = False,
+) -> Dict:
+    """Esporta (incrementalmente, salvo full=True) fact e dimensioni; ritorna il manifest scritto."""
+    t0 = time.perf_counter()
+    db_path = db_path.resolve()
+    out_dir = export_dir(db_path, root)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    manifest = {"tables": {}, "partitions": {}} if full else read_manifest(out_dir)
+    if full and (out_dir / FACT_TABLE).exists():
+        shutil.rmtree(out_dir / FACT_TABLE)
+
+    con = duckdb.connect(str(db_path), read_only=True)
+    try:
+        runs = last_execution_times(con)
+        tables = existing_tables(con)
+        if FACT_TABLE not in tables:
+            raise RuntimeError(f"{SCHEMA}.{FACT_TABLE} non esiste in {db_path}")
+
+        # ---- dimensioni: un file ciascuna, riscritto se il run dbt è cambiato ----
+        written_tables = []
+        for table in dimensions if dimensions is not None else DIMENSIONS:
+            if table not in tables:
+                continue
+            previous = manifest["tables"].get(table, {})
+            path = out_dir / f"{table}.parquet"
+            if table in runs and previous.get("last_execution") == runs[table] and path.exists():
+                continue
+            rows = _copy_to_parquet(con, f"SELECT * FROM {SCHEMA}.{table}", path)
+            manifest["tables"][table] = {
+                "file": path.relative_to(out_dir).as_posix(),
+                "rows": rows,
+                "last_execution": runs.get(table),
+            }
+            written_tables.append(table)
+
+        # ---- fact: solo i mesi con impronta diversa ----
+        written, removed = [], []
+        fact_run = runs.get(FACT_TABLE)
+        # sempre: outlier_flags (score_outliers.py) cambia senza un run dbt della fact
+        current = fact_fingerprints(con)
+        partitions = manifest["partitions"]
+        for (year, month), fingerprint in sorted(current.items()):
+            key = f"{year}-{month:02d}"
+            path = partition_path(out_dir, year, month)
+            entry = partitions.get(key)
+            if entry is not None and entry["fingerprint"] == fingerprint and path.exists():
+                continue
+            rows = _copy_to_parquet(con, _partition_query(con, year, month), path)
+            partitions[key] = {
+                "file": path.relative_to(out_dir).as_posix(),
+                "rows": rows,
+                "fingerprint": fingerprint,
+                "exported_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            written.append(key)
+        for key in sorted(set(partitions) - {f"{y}-{m:02d}" for y, m in current}):
+            shutil.rmtree((out_dir / partitions.pop(key)["file"]).parent, ignore_errors=True)
+            removed.append(key)
+        manifest["tables"][FACT_TABLE] = {
+            "path": f"{FACT_TABLE}/*/*/*.parquet",
+            "partitioning": ["year", "month"],
+            "sort": FACT_ORDER,
+            "rows": sum(p["rows"] for p in partitions.values()),
+            "last_execution": fact_run,
+        }
+    finally:
+        con.close()
+
+    manifest["source"] = str(db_path)
+    manifest["exported_at"] = datetime.now().isoformat(timespec="seconds")
+    write_manifest(out_dir, manifest)
+    print(f"Export in {out_dir} completato in {time.perf_counter() - t0:.1f}s: "
+          f"{len(written_tables)} dimensioni, {len(written)} partizioni riscritte, "
+          f"{len(removed)} rimosse, {len(manifest['partitions']) - len(written)} invariate.")
+    return manifest
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export incrementale del datamart in Parquet partizionato.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--out", type=Path, default=EXPORT_DIR, help="cartella radice dell'export")
+    parser.add_argument("--dimensions", nargs="*", default=None, help=f"default: {' '.join(DIMENSIONS)}")
+    parser.add_argument("--full", action="store_true", help="riscrive tutto ignorando il manifest")
+    args = parser.parse_args()
+    export_parquet(args.db, args.out, args.dimensions, args.full)
+
+
+if __name__ == "__main__":
+    main()
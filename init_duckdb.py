@@ -6,44 +6,44 @@ DB_PATH = BASE_DIR / 'taxi_trips.duckdb'
 DATA_DIR = BASE_DIR / 'data'
 
 
-def init_duckdb():
-    con = duckdb.connect(str(DB_PATH))
+def init_duckdb(db_path=DB_PATH):
+    con = duckdb.connect(str(db_path))
     con.execute('CREATE SCHEMA IF NOT EXISTS raw;')
     return con
 
 
-def init_zones(con):
+def init_zones(con, data_dir=DATA_DIR):
     con.execute(f"""
             CREATE OR REPLACE VIEW raw.borough AS
             SELECT *
-            FROM read_csv_auto('{DATA_DIR / 'zones/borough.csv'}', header=True);
+            FROM read_csv_auto('{data_dir / 'zones/borough.csv'}', header=True);
             """)
 
     con.execute(f"""
             CREATE OR REPLACE VIEW raw.neighborhood AS
             SELECT *
-            FROM read_csv_auto('{DATA_DIR / 'zones/taxi_zone_lookup.csv'}', header=True);
+            FROM read_csv_auto('{data_dir / 'zones/taxi_zone_lookup.csv'}', header=True);
 
 
         """)
 
 
-def init_taxi_trips(con):
+def init_taxi_trips(con, data_dir=DATA_DIR):
     con.execute(f"""
     CREATE OR REPLACE VIEW raw.taxi_trip AS
     SELECT *
-    FROM read_parquet('{DATA_DIR / 'taxi_trip/*.parquet'}')
+    FROM read_parquet('{data_dir / 'taxi_trip/*.parquet'}')
 
     """)
 
 
-def init_weather(con):
-    manhattan_path = (DATA_DIR / 'weather_dt/Weather_Manhattan/*.csv').as_posix()
-    brooklyn_path = (DATA_DIR / 'weather_dt/Weather_Brooklyn/*.csv').as_posix()
-    bronx_path = (DATA_DIR / 'weather_dt/Weather_Bronx/*.csv').as_posix()
-    queens_path = (DATA_DIR / 'weather_dt/Weather_Queens/*.csv').as_posix()
-    statenisland_path = (DATA_DIR / 'weather_dt/Weather_StatenIsland/*.csv').as_posix()
-    ewr_path = (DATA_DIR / 'weather_dt/Weather_EWR/*.csv').as_posix()
+def init_weather(con, data_dir=DATA_DIR):
+    manhattan_path = (data_dir / 'weather_dt/Weather_Manhattan/*.csv').as_posix()
+    brooklyn_path = (data_dir / 'weather_dt/Weather_Brooklyn/*.csv').as_posix()
+    bronx_path = (data_dir / 'weather_dt/Weather_Bronx/*.csv').as_posix()
+    queens_path = (data_dir / 'weather_dt/Weather_Queens/*.csv').as_posix()
+    statenisland_path = (data_dir / 'weather_dt/Weather_StatenIsland/*.csv').as_posix()
+    ewr_path = (data_dir / 'weather_dt/Weather_EWR/*.csv').as_posix()
 
     con.execute(f"""
     CREATE OR REPLACE VIEW raw.weather AS
@@ -79,10 +79,10 @@ def init_weather(con):
     """)
 
 
-def init_files_dictionary(con):
-    vendor_path = (DATA_DIR / 'taxi_trip/vendor_id.csv')
-    ratecode_path = (DATA_DIR / 'taxi_trip/ratecode_id.csv')
-    payment_type_path = (DATA_DIR / 'taxi_trip/payment_type.csv')
+def init_files_dictionary(con, data_dir=DATA_DIR):
+    vendor_path = (data_dir / 'taxi_trip/vendor_id.csv')
+    ratecode_path = (data_dir / 'taxi_trip/ratecode_id.csv')
+    payment_type_path = (data_dir / 'taxi_trip/payment_type.csv')
     con.execute(f"""
         CREATE OR REPLACE VIEW raw.vendor_id AS
         SELECT *
@@ -0,0 +1,292 @@
+"""
+Manutenzione dello storage del file DuckDB: report, riscrittura ordinata, checkpoint, copia compatta.
+
+Gli incrementali append e delete+insert (dm_zone, dm_vendor, dm_daily_*, ods_taxi_trip) e gli
+UPDATE di score_outliers.py lasciano row group mezzi vuoti, righe cancellate ancora su disco
+e blocchi liberi che il file non restituisce mai: tra un full refresh e l'altro le scansioni
+rallentano e il file cresce.
+
+    python maintenance.py report                 # righe, row group, riempimento, compressione
+    python maintenance.py compact                # riscrive le tabelle frammentate + CHECKPOINT
+    python maintenance.py compact --all          # riscrive tutte le tabelle
+    python maintenance.py checkpoint             # solo FORCE CHECKPOINT (WAL -> file)
+    python maintenance.py copy [--no-backup]     # nuovo file compatto al posto del vecchio
+
+- compact riscrive ogni tabella nel suo ordine di clustering (CLUSTER_KEYS: lo stesso ORDER BY
+  dei modelli dbt, così le zone map sulle chiavi restano strette) in una sola transazione:
+  copia temporanea, DELETE, INSERT. La tabella resta la stessa (niente DROP/RENAME), i
+  row group vecchi, ora interamente cancellati, vengono liberati dal CHECKPOINT finale.
+- I blocchi liberati restano nel file (riusati dai prossimi insert): solo copy restituisce
+  spazio al disco, con COPY FROM DATABASE (tabelle, viste, sequence con il loro valore
+  corrente) in <db>.compact.tmp, verifica dei conteggi e os.replace; il vecchio file resta
+  come <db>.bak salvo --no-backup.
+- Tutti i comandi tranne report richiedono il file libero: dbt, refresh_watch.py e l'API
+  (se legge il DB e non uno snapshot) non devono essere attivi.
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import duckdb
+
+from init_duckdb import DB_PATH
+
+# righe per row group (default DuckDB): misura del riempimento
+ROW_GROUP_SIZE = 122_880
+# ordine di riscrittura: quello di ORDER BY nei modelli (o della chiave di lookup)
+CLUSTER_KEYS = {
+    "dwh_ods.ods_taxi_trip": "pickup_datetime",
+    "dwh_datamart.dm_fact_taxi_trip": "key_date_pickup, key_zone_pickup, pickup_time",
+    "dwh_datamart.dm_trip_narrow": "key_date_pickup, key_zone_pickup",
+    "dwh_datamart.dm_fact_taxi_trip_sample": "key_date_pickup, stratum_borough",
+    "dwh_datamart.dm_daily_metrics": "pickup_date, borough",
+    "dwh_datamart.dm_daily_metrics_rolling": "pickup_date, borough",
+    "dwh_datamart.dm_daily_quantile_sketch": "key_date_pickup, borough, measure, bucket",
+    "dwh_datamart.dm_weather_dt": "key_weather",
+    "dwh_datamart.dm_zone": "key_zone",
+    "dwh_datamart.dm_vendor": "key_vendor",
+}
+# soglie oltre cui compact riscrive una tabella
+MAX_DEAD_FRACTION = 0.10
+MIN_FILL = 0.60
+# byte per valore dei tipi a larghezza fissa (VARCHAR: string_t da 16 byte, inline fino a 12
+# caratteri): stima della dimensione non compressa per il rapporto di compressione
+TYPE_BYTES = {
+    "BOOLEAN": 1, "TINYINT": 1, "UTINYINT": 1, "SMALLINT": 2, "USMALLINT": 2,
+    "INTEGER": 4, "UINTEGER": 4, "DATE": 4, "FLOAT": 4,
+    "BIGINT": 8, "UBIGINT": 8, "DOUBLE": 8, "TIME": 8, "TIMESTAMP": 8, "TIMESTAMP WITH TIME ZONE": 8,
+    "HUGEINT": 16, "UUID": 16, "INTERVAL": 16, "VARCHAR": 16,
+}
+
+
+def _type_bytes(data_type: str) -> int:
+    if data_type.startswith("DECIMAL"):
+        precision = int(data_type[len("DECIMAL("):].split(",")[0])
+        return 2 if precision <= 4 else 4 if precision <= 9 else 8 if precision <= 18 else 16
+    return TYPE_BYTES.get(data_type, 8)
+
+
+@dataclass
+class TableStorage:
+    table: str
+    rows: int
+    stored_rows: int
+    row_groups: int
+    blocks: int
+    block_size: int
+    raw_bytes: int
+    updated_segments: int
+
+    @property
+    def dead_rows(self) -> int:
+        """Righe cancellate ma ancora nei row group (liberate solo dal checkpoint/riscrittura)."""
+        return self.stored_rows - self.rows
+
+    @property
+    def fill(self) -> float:
+        """Righe vive / capacità dei row group occupati."""
+        return self.rows / (self.row_groups * ROW_GROUP_SIZE) if self.row_groups else 1.0
+
+    @property
+    def disk_bytes(self) -> int:
+        # stima: i blocchi parziali possono essere condivisi tra tabelle piccole
+        return self.blocks * self.block_size
+
+    @property
+    def compression(self) -> Optional[float]:
+        # sotto i due blocchi la tabella divide blocchi parziali con altre: stima senza senso
+        return self.raw_bytes / self.disk_bytes if self.blocks >= 2 else None
+
+    @property
+    def fragmented(self) -> bool:
+        dead = self.dead_rows / self.stored_rows if self.stored_rows else 0.0
+        # una tabella da un solo row group non può essere più compatta di così
+        sparse = self.row_groups > math.ceil(self.rows / ROW_GROUP_SIZE) and self.fill < MIN_FILL
+        return dead > MAX_DEAD_FRACTION or sparse or self.updated_segments > 0
+
+
+def list_tables(con: duckdb.DuckDBPyConnection, indexed: bool = True) -> List[str]:
+    """Tabelle del file; indexed=False esclude quelle con chiavi o indici."""
+    rows = con.execute(f"""
+        SELECT schema_name, table_name FROM duckdb_tables()
+        WHERE database_name = current_database() AND NOT internal AND NOT temporary
+          {'' if indexed else 'AND NOT has_primary_key AND index_count = 0'}
+        ORDER BY schema_name, table_name
+    """).fetchall()
+    return [f"{schema}.{table}" for schema, table in rows]
+
+
+def table_storage(con: duckdb.DuckDBPyConnection, table: str) -> TableStorage:
+    schema, name = table.split(".")
+    block_size = con.execute("SELECT block_size FROM pragma_database_size() WHERE database_name = current_database()").fetchone()[0]
+    stored_rows, row_groups, blocks, updated = con.execute(f"""
+        SELECT
+            COALESCE(SUM(count) FILTER (WHERE column_id = 0 AND column_path = '[0]'), 0),
+            COUNT(DISTINCT row_group_id),
+            COUNT(DISTINCT block_id) FILTER (WHERE block_id >= 0),
+            COUNT(*) FILTER (WHERE has_updates)
+        FROM pragma_storage_info('{table}')
+    """).fetchone()
+    widths = con.execute("""
+        SELECT data_type FROM duckdb_columns()
+        WHERE database_name = current_database() AND schema_name = ? AND table_name = ?
+    """, [schema, name]).fetchall()
+    rows = con.execute(f'SELECT COUNT(*) FROM "{schema}"."{name}"').fetchone()[0]
+    return TableStorage(
+        table=table,
+        rows=rows,
+        # tabella mai scritta su disco (solo WAL): nessun segmento persistente
+        stored_rows=max(int(stored_rows), rows),
+        row_groups=row_groups,
+        blocks=blocks,
+        block_size=block_size,
+        raw_bytes=int(stored_rows) * sum(_type_bytes(t) for (t,) in widths),
+        updated_segments=updated,
+    )
+
+
+def storage_report(con: duckdb.DuckDBPyConnection) -> List[TableStorage]:
+    return [table_storage(con, t) for t in list_tables(con)]
+
+
+def print_report(con: duckdb.DuckDBPyConnection, stats: List[TableStorage]) -> None:
+    print(f"{'tabella':44} {'righe':>12} {'cancellate':>10} {'rg':>5} {'riemp.':>7} {'MiB':>9} {'compr.':>7}")
+    for s in stats:
+        ratio = f"{s.compression:.1f}x" if s.compression else "-"
+        flag = "  *" if s.fragmented else ""
+        print(f"{s.table:44} {s.rows:>12,} {s.dead_rows:>10,} {s.row_groups:>5} {s.fill:>7.0%} "
+              f"{s.disk_bytes / 2**20:>9.1f} {ratio:>7}{flag}")
+    size, block_size, total, used, free, wal = con.execute("""
+        SELECT database_size, block_size, total_blocks, used_blocks, free_blocks, wal_size
+        FROM pragma_database_size() WHERE database_name = current_database()
+    """).fetchone()
+    print(f"\nFile: {size} ({total:,} blocchi da {block_size // 1024} KiB, {used:,} usati, "
+          f"{free:,} liberi = {free * block_size / 2**20:.1f} MiB recuperabili con `copy`); WAL: {wal}")
+    if any(s.fragmented for s in stats):
+        print("* frammentata: `compact` la riscrive")
+
+
+def rewrite_table(con: duckdb.DuckDBPyConnection, table: str) -> int:
+    """Riscrive la tabella nel suo ordine di clustering, in una transazione; ritorna le righe."""
+    schema, name = table.split(".")
+    order = f"ORDER BY {CLUSTER_KEYS[table]}" if table in CLUSTER_KEYS else ""
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f'CREATE TEMP TABLE __maintenance_rewrite AS SELECT * FROM "{schema}"."{name}" {order}')
+        con.execute(f'DELETE FROM "{schema}"."{name}"')
+        con.execute(f'INSERT INTO "{schema}"."{name}" SELECT * FROM __maintenance_rewrite')
+        rows = con.execute(f'SELECT COUNT(*) FROM "{schema}"."{name}"').fetchone()[0]
+        con.execute("DROP TABLE __maintenance_rewrite")
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    return rows
+
+
+def compact(db_path: Path = DB_PATH, tables: Optional[List[str]] = None, rewrite_all: bool = False) -> Dict[str, int]:
+    """Riscrive le tabelle frammentate (o `tables`, o tutte) e fa il checkpoint."""
+    t0 = time.perf_counter()
+    con = duckdb.connect(str(db_path))
+    rewritten: Dict[str, int] = {}
+    try:
+        # DELETE + INSERT delle stesse chiavi nella stessa transazione viola i vincoli
+        # (limite degli indici DuckDB): le tabelle con chiavi, piccole tabelle di servizio
+        # come last_execution_times, restano fuori
+        rewritable = list_tables(con, indexed=False)
+        if tables:
+            unknown = set(tables) - set(rewritable)
+            if unknown:
+                raise ValueError(f"Tabelle inesistenti o con chiavi/indici: {sorted(unknown)}")
+            selected = tables
+        else:
+            selected = [s.table for s in storage_report(con) if s.table in rewritable and (rewrite_all or s.fragmented)]
+        for table in selected:
+            t = time.perf_counter()
+            rewritten[table] = rewrite_table(con, table)
+            print(f"  {table}: {rewritten[table]:,} righe riscritte in {time.perf_counter() - t:.1f}s")
+        con.execute("FORCE CHECKPOINT")
+    finally:
+        con.close()
+    print(f"Compattazione di {db_path.name}: {len(rewritten)} tabelle in {time.perf_counter() - t0:.1f}s.")
+    return rewritten
+
+
+def checkpoint(db_path: Path = DB_PATH) -> None:
+    con = duckdb.connect(str(db_path))
+    try:
+        con.execute("FORCE CHECKPOINT")
+    finally:
+        con.close()
+    print(f"Checkpoint di {db_path.name} eseguito.")
+
+
+def compact_copy(db_path: Path = DB_PATH, backup: bool = True) -> Path:
+    """Ricostruisce il file in una copia compatta e la sostituisce all'originale."""
+    t0 = time.perf_counter()
+    db_path = db_path.resolve()
+    before = db_path.stat().st_size
+    checkpoint(db_path)  # il WAL finisce nel file prima della copia
+
+    tmp = db_path.with_name(db_path.stem + ".compact.tmp")
+    tmp.unlink(missing_ok=True)
+    con = duckdb.connect(str(tmp))
+    try:
+        target = con.execute("SELECT current_database()").fetchone()[0]
+        con.execute(f"ATTACH '{db_path.as_posix()}' AS src (READ_ONLY)")
+        con.execute(f'COPY FROM DATABASE src TO "{target}"')
+        tables = con.execute("""
+            SELECT schema_name, table_name FROM duckdb_tables() WHERE database_name = 'src'
+        """).fetchall()
+        for schema, name in tables:
+            src, dst = (con.execute(f'SELECT COUNT(*) FROM {db}."{schema}"."{name}"').fetchone()[0]
+                        for db in ("src", f'"{target}"'))
+            if src != dst:
+                raise RuntimeError(f"Copia incompleta di {schema}.{name}: {dst:,} righe su {src:,}")
+        con.execute("DETACH src")
+        con.execute("CHECKPOINT")
+        con.close()
+        if backup:
+            os.replace(db_path, db_path.with_name(db_path.name + ".bak"))
+        os.replace(tmp, db_path)
+    finally:
+        con.close()
+        tmp.unlink(missing_ok=True)
+        Path(str(tmp) + ".wal").unlink(missing_ok=True)
+    after = db_path.stat().st_size
+    print(f"Copia compatta di {db_path.name} in {time.perf_counter() - t0:.1f}s: "
+          f"{before / 2**20:.1f} -> {after / 2**20:.1f} MiB ({len(tables)} tabelle).")
+    return db_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Manutenzione dello storage del file DuckDB.")
+    parser.add_argument("command", choices=["report", "compact", "checkpoint", "copy"])
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--tables", nargs="+", default=None, help="compact: tabelle schema.tabella da riscrivere")
+    parser.add_argument("--all", action="store_true", help="compact: riscrive tutte le tabelle")
+    parser.add_argument("--no-backup", action="store_true", help="copy: non conserva il vecchio file come .bak")
+    args = parser.parse_args()
+
+    if args.command == "report":
+        con = duckdb.connect(str(args.db), read_only=True)
+        try:
+            print_report(con, storage_report(con))
+        finally:
+            con.close()
+    elif args.command == "compact":
+        compact(args.db, args.tables, args.all)
+    elif args.command == "checkpoint":
+        checkpoint(args.db)
+    else:
+        compact_copy(args.db, backup=not args.no_backup)
+
+
+if __name__ == "__main__":
+    main()
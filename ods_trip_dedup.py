@@ -0,0 +1,271 @@
+"""
+Caricamento incrementale di dwh_ods.ods_taxi_trip con Bloom filter per mese.
+
+Il modello dbt rilegge un giorno di sovrapposizione (max(pickup_datetime) - 1 day) e lascia
+al merge su id_trip lo scarto dei duplicati: a ogni run la chiave unica viene confrontata
+con tutta la tabella. Qui ogni mese di pickup ha un Bloom filter persistente sugli id_trip
+(hash DuckDB a 64 bit, double hashing) e il batch in arrivo si divide in:
+
+- righe "sicuramente nuove" (almeno un bit a zero): accodate senza altri controlli;
+- righe "forse duplicate": controllo esatto su id_trip, limitato all'intervallo di pickup
+  di queste sole righe (zone map), tipicamente il giorno di sovrapposizione.
+
+Il costo della deduplica dipende dal batch, non dalla dimensione della ODS.
+I filtri si salvano prima del COMMIT: se il COMMIT fallisce contengono chiavi in più
+(falsi positivi, innocui), mai chiavi in meno. Un filtro il cui conteggio non coincide
+con le righe del mese (caricamenti fatti da dbt o da build_ods_parallel.py) viene ricostruito.
+
+A differenza del merge di dbt, i trip già presenti non vengono riscritti: la riga caricata
+per prima resta (con il suo last_update) e non viene ripassata ai modelli del datamart.
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from build_ods_parallel import ODS_SCHEMA, ODS_TABLE, _month_bounds, render_model_sql
+from init_duckdb import BASE_DIR, DB_PATH
+
+BLOOM_DIR = BASE_DIR / "bloom" / ODS_TABLE
+FALSE_POSITIVE_RATE = 0.01
+# capacità minima e margine di crescita di un filtro (mesi caricati a più riprese)
+MIN_CAPACITY = 100_000
+GROWTH = 2.0
+
+
+@dataclass
+class BloomFilter:
+    """Bloom filter su hash a 64 bit: k posizioni per chiave da h1 + i * h2 (double hashing)."""
+    capacity: int
+    fp_rate: float = FALSE_POSITIVE_RATE
+    count: int = 0
+    bits: np.ndarray = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        self.m = max(64, int(math.ceil(-self.capacity * math.log(self.fp_rate) / math.log(2) ** 2)))
+        self.k = max(1, int(round(self.m / self.capacity * math.log(2))))
+        if self.bits is None:
+            self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, hashes: np.ndarray) -> np.ndarray:
+        hashes = hashes.astype(np.uint64, copy=False)
+        h1 = hashes & np.uint64(0xFFFFFFFF)
+        h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+        i = np.arange(self.k, dtype=np.uint64)
+        return (h1[:, None] + i[None, :] * h2[:, None]) % np.uint64(self.m)
+
+    def add(self, hashes: np.ndarray) -> None:
+        pos = self._positions(hashes).ravel()
+        np.bitwise_or.at(self.bits, pos >> np.uint64(3), (1 << (pos & np.uint64(7))).astype(np.uint8))
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        if len(hashes) == 0:
+            return np.zeros(0, dtype=bool)
+        pos = self._positions(hashes)
+        return ((self.bits[pos >> np.uint64(3)] >> (pos & np.uint64(7)).astype(np.uint8)) & 1).all(axis=1)
+
+    def save(self, path: Path) -> None:
+        """Scrittura atomica (file temporaneo + os.replace)."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(tmp, bits=self.bits, capacity=self.capacity, fp_rate=self.fp_rate,
+                 count=self.count, duckdb_version=duckdb.__version__)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["BloomFilter"]:
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            # hash() di DuckDB non è garantito stabile tra versioni
+            if str(data["duckdb_version"]) != duckdb.__version__:
+                return None
+            return cls(capacity=int(data["capacity"]), fp_rate=float(data["fp_rate"]),
+                       count=int(data["count"]), bits=data["bits"])
+
+
+def filter_path(month: date, bloom_dir: Path = BLOOM_DIR) -> Path:
+    return bloom_dir / f"{month:%Y-%m}.npz"
+
+
+def invalidate(months: Iterable[date], bloom_dir: Path = BLOOM_DIR) -> None:
+    """Elimina i filtri dei mesi riscritti (verranno ricostruiti al primo caricamento)."""
+    for month in months:
+        filter_path(month, bloom_dir).unlink(missing_ok=True)
+
+
+def _month_hashes(con: duckdb.DuckDBPyConnection, month: date) -> np.ndarray:
+    start, end = _month_bounds(month)
+    return con.execute(f"""
+        SELECT hash(id_trip) AS h
+        FROM {ODS_SCHEMA}.{ODS_TABLE}
+        WHERE pickup_datetime >= TIMESTAMP '{start}' AND pickup_datetime < TIMESTAMP '{end}'
+    """).fetchnumpy()["h"]
+
+
+def _month_count(con: duckdb.DuckDBPyConnection, month: date) -> int:
+    start, end = _month_bounds(month)
+    return con.execute(f"""
+        SELECT COUNT(*) FROM {ODS_SCHEMA}.{ODS_TABLE}
+        WHERE pickup_datetime >= TIMESTAMP '{start}' AND pickup_datetime < TIMESTAMP '{end}'
+    """).fetchone()[0]
+
+
+def _load_or_rebuild(
+    con: duckdb.DuckDBPyConnection, month: date, incoming: int, bloom_dir: Path
+) -> BloomFilter:
+    """Filtro del mese, ricostruito dalla ODS se manca, è obsoleto o non ha capacità sufficiente."""
+    bloom = BloomFilter.load(filter_path(month, bloom_dir))
+    if bloom is not None and bloom.count == _month_count(con, month) and bloom.count + incoming <= bloom.capacity:
+        return bloom
+    existing = _month_hashes(con, month)
+    bloom = BloomFilter(capacity=max(MIN_CAPACITY, int((len(existing) + incoming) * GROWTH)))
+    bloom.add(existing)
+    bloom.count = len(existing)
+    return bloom
+
+
+# ----------------------------
+# CARICAMENTO INCREMENTALE
+# ----------------------------
+
+def append_new_trips(
+    db_path: Path = DB_PATH,
+    overlap_days: int = 1,
+    bloom_dir: Path = BLOOM_DIR,
+    files: Optional[List[Path]] = None,
+) -> Dict[str, int]:
+    """
+    Accoda a ods_taxi_trip i trip raw con pickup >= max(pickup_datetime) - overlap_days,
+    scartando quelli già presenti. Stessa trasformazione del modello dbt (render_model_sql).
+    Con `files` il batch sono soltanto quei parquet raw, per intero (refresh_watch.py).
+    """
+    t0 = time.perf_counter()
+    con = duckdb.connect(str(db_path))
+    try:
+        exists = con.execute(
+            "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?",
+            [ODS_SCHEMA, ODS_TABLE],
+        ).fetchone()[0]
+        if not exists:
+            raise RuntimeError(
+                f"{ODS_SCHEMA}.{ODS_TABLE} non esiste: primo caricamento con dbt o build_ods_parallel.py"
+            )
+        if files:
+            file_list = ", ".join(f"'{Path(f).as_posix()}'" for f in files)
+            source = f"(SELECT * FROM read_parquet([{file_list}])) AS src_batch"
+        else:
+            source = f"""(
+                SELECT *
+                FROM raw.taxi_trip
+                WHERE tpep_pickup_datetime >= (
+                    SELECT COALESCE(MAX(pickup_datetime), TIMESTAMP '2000-01-01') - INTERVAL {int(overlap_days)} DAY
+                    FROM {ODS_SCHEMA}.{ODS_TABLE}
+                )
+            ) AS src_batch"""
+        sql = render_model_sql(source, f"{ODS_SCHEMA}.ods_neighborhood")
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            con.execute(f"""
+                CREATE TEMP TABLE batch AS
+                SELECT *, row_number() OVER () AS _rn, hash(id_trip) AS _h
+                FROM ({sql})
+            """)
+            keys = con.execute("""
+                SELECT _rn, _h, CAST(date_trunc('month', pickup_datetime) AS DATE) AS month
+                FROM batch
+            """).df()
+
+            # split per mese: sicuramente nuove / forse duplicate
+            filters: Dict[date, BloomFilter] = {}
+            maybe = np.zeros(len(keys), dtype=bool)
+            for month, idx in keys.groupby("month").indices.items():
+                month = pd.Timestamp(month).date()
+                filters[month] = _load_or_rebuild(con, month, len(idx), bloom_dir)
+                maybe[idx] = filters[month].contains(keys["_h"].to_numpy()[idx])
+
+            con.register("maybe_rows", pd.DataFrame({"_rn": keys["_rn"].to_numpy()[maybe]}))
+            con.execute("""
+                CREATE TEMP TABLE maybe_batch AS
+                SELECT b.* FROM batch b SEMI JOIN maybe_rows m ON b._rn = m._rn
+            """)
+            # controllo esatto solo sull'intervallo di pickup delle righe dubbie
+            lo, hi = con.execute("SELECT MIN(pickup_datetime), MAX(pickup_datetime) FROM maybe_batch").fetchone()
+            duplicates = pd.DataFrame({"_rn": pd.Series([], dtype="int64")})
+            if lo is not None:
+                duplicates = con.execute(f"""
+                    SELECT b._rn
+                    FROM maybe_batch b
+                    SEMI JOIN (
+                        SELECT id_trip FROM {ODS_SCHEMA}.{ODS_TABLE}
+                        WHERE pickup_datetime BETWEEN TIMESTAMP '{lo}' AND TIMESTAMP '{hi}'
+                    ) o ON o.id_trip = b.id_trip
+                """).df()
+            con.register("duplicate_rows", duplicates)
+
+            con.execute(f"""
+                INSERT INTO {ODS_SCHEMA}.{ODS_TABLE} BY NAME
+                SELECT * EXCLUDE (_rn, _h)
+                FROM batch
+                ANTI JOIN duplicate_rows d ON batch._rn = d._rn
+                ORDER BY pickup_datetime
+            """)
+
+            inserted = keys[~keys["_rn"].isin(duplicates["_rn"])]
+            for month, idx in inserted.groupby("month").indices.items():
+                bloom = filters[pd.Timestamp(month).date()]
+                bloom.add(inserted["_h"].to_numpy()[idx])
+                bloom.count += len(idx)
+            # prima i filtri, poi il COMMIT: un filtro può solo avere chiavi in più
+            for month, bloom in filters.items():
+                bloom.save(filter_path(month, bloom_dir))
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        con.close()
+
+    stats = {
+        "batch_rows": len(keys),
+        "definitely_new": int((~maybe).sum()),
+        "maybe_duplicate": int(maybe.sum()),
+        "duplicates": len(duplicates),
+        "inserted": len(inserted),
+        "months": len(filters),
+    }
+    false_pos = stats["maybe_duplicate"] - stats["duplicates"]
+    print(f"Batch di {stats['batch_rows']:,} righe su {stats['months']} mesi: "
+          f"{stats['definitely_new']:,} sicuramente nuove, {stats['maybe_duplicate']:,} da verificare "
+          f"({stats['duplicates']:,} duplicati, {false_pos:,} falsi positivi); "
+          f"{stats['inserted']:,} righe accodate in {time.perf_counter() - t0:.1f}s.")
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Caricamento incrementale di dwh_ods.ods_taxi_trip con deduplica via Bloom filter."
+    )
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--overlap-days", type=int, default=1,
+                        help="giorni riletti prima del max(pickup_datetime) (come il modello dbt)")
+    parser.add_argument("--bloom-dir", type=Path, default=BLOOM_DIR)
+    parser.add_argument("--files", type=Path, nargs="+", default=None,
+                        help="carica solo questi parquet raw (invece della finestra su raw.taxi_trip)")
+    args = parser.parse_args()
+    append_new_trips(args.db, args.overlap_days, args.bloom_dir, args.files)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import inspect
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import duckdb
+import pandas as pd
+
+from chart_filters import ChartFilter
+from chart_registry import QUERIES, WEATHER_CATEGORIES, get_query
+from query_governor import QueryCancelled, QueryGovernor, QueryQueueFull, QueryTimeout, default_governor
+from query_profiler import QueryProfiler
+
+ARROW_MIME = "application/vnd.apache.arrow.stream"
+# parametro HTTP -> campo di ChartFilter (filtro spinto nella query, non sul risultato)
+FILTER_PARAMS = {
+    "start_date": "start_date",
+    "end_date": "end_date",
+    "borough": "pickup_borough",
+    "dropoff_borough": "dropoff_borough",
+    "vendor": "vendor",
+}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           406: "Not Acceptable", 500: "Internal Server Error", 503: "Service Unavailable",
+           504: "Gateway Timeout"}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class _Generation:
+    """Connessione su un file (DB o snapshot) con le classi dei grafici costruite su di essa."""
+    path: Path
+    connection: duckdb.DuckDBPyConnection
+    charts: Dict[Tuple[str, str], Any] = field(default_factory=dict)
+    active: int = 0
+    retired: bool = False
+
+
+class DatamartApi:
+    """
+    Server HTTP asyncio (solo libreria standard) che espone le query q_*/load_*
+    del registry come JSON o Arrow.
+
+    - Una connessione DuckDB read-only condivisa; ogni query usa un cursor.
+      Se è pubblicato uno snapshot (publish_snapshot.py) la connessione è sullo snapshot
+      corrente: a ogni richiesta si controlla il puntatore e, se è cambiato, le nuove query
+      vanno sul nuovo file mentre quelle in corso finiscono sul vecchio (chiuso dopo).
+    - Le query girano in un pool di thread limitato (`workers`): l'event loop
+      non si blocca mai su DuckDB.
+    - Richieste identiche concorrenti condividono la stessa esecuzione
+      (request coalescing): il risultato viene calcolato una volta sola.
+    - Il formato arrow richiede pyarrow (opzionale).
+    - Con un `profiler` le query sono strumentate; /stats espone i percentili.
+    - Con use_shards=True le aggregazioni convertibili girano sugli shard Parquet
+      (build_shards.py) in un pool di processi condiviso, non nei thread DuckDB.
+    - Con un `governor` (QueryGovernor) le query pesanti passano da una coda limitata e
+      hanno un timeout: 504 se interrotte, 503 se la coda non si libera in tempo.
+      /health riporta lo stato della coda.
+    """
+
+    def __init__(
+        self,
+        db_filename: str = "taxi_trips.duckdb",
+        project_root: Optional[Path] = None,
+        workers: int = 4,
+        max_pending: int = 64,
+        profiler: Optional[QueryProfiler] = None,
+        use_shards: bool = False,
+        governor: Optional[QueryGovernor] = None,
+    ) -> None:
+        self.db_filename = db_filename
+        self.project_root = project_root
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="duckdb")
+        self.max_pending = max_pending
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._probe = None
+        self._generation: Optional[_Generation] = None
+        self.stats = {"executed": 0, "coalesced": 0}
+        self.profiler = profiler or QueryProfiler.from_env()
+        self.use_shards = use_shards
+        self.governor = governor or default_governor()
+
+    # -------------------------
+    # DUCKDB
+    # -------------------------
+
+    def open(self) -> None:
+        spec = QUERIES[0]
+        self._probe = spec.build(db_filename=self.db_filename, project_root=self.project_root, show=False)
+        self._release(self._acquire())
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+        with self._lock:
+            if self._generation is not None:
+                self._generation.connection.close()
+                self._generation = None
+
+    def _acquire(self) -> "_Generation":
+        """Connessione sul file corrente (snapshot o DB); apre la nuova se il puntatore è cambiato."""
+        path = self._probe.current_db_path()
+        with self._lock:
+            current = self._generation
+            if current is None or current.path != path:
+                if current is not None:
+                    current.retired = True
+                    if current.active == 0:
+                        current.connection.close()
+                current = self._generation = _Generation(path, duckdb.connect(str(path), read_only=True))
+            current.active += 1
+            return current
+
+    def _release(self, generation: "_Generation") -> None:
+        with self._lock:
+            generation.active -= 1
+            if generation.retired and generation.active == 0:
+                generation.connection.close()
+
+    def _chart(self, generation: "_Generation", module: str, chart_class: str):
+        key = (module, chart_class)
+        with self._lock:
+            if key not in generation.charts:
+                spec = next(q for q in QUERIES if (q.module, q.chart_class) == key)
+                generation.charts[key] = spec.build(
+                    db_filename=self.db_filename,
+                    project_root=self.project_root,
+                    show=False,
+                    connection=generation.connection,
+                    profiler=self.profiler,
+                    use_shards=self.use_shards,
+                    governor=self.governor,
+                )
+            return generation.charts[key]
+
+    def _run_query(self, name: str, params: Tuple[Tuple[str, str], ...]) -> pd.DataFrame:
+        """Eseguito nei thread del pool."""
+        generation = self._acquire()
+        try:
+            return self._run_on(generation, name, params)
+        except QueryTimeout as exc:
+            raise ApiError(504, str(exc))
+        except (QueryQueueFull, QueryCancelled) as exc:
+            raise ApiError(503, str(exc))
+        finally:
+            self._release(generation)
+
+    def _run_on(self, generation: "_Generation", name: str, params: Tuple[Tuple[str, str], ...]) -> pd.DataFrame:
+        spec = get_query(name)
+        charts = self._chart(generation, spec.module, spec.chart_class)
+        method = getattr(charts, spec.method)
+        accepted = inspect.signature(method).parameters
+        opts = dict(params)
+
+        kwargs = dict(spec.kwargs)
+        filter_opts = {FILTER_PARAMS[k]: v for k, v in opts.items() if k in FILTER_PARAMS}
+        if opts.get("exclude_outliers") == "true":
+            filter_opts["exclude_outliers"] = True
+        if filter_opts:
+            if "filters" not in accepted:
+                raise ApiError(400, f"{name} non supporta i filtri {sorted(filter_opts)}")
+            kwargs["filters"] = ChartFilter(**filter_opts)
+        if "approx" in opts:
+            if "approx" not in accepted:
+                raise ApiError(400, f"{name} non ha una modalità approssimata")
+            kwargs["approx"] = opts["approx"] == "true"
+        if "weather_category" in opts:
+            if "intensity_col" not in accepted:
+                raise ApiError(400, f"{name} non supporta il parametro weather_category")
+            kwargs["intensity_col"] = opts["weather_category"]
+        elif "intensity_col" in accepted and "intensity_col" not in kwargs:
+            raise ApiError(400, f"{name} richiede il parametro weather_category")
+
+        return method(**kwargs)
+
+    # -------------------------
+    # PARAMETRI
+    # -------------------------
+
+    @staticmethod
+    def _parse_params(query_string: str) -> Tuple[Tuple[str, str], ...]:
+        raw = {k: v[-1] for k, v in parse_qs(query_string, keep_blank_values=False).items()}
+        params: Dict[str, str] = {}
+        for key in ("start_date", "end_date"):
+            if key in raw:
+                try:
+                    params[key] = date.fromisoformat(raw[key]).isoformat()
+                except ValueError:
+                    raise ApiError(400, f"{key} non è una data ISO (YYYY-MM-DD): {raw[key]}")
+        for key in ("borough", "dropoff_borough", "vendor"):
+            if key in raw:
+                params[key] = raw[key].strip().lower()
+        if "weather_category" in raw:
+            if raw["weather_category"] not in WEATHER_CATEGORIES:
+                raise ApiError(400, f"weather_category deve essere uno di {WEATHER_CATEGORIES}")
+            params["weather_category"] = raw["weather_category"]
+        for key in ("approx", "exclude_outliers"):
+            if key in raw:
+                if raw[key].lower() not in ("1", "true", "0", "false"):
+                    raise ApiError(400, f"{key} deve essere true/false")
+                params[key] = "true" if raw[key].lower() in ("1", "true") else "false"
+        unknown = set(raw) - set(params) - {"format"}
+        if unknown:
+            raise ApiError(400, f"Parametri non supportati: {sorted(unknown)}")
+        # tupla ordinata: chiave stabile per il coalescing
+        return tuple(sorted(params.items()))
+
+    # -------------------------
+    # ESECUZIONE (coalescing)
+    # -------------------------
+
+    async def query(self, name: str, params: Tuple[Tuple[str, str], ...]) -> pd.DataFrame:
+        key = (name, params)
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(fut)
+
+        if len(self._inflight) >= self.max_pending:
+            raise ApiError(503, "Troppe query in coda, riprova più tardi")
+
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self.executor, self._run_query, name, params)
+        self._inflight[key] = fut
+        fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        self.stats["executed"] += 1
+        return await asyncio.shield(fut)
+
+    @staticmethod
+    def _to_arrow(df: pd.DataFrame) -> bytes:
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ApiError(406, "Formato arrow non disponibile: installa pyarrow")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+    async def handle_path(self, target: str) -> Tuple[int, str, bytes]:
+        url = urlsplit(target)
+        path = unquote(url.path).rstrip("/") or "/"
+
+        if path == "/health":
+            body = {"status": "ok", "inflight": len(self._inflight), **self.stats}
+            if self._generation is not None:
+                body["db"] = self._generation.path.name
+            if self.governor is not None:
+                body["governor"] = self.governor.stats()
+            return 200, "application/json", json.dumps(body).encode()
+
+        if path == "/stats":
+            if self.profiler is None:
+                raise ApiError(404, "Profiler non attivo (--slow-log / --timing-log)")
+            summary = self.profiler.summary()
+            return 200, "application/json", summary.to_json(orient="records").encode()
+
+        if path in ("/", "/queries"):
+            listing = [
+                {"name": q.name, "method": q.method, "params": self._describe(q.name)}
+                for q in QUERIES
+            ]
+            return 200, "application/json", json.dumps(listing).encode()
+
+        if path.startswith("/query/"):
+            name = path[len("/query/"):]
+            try:
+                get_query(name)
+            except KeyError as exc:
+                raise ApiError(404, str(exc.args[0]))
+            fmt = (parse_qs(url.query).get("format") or ["json"])[-1]
+            if fmt not in ("json", "arrow"):
+                raise ApiError(400, "format deve essere json o arrow")
+
+            df = await self.query(name, self._parse_params(url.query))
+            loop = asyncio.get_running_loop()
+            if fmt == "arrow":
+                return 200, ARROW_MIME, await loop.run_in_executor(self.executor, self._to_arrow, df)
+            payload = await loop.run_in_executor(
+                self.executor, lambda: df.to_json(orient="records", date_format="iso")
+            )
+            return 200, "application/json", payload.encode()
+
+        raise ApiError(404, f"Percorso sconosciuto: {path}")
+
+    def _describe(self, name: str) -> list:
+        spec = get_query(name)
+        module = importlib.import_module(spec.module)
+        accepted = inspect.signature(getattr(getattr(module, spec.chart_class), spec.method)).parameters
+        params = ["format"]
+        if "filters" in accepted:
+            params += list(FILTER_PARAMS) + ["exclude_outliers"]
+        if "intensity_col" in accepted:
+            params.append("weather_category")
+        if "approx" in accepted:
+            params.append("approx")
+        return params
+
+    # -------------------------
+    # HTTP
+    # -------------------------
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        status, ctype, body = 500, "application/json", b""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").strip()
+            # header ignorati: nessun body per le GET
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.split()
+            if len(parts) != 3:
+                raise ApiError(400, "Richiesta HTTP non valida")
+            method, target, _ = parts
+            if method != "GET":
+                raise ApiError(405, "Solo GET")
+            status, ctype, body = await self.handle_path(target)
+        except ApiError as exc:
+            status, body = exc.status, json.dumps({"error": str(exc)}).encode()
+        except Exception as exc:  # noqa: BLE001 - errore della query lato DuckDB
+            status, body = 500, json.dumps({"error": f"{type(exc).__name__}: {exc}"}).encode()
+
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        self.open()
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print(f"API in ascolto su http://{host}:{port} (db: {self.db_filename})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="API HTTP locale sui datamart (JSON/Arrow).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=4, help="thread per le query DuckDB")
+    parser.add_argument("--db", default="taxi_trips.duckdb")
+    parser.add_argument("--slow-log", type=Path, default=None, help="JSONL delle query lente")
+    parser.add_argument("--slow-threshold", type=float, default=1.0, help="soglia query lenta (secondi)")
+    parser.add_argument("--timing-log", type=Path, default=None, help="JSONL con i tempi di ogni query")
+    parser.add_argument("--profile-sample", type=float, default=0.0,
+                        help="frazione di query con profiling DuckDB (0..1)")
+    parser.add_argument("--shards", action="store_true", help="aggregazioni scatter-gather sugli shard Parquet")
+    parser.add_argument("--max-heavy", type=int, default=None, help="query pesanti in parallelo (le altre in coda)")
+    parser.add_argument("--query-timeout", type=float, default=None, help="tempo massimo per query (secondi)")
+    parser.add_argument("--queue-timeout", type=float, default=None, help="attesa massima in coda (secondi)")
+    parser.add_argument("--memory-limit", default=None, help="memory_limit DuckDB (es. 4GB)")
+    args = parser.parse_args()
+
+    profiler = None
+    if args.slow_log or args.timing_log:
+        profiler = QueryProfiler(
+            slow_log=args.slow_log,
+            threshold_s=args.slow_threshold,
+            sample_rate=args.profile_sample,
+            timing_log=args.timing_log,
+        )
+    governor = None
+    if args.max_heavy or args.query_timeout or args.queue_timeout or args.memory_limit:
+        governor = QueryGovernor(
+            max_heavy=args.max_heavy or max(1, args.workers // 2),
+            timeout_s=args.query_timeout,
+            queue_timeout_s=args.queue_timeout,
+            memory_limit=args.memory_limit,
+        )
+    api = DatamartApi(db_filename=args.db, workers=args.workers, profiler=profiler,
+                      use_shards=args.shards, governor=governor)
+    try:
+        asyncio.run(api.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from typing import Dict, List
+
+# Tabella campione stratificato (dwh/models/datamart/dm_fact_taxi_trip_sample.sql)
+SAMPLE_TABLE = "dm_fact_taxi_trip_sample"
+
+# Quantile normale per l'intervallo di confidenza (95%)
+Z_95 = 1.959964
+
+
+def stratified_sql(
+    rows_sql: str,
+    group_cols: List[str],
+    count_name: str,
+    sums: Dict[str, str] | None = None,
+    avgs: Dict[str, str] | None = None,
+    z: float = Z_95,
+) -> str:
+    """
+    Costruisce la query di stima su campione stratificato (date x borough pickup).
+
+    `rows_sql` deve restituire una riga per trip campionato con: le colonne di
+    `group_cols`, le misure usate in `sums`/`avgs`, e le colonne di strato
+    key_date_pickup, stratum_borough, stratum_rows (N_h), stratum_sample_rows (n_h).
+
+    Stimatori (campionamento casuale semplice dentro ogni strato):
+    - conteggi e somme: Horvitz-Thompson, sum_h N_h/n_h * y_h;
+    - medie: stimatore per rapporto Y/X, varianza linearizzata sui residui y - R.
+    Ogni misura <m> esce con <m>_ci_low / <m>_ci_high (intervallo normale a livello z).
+    """
+    sums = sums or {}
+    avgs = avgs or {}
+    measures = sorted(set(sums.values()) | set(avgs.values()))
+    g = ", ".join(group_cols)
+    tg = ", ".join(f"t.{c}" for c in group_cols)
+    join_on = " AND ".join(f"t.{c} IS NOT DISTINCT FROM e.{c}" for c in group_cols)
+
+    part_measures = "".join(
+        f",\n            SUM({m})::DOUBLE AS s_{m},\n            SUM({m} * {m})::DOUBLE AS ss_{m}"
+        for m in measures
+    )
+    est_measures = "".join(
+        f",\n            SUM(w * s_{m}) AS sum_{m},\n            SUM(v * (ss_{m} - s_{m} * s_{m} / n)) AS var_sum_{m}"
+        for m in measures
+    )
+    # d = y - R * x (x = 1 per le righe del gruppo): sum d = s - R c, sum d^2 = ss - 2 R s + R^2 c
+    ratio_measures = "".join(
+        f""",
+                SUM(t.v * (
+                    (t.ss_{m} - 2 * e.r_{m} * t.s_{m} + e.r_{m} * e.r_{m} * t.c)
+                    - (t.s_{m} - e.r_{m} * t.c) * (t.s_{m} - e.r_{m} * t.c) / t.n
+                )) / NULLIF(ANY_VALUE(e.count_est) * ANY_VALUE(e.count_est), 0) AS var_avg_{m}"""
+        for m in avgs.values()
+    )
+    ratio_cols = "".join(f", sum_{m} / NULLIF(count_est, 0) AS r_{m}" for m in avgs.values())
+
+    out = [
+        f"e.count_est AS {count_name}",
+        f"GREATEST(e.count_est - {z} * SQRT(GREATEST(e.var_count, 0)), 0) AS {count_name}_ci_low",
+        f"e.count_est + {z} * SQRT(GREATEST(e.var_count, 0)) AS {count_name}_ci_high",
+    ]
+    for name, m in sums.items():
+        out += [
+            f"e.sum_{m} AS {name}",
+            f"e.sum_{m} - {z} * SQRT(GREATEST(e.var_sum_{m}, 0)) AS {name}_ci_low",
+            f"e.sum_{m} + {z} * SQRT(GREATEST(e.var_sum_{m}, 0)) AS {name}_ci_high",
+        ]
+    for name, m in avgs.items():
+        est = f"e.sum_{m} / NULLIF(e.count_est, 0)"
+        out += [
+            f"{est} AS {name}",
+            f"{est} - {z} * SQRT(GREATEST(r.var_avg_{m}, 0)) AS {name}_ci_low",
+            f"{est} + {z} * SQRT(GREATEST(r.var_avg_{m}, 0)) AS {name}_ci_high",
+        ]
+    out_sql = ",\n            ".join(out)
+    ratio_cte, ratio_join = "", ""
+    if avgs:
+        ratio_cte = f""",
+        ratio AS (
+            SELECT
+                {tg}{ratio_measures}
+            FROM terms t
+            JOIN (SELECT *{ratio_cols} FROM est) e ON {join_on}
+            GROUP BY {tg}
+        )"""
+        ratio_join = "LEFT JOIN ratio r ON " + " AND ".join(
+            f"r.{c} IS NOT DISTINCT FROM e.{c}" for c in group_cols
+        )
+
+    return f"""
+        WITH sampled AS (
+            {rows_sql}
+        ),
+        parts AS (
+            SELECT
+            {g},
+            key_date_pickup,
+            stratum_borough,
+            ANY_VALUE(stratum_rows)::DOUBLE AS big_n,
+            ANY_VALUE(stratum_sample_rows)::DOUBLE AS n,
+            COUNT(*)::DOUBLE AS c{part_measures}
+            FROM sampled
+            GROUP BY {g}, key_date_pickup, stratum_borough
+        ),
+        terms AS (
+            SELECT
+                *,
+                big_n / n AS w,
+                CASE WHEN n > 1 THEN big_n * big_n * (1 - n / big_n) / n / (n - 1) ELSE 0 END AS v
+            FROM parts
+        ),
+        est AS (
+            SELECT
+            {g},
+            SUM(w * c) AS count_est,
+            SUM(v * (c - c * c / n)) AS var_count{est_measures}
+            FROM terms
+            GROUP BY {g}
+        ){ratio_cte}
+        SELECT
+            {", ".join(f"e.{c}" for c in group_cols)},
+            {out_sql}
+        FROM est e
+        {ratio_join}
+    """
@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import json
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import duckdb
+
+from chart_filters import ChartFilter
+from query_governor import CancelToken, QueryGovernor, default_governor
+from query_profiler import QueryProfiler, caller_name
+from sharded import Aggregate, ShardSet
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Estratto pre-joinato fact + dimensioni (dwh/models/datamart/dm_trip_narrow.sql):
+# le query esatte dei grafici lo leggono come singola tabella, senza join.
+NARROW_TABLE = "dm_trip_narrow"
+# Metriche giornaliere per borough di pickup (dm_daily_metrics.sql) e finestre mobili / anno
+# precedente (dm_daily_metrics_rolling.sql): i trend leggono poche migliaia di righe.
+DAILY_METRICS_TABLE = "dm_daily_metrics"
+ROLLING_METRICS_TABLE = "dm_daily_metrics_rolling"
+# Sketch di quantili giornalieri per borough x ora x meteo (dm_daily_quantile_sketch.sql)
+SKETCH_TABLE = "dm_daily_quantile_sketch"
+
+# Snapshot read-only pubblicati da publish_snapshot.py: snapshots/<db>/CURRENT -> file corrente
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_POINTER = "CURRENT"
+
+
+@dataclass
+class QueryRows:
+    """Risultato di _sql con as_rows=True: nomi delle colonne e tuple, senza pandas."""
+    columns: List[str]
+    rows: List[tuple]
+
+    @classmethod
+    def fetch(cls, cursor: duckdb.DuckDBPyConnection) -> "QueryRows":
+        return cls([d[0] for d in cursor.description], cursor.fetchall())
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+def read_snapshot_pointer(pointer: Path, source: Path) -> Optional[Path]:
+    """File dello snapshot corrente di `source`, o None (nessun puntatore, altro DB, file mancante)."""
+    try:
+        info = json.loads(pointer.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    if Path(info.get("source", "")) != source:
+        return None
+    path = pointer.parent / info["snapshot"]
+    return path if path.exists() else None
+
+
+@dataclass
+class ChartBase:
+    """
+    Base comune delle classi di grafici in plots/.
+
+    - Risolve il file DuckDB (default: taxi_trips.duckdb) nel root progetto.
+    - Apre connessioni read-only ed esegue le query verso lo schema `schema`.
+    - Con show=False i grafici vengono solo costruiti e restituiti (uso headless:
+      report, job schedulati), senza aprire il browser.
+    - Se `connection` è valorizzata (es. dal server API) ogni query usa un cursor
+      di quella connessione condivisa invece di riaprire il file DuckDB.
+    - `profiler` (QueryProfiler) strumenta _sql: tempi, righe, slow-query log, profili
+      DuckDB campionati. Se non passato si attiva dalle variabili QUERY_PROFILE_*.
+    - Con use_snapshot=True (default) le query leggono lo snapshot pubblicato in
+      snapshots/<db>/CURRENT, se esiste: nessun conflitto con il lock di dbt sul file.
+      Il puntatore è riletto a ogni connessione, quindi una nuova pubblicazione vale subito.
+    - Con use_shards=True le aggregazioni di _aggregate girano in scatter-gather sugli shard
+      Parquet di build_shards.py (pool di processi, o `shard_executor`), se sono allineati
+      al DB corrente; altrimenti si legge il DB come sempre.
+    - `governor` (QueryGovernor) limita le query: coda per quelle pesanti, timeout
+      (`timeout_s` sovrascrive quello del governor), memoria. Se non passato si usa quello
+      condiviso del processo dalle variabili QUERY_MAX_HEAVY / QUERY_TIMEOUT_S / ..., o
+      uno senza coda né limiti. cancel() (anche da un altro thread) interrompe le query
+      in corso dell'istanza.
+    - Con as_rows=True _sql e _aggregate ritornano QueryRows invece di un DataFrame: per i
+      metodi che non elaborano il risultato (QuerySpec.sql_only) pandas non viene importato.
+    """
+    db_filename: str = "taxi_trips.duckdb"
+    project_root: Optional[Path] = None
+    schema: str = "dwh_datamart"
+    show: bool = True
+    connection: Optional[duckdb.DuckDBPyConnection] = field(default=None, repr=False, compare=False)
+    profiler: Optional[QueryProfiler] = field(default=None, repr=False, compare=False)
+    use_snapshot: bool = True
+    use_shards: bool = False
+    shard_executor: Optional[Executor] = field(default=None, repr=False, compare=False)
+    governor: Optional[QueryGovernor] = field(default=None, repr=False, compare=False)
+    timeout_s: Optional[float] = None
+    as_rows: bool = False
+
+    def __post_init__(self) -> None:
+        if self.project_root is None:
+            # plots/qualcosa.py -> parents[1] = root progetto
+            self.project_root = Path(__file__).resolve().parents[1]
+        self.db_path = (self.project_root / self.db_filename).resolve()
+        self.snapshot_pointer = self.project_root / SNAPSHOT_DIR / self.db_path.stem / SNAPSHOT_POINTER
+        self._read_path = self.db_path
+        self._key_cache: Dict[Tuple[str, str], Tuple[int, ...]] = {}
+        self._shard_checks: Dict[Tuple, bool] = {}
+
+        if not self.db_path.exists() and self.current_db_path() == self.db_path:
+            raise FileNotFoundError(f"DuckDB non trovato: {self.db_path}")
+        if self.profiler is None:
+            self.profiler = QueryProfiler.from_env()
+        if self.governor is None:
+            self.governor = default_governor() or QueryGovernor(max_heavy=None)
+        self._cancel_token = CancelToken()
+
+    def current_db_path(self) -> Path:
+        """File letto dalle query: lo snapshot corrente se pubblicato, altrimenti db_path."""
+        path = None
+        if self.use_snapshot:
+            path = read_snapshot_pointer(self.snapshot_pointer, self.db_path)
+        path = path or self.db_path
+        if path != self._read_path:
+            # nuovo snapshot: le chiavi SCD delle dimensioni possono essere cambiate
+            self._key_cache = {}
+            self._read_path = path
+        return path
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        if self.connection is not None:
+            # chiudere il cursor non chiude la connessione condivisa
+            return self.connection.cursor()
+        return duckdb.connect(str(self.current_db_path()), read_only=True)
+
+    def _sql(self, query: str) -> pd.DataFrame:
+        """Esegue SQL e ritorna un DataFrame, o QueryRows con as_rows (passando da governor e profiler, se attivi)."""
+        fetch = QueryRows.fetch if self.as_rows else None
+        with self._connect() as con, self.governor.run(con, query, self._cancel_token, self.timeout_s):
+            if self.profiler is not None:
+                return self.profiler.execute(con, query, caller_name(), fetch)
+            cursor = con.execute(query)
+            return cursor.df() if fetch is None else fetch(cursor)
+
+    def cancel(self) -> None:
+        """Annulla le query in corso (e in coda) di questa istanza; le successive ripartono."""
+        token, self._cancel_token = self._cancel_token, CancelToken()
+        token.cancel()
+
+    def _aggregate(self, agg: Aggregate, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Esegue un Aggregate su dm_trip_narrow, sugli shard se use_shards e sono allineati."""
+        shards = self._shards() if self.use_shards else None
+        if shards is None:
+            return self._sql(agg.sql(f"{self.schema}.{NARROW_TABLE}"))
+        date_range = filters.date_key_range() if filters else (None, None)
+        # i worker non si possono interrompere: slot nella coda delle pesanti e timeout sull'attesa
+        with self.governor.slot(heavy=True, token=self._cancel_token):
+            timeout_s = self.governor.timeout_s if self.timeout_s is None else self.timeout_s
+            df = shards.aggregate(agg, date_range, timeout_s)
+        if self.as_rows:
+            return QueryRows(list(df.columns), list(df.itertuples(index=False, name=None)))
+        return df
+
+    def _shards(self) -> Optional[ShardSet]:
+        shards = ShardSet.open(self.project_root, self.db_path, self.shard_executor)
+        if shards is None or not shards.manifest.get("shards"):
+            return None
+        path = self.current_db_path()
+        # verifica ripetuta solo se il file o gli shard sono cambiati
+        stamp = (path, path.stat().st_mtime_ns, shards.manifest.get("built_at"))
+        if stamp not in self._shard_checks:
+            sql = f"""
+            SELECT
+              COUNT(*),
+              COALESCE(MAX(key_taxi_trip), -1),
+              COALESCE(bit_xor(hash(hash(key_taxi_trip, key_weather, outlier_flags))), 0)
+            FROM {self.schema}.{NARROW_TABLE}
+            """
+            with self._connect() as con:
+                current = [int(v) for v in con.execute(sql).fetchone()]
+            self._shard_checks[stamp] = current == shards.fingerprint()
+        return shards if self._shard_checks[stamp] else None
+
+    def _show(self, fig):
+        """Mostra il grafico solo in modalità interattiva; ritorna sempre la figura."""
+        if self.show:
+            fig.show()
+        return fig
+
+    # ----------------------------
+    # FILTRI (pushdown sulle chiavi della fact)
+    # ----------------------------
+
+    def _lookup_keys(self, kind: str, value: str) -> Tuple[int, ...]:
+        """Chiavi surrogate (tutte le versioni SCD) per un borough o un vendor."""
+        cache_key = (kind, value.strip().lower())
+        if self.connection is None:
+            # svuota la cache se nel frattempo è stato pubblicato un altro snapshot
+            self.current_db_path()
+        if cache_key not in self._key_cache:
+            # dimensioni piccole: confronto in Python, senza parametri (in DuckDB 0.10 un
+            # execute con parametri importa pandas, che `cli.py query` evita)
+            if kind == "zone":
+                sql = f"SELECT key_zone, lower(borough_name) FROM {self.schema}.dm_zone"
+            else:
+                sql = f"""
+                SELECT key_vendor, lower(vendor_name), CAST(id_vendor AS VARCHAR)
+                FROM {self.schema}.dm_vendor
+                """
+            with self._connect() as con:
+                rows = [r for r in con.execute(sql).fetchall() if cache_key[1] in r[1:]]
+            self._key_cache[cache_key] = tuple(sorted(r[0] for r in rows))
+        return self._key_cache[cache_key]
+
+    @staticmethod
+    def _in_keys(column: str, keys: Tuple[int, ...]) -> str:
+        # nessuna chiave -> nessuna riga (IN () non è SQL valido)
+        return f"{column} IN ({', '.join(map(str, keys))})" if keys else "FALSE"
+
+    @staticmethod
+    def _daily_where(filters: Optional[ChartFilter], alias: str = "d") -> Optional[str]:
+        """
+        Predicati equivalenti sulle tabelle di metriche giornaliere (periodo e borough di pickup).
+        None se il filtro usa dimensioni che lì non ci sono (dropoff, vendor, esclusione
+        degli outlier): si legge la fact.
+        """
+        if filters is None or filters.is_empty:
+            return "TRUE"
+        if filters.dropoff_borough or filters.vendor or filters.exclude_outliers:
+            return None
+        preds = []
+        if filters.start_date:
+            preds.append(f"{alias}.pickup_date >= DATE '{date.fromisoformat(filters.start_date)}'")
+        if filters.end_date:
+            preds.append(f"{alias}.pickup_date < DATE '{date.fromisoformat(filters.end_date)}'")
+        if filters.pickup_borough:
+            borough = filters.pickup_borough.strip().lower().replace("'", "''")
+            preds.append(f"{alias}.borough = '{borough}'")
+        return " AND ".join(preds)
+
+    def _fact_where(self, filters: Optional[ChartFilter], alias: str = "f") -> str:
+        """
+        Traduce il filtro in predicati sulle colonne intere della fact (alias `alias`):
+        key_date_pickup per il periodo, key_zone_* e key_vendor risolte sulle dimensioni.
+        """
+        if filters is None or filters.is_empty:
+            return "TRUE"
+        preds = filters.date_key_predicates(f"{alias}.key_date_pickup")
+        if filters.pickup_borough:
+            preds.append(self._in_keys(f"{alias}.key_zone_pickup", self._lookup_keys("zone", filters.pickup_borough)))
+        if filters.dropoff_borough:
+            preds.append(self._in_keys(f"{alias}.key_zone_dropoff", self._lookup_keys("zone", filters.dropoff_borough)))
+        if filters.vendor:
+            preds.append(self._in_keys(f"{alias}.key_vendor", self._lookup_keys("vendor", filters.vendor)))
+        if filters.exclude_outliers:
+            # NULL = trip non ancora valutato da score_outliers.py
+            preds.append(f"COALESCE({alias}.outlier_flags, 0) = 0")
+        return " AND ".join(preds)
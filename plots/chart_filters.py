@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from datetime import date
+from typing import Optional, Tuple
+
+
+def _date_key(value: str) -> int:
+    """'2024-06-15' -> 20240615 (stesso formato di dm_date.key_date)."""
+    return int(date.fromisoformat(value).strftime("%Y%m%d"))
+
+
+@dataclass(frozen=True)
+class ChartFilter:
+    """
+    Filtro comune a tutte le query dei grafici.
+
+    - start_date incluso, end_date escluso (formato ISO 'YYYY-MM-DD').
+    - pickup_borough / dropoff_borough: nome del borough (case-insensitive).
+    - vendor: vendor_name oppure id_vendor.
+    - exclude_outliers: esclude i trip segnalati da score_outliers.py (outlier_flags != 0).
+
+    Le classi di grafici lo traducono in predicati sulle chiavi intere della fact
+    (key_date_pickup, key_zone_pickup/dropoff, key_vendor), così il filtro viene
+    applicato alla scansione della fact prima dei join con le dimensioni.
+    """
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    pickup_borough: Optional[str] = None
+    dropoff_borough: Optional[str] = None
+    vendor: Optional[str] = None
+    exclude_outliers: bool = False
+
+    def __post_init__(self) -> None:
+        # valida subito le date: finiscono nel SQL come interi
+        for value in (self.start_date, self.end_date):
+            if value is not None:
+                _date_key(value)
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(
+            (self.start_date, self.end_date, self.pickup_borough, self.dropoff_borough, self.vendor,
+             self.exclude_outliers)
+        )
+
+    def with_defaults(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> "ChartFilter":
+        """Completa il periodo solo se il filtro non ne specifica già uno."""
+        return replace(
+            self,
+            start_date=self.start_date or start_date,
+            end_date=self.end_date or end_date,
+        )
+
+    def date_key_predicates(self, column: str) -> list:
+        preds = []
+        if self.start_date:
+            preds.append(f"{column} >= {_date_key(self.start_date)}")
+        if self.end_date:
+            preds.append(f"{column} < {_date_key(self.end_date)}")
+        return preds
+
+    def date_key_range(self) -> Tuple[Optional[int], Optional[int]]:
+        """(key_date_pickup minima inclusa, massima esclusa); None dove il periodo è aperto."""
+        return (
+            _date_key(self.start_date) if self.start_date else None,
+            _date_key(self.end_date) if self.end_date else None,
+        )
+
+    def weather_predicates(self, alias: str = "w") -> str:
+        """Predicati equivalenti su dm_weather_dt (denominatori delle metriche per record meteo)."""
+        preds = []
+        if self.start_date:
+            preds.append(f"{alias}.weather_date >= DATE '{date.fromisoformat(self.start_date)}'")
+        if self.end_date:
+            preds.append(f"{alias}.weather_date < DATE '{date.fromisoformat(self.end_date)}'")
+        if self.pickup_borough:
+            borough = self.pickup_borough.strip().lower().replace("'", "''")
+            preds.append(f"lower({alias}.borough_name) = '{borough}'")
+        return " AND ".join(preds) or "TRUE"
@@ -0,0 +1,444 @@
+from __future__ import annotations
+
+import importlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+
+@dataclass(frozen=True)
+class ChartSpec:
+    """
+    Descrive un grafico del report: modulo/classe in plots/, metodo che carica
+    il DataFrame e metodo che costruisce la figura (con i rispettivi kwargs).
+    """
+    name: str
+    module: str
+    chart_class: str
+    loader: str
+    plotter: str
+    loader_kwargs: Dict[str, Any] = field(default_factory=dict)
+    plot_kwargs: Dict[str, Any] = field(default_factory=dict)
+
+    def build(self, **chart_kwargs):
+        """Istanzia la classe di grafici del modulo (es. show=False per uso headless)."""
+        return build_chart(self.module, self.chart_class, **chart_kwargs)
+
+
+@dataclass(frozen=True)
+class QuerySpec:
+    """
+    Query "data only" esposta all'esterno (API): metodo q_*/load_* di una classe
+    di grafici, con eventuali kwargs fissi.
+    sql_only: il metodo ritorna il risultato di _sql/_aggregate senza elaborarlo con
+    pandas, quindi `cli.py query` può chiederlo come righe DuckDB (ChartBase(as_rows=True)).
+    """
+    name: str
+    module: str
+    chart_class: str
+    method: str
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    sql_only: bool = False
+
+    def build(self, **chart_kwargs):
+        return build_chart(self.module, self.chart_class, **chart_kwargs)
+
+
+def build_chart(module_name: str, chart_class: str, **chart_kwargs):
+    module = importlib.import_module(module_name)
+    return getattr(module, chart_class)(**chart_kwargs)
+
+
+RAIN_ORDER = ["No Rain", "Light Rain", "Moderate Rain", "Heavy Rain"]
+WIND_ORDER = ["No Wind", "Light Wind", "Moderate Wind", "Strong Wind", "Very Strong Wind"]
+SNOW_ORDER = ["No Snow", "Light Snow", "Moderate Snow", "Heavy Snow"]
+TEMP_ORDER = ["Extreme Cold", "Freezing", "Cold", "Mild", "Warm", "Hot", "Extreme Heat"]
+
+
+# Stesso elenco (e stesso ordine) dei blocchi __main__ degli script plot_*.py
+CHARTS: List[ChartSpec] = [
+    # ---- plot_1_extended.py ----
+    ChartSpec(
+        name="top_dropoff_neighborhoods",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_dropoff_trips_by_neighborhood",
+        plotter="plot_top_dropoff_neighborhoods",
+        plot_kwargs={"top_n": 20},
+    ),
+    ChartSpec(
+        name="avg_revenue_by_vendor",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_avg_revenue_by_vendor",
+        plotter="plot_avg_revenue_by_vendor",
+    ),
+    ChartSpec(
+        name="trips_by_temp_category",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_trips_by_apparent_temp_category",
+        plotter="plot_trips_by_temp_category",
+    ),
+    ChartSpec(
+        name="christmas_top_dropoff_neighborhoods",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_christmas_day_trips_by_neighborhood_do",
+        plotter="plot_christmas_trips_top_neighborhoods_do",
+        plot_kwargs={"top_n": 10},
+    ),
+    ChartSpec(
+        name="christmas_top_pickup_neighborhoods",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_christmas_day_trips_by_neighborhood_pu",
+        plotter="plot_christmas_trips_top_neighborhoods_pu",
+        plot_kwargs={"top_n": 10},
+    ),
+    ChartSpec(
+        name="holiday_top_pickup_neighborhoods",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_holiday_day_trips_by_neighborhood_pu",
+        plotter="plot_holiday_trips_top_neighborhoods_pu",
+        plot_kwargs={"top_n": 10},
+    ),
+    ChartSpec(
+        name="holiday_top_dropoff_neighborhoods",
+        module="plot_1_extended",
+        chart_class="TaxiCharts",
+        loader="q_holiday_day_trips_by_neighborhood_do",
+        plotter="plot_holiday_trips_top_neighborhoods_do",
+        plot_kwargs={"top_n": 10},
+    ),
+    # ---- plot_trips_by_month_year.py ----
+    ChartSpec(
+        name="revenue_by_year_month",
+        module="plot_trips_by_month_year",
+        chart_class="TaxiCharts",
+        loader="q_revenue_by_year_month",
+        plotter="plot_revenue_by_year_month",
+    ),
+    ChartSpec(
+        name="rolling_trips",
+        module="plot_trips_by_month_year",
+        chart_class="TaxiCharts",
+        loader="q_rolling_metrics",
+        plotter="plot_rolling_metrics",
+        plot_kwargs={"metric": "trips"},
+    ),
+    # ---- plot_avg_by_weather_category.py ----
+    ChartSpec(
+        name="trips_per_weather_rainy",
+        module="plot_avg_by_weather_category",
+        chart_class="TaxiCharts",
+        loader="load_agg_rainy",
+        plotter="plot_trips_per_weather_binary",
+        plot_kwargs={"title": "Avg taxi trips per weather record (rain vs no rain)"},
+    ),
+    ChartSpec(
+        name="trips_per_weather_snowy",
+        module="plot_avg_by_weather_category",
+        chart_class="TaxiCharts",
+        loader="load_agg_snowy",
+        plotter="plot_trips_per_weather_binary",
+        plot_kwargs={"title": "Avg taxi trips per weather record (snow vs no snow)"},
+    ),
+    ChartSpec(
+        name="trips_per_rain_intensity",
+        module="plot_avg_by_weather_category",
+        chart_class="TaxiCharts",
+        loader="load_agg_rain_intensity",
+        plotter="plot_trips_per_category",
+        plot_kwargs={
+            "title": "Avg taxi trips per weather record by rain intensity",
+            "order": RAIN_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="trips_per_wind_intensity",
+        module="plot_avg_by_weather_category",
+        chart_class="TaxiCharts",
+        loader="load_agg_wind_intensity",
+        plotter="plot_trips_per_category",
+        plot_kwargs={
+            "title": "Avg taxi trips per weather record by wind intensity",
+            "order": WIND_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="trips_per_snow_intensity",
+        module="plot_avg_by_weather_category",
+        chart_class="TaxiCharts",
+        loader="load_agg_snow_intensity",
+        plotter="plot_trips_per_category",
+        plot_kwargs={"title": "Avg taxi trips per weather record by snow intensity"},
+    ),
+    # ---- plot_avg_by_weather_cat_borough.py ----
+    ChartSpec(
+        name="rainy_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_rainy_by_borough",
+        plotter="plot_by_borough_1",
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_weather",
+            "color": "condition",
+            "title": "Avg taxi trips per weather record by borough (rain vs no rain)",
+        },
+    ),
+    ChartSpec(
+        name="snowy_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_snowy_by_borough",
+        plotter="plot_by_borough_1",
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_weather",
+            "color": "condition",
+            "title": "Avg taxi trips per weather record by borough (snow vs no snow)",
+        },
+    ),
+    ChartSpec(
+        name="rain_intensity_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_intensity_by_borough",
+        plotter="plot_by_borough_2",
+        loader_kwargs={"intensity_col": "rain_intensity"},
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_category",
+            "color": "intensity",
+            "title": "Avg taxi trips per weather record by rain intensity and borough",
+            "category_order": RAIN_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="wind_intensity_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_intensity_by_borough",
+        plotter="plot_by_borough_2",
+        loader_kwargs={"intensity_col": "wind_intensity"},
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_category",
+            "color": "intensity",
+            "title": "Avg taxi trips per weather record by wind intensity and borough",
+            "category_order": WIND_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="snow_intensity_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_intensity_by_borough",
+        plotter="plot_by_borough_2",
+        loader_kwargs={"intensity_col": "snow_intensity"},
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_category",
+            "color": "intensity",
+            "title": "Avg taxi trips per weather record by snow intensity and borough",
+        },
+    ),
+    ChartSpec(
+        name="temperature_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="load_intensity_by_borough",
+        plotter="plot_by_borough_2",
+        loader_kwargs={"intensity_col": "temperature_category"},
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_category",
+            "color": "intensity",
+            "title": "Avg taxi trips per weather record by temperature intensity",
+            "category_order": TEMP_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="trip_distance_by_borough",
+        module="plot_avg_by_weather_cat_borough",
+        chart_class="TaxiChartsByBorough",
+        loader="trip_distance_borough",
+        plotter="plot_by_trip_distance",
+        plot_kwargs={
+            "x": "borough",
+            "y": "trips_per_category",
+            "color": "intensity",
+            "title": "taxi trips per average distance (no airport 'La Guardia' and 'JFK' trips)",
+        },
+    ),
+    # ---- weather_elasticity.py ----
+    ChartSpec(
+        name="weather_effects_rain",
+        module="weather_elasticity",
+        chart_class="WeatherElasticity",
+        loader="q_weather_effects",
+        plotter="plot_weather_effects",
+        loader_kwargs={"factor": "rain_intensity"},
+        plot_kwargs={
+            "title": "Rain intensity effect on taxi demand (vs no rain, 95% CI)",
+            "category_order": RAIN_ORDER,
+        },
+    ),
+    ChartSpec(
+        name="weather_effects_temperature",
+        module="weather_elasticity",
+        chart_class="WeatherElasticity",
+        loader="q_weather_effects",
+        plotter="plot_weather_effects",
+        loader_kwargs={"factor": "temperature_category"},
+        plot_kwargs={
+            "title": "Temperature effect on taxi demand (vs mild, 95% CI)",
+            "category_order": TEMP_ORDER,
+        },
+    ),
+    # ---- od_matrix.py ----
+    ChartSpec(
+        name="od_top_flows",
+        module="od_matrix",
+        chart_class="ODMatrixCharts",
+        loader="q_top_flows",
+        plotter="plot_top_flows",
+        loader_kwargs={"k": 20},
+    ),
+    ChartSpec(
+        name="od_borough_flows",
+        module="od_matrix",
+        chart_class="ODMatrixCharts",
+        loader="q_borough_flows",
+        plotter="plot_borough_flows",
+    ),
+    # ---- quantile_sketch.py ----
+    ChartSpec(
+        name="fare_quantiles_by_borough",
+        module="quantile_sketch",
+        chart_class="QuantileCharts",
+        loader="q_quantiles",
+        plotter="plot_quantiles",
+        loader_kwargs={"measure": "total_amount", "by": "borough"},
+        plot_kwargs={"title": "Total amount percentiles by borough", "y_title": "USD"},
+    ),
+    ChartSpec(
+        name="duration_quantiles_by_hour",
+        module="quantile_sketch",
+        chart_class="QuantileCharts",
+        loader="q_quantiles",
+        plotter="plot_quantiles",
+        loader_kwargs={"measure": "trip_duration_minutes", "by": "pickup_hour", "quantiles": (0.5, 0.9, 0.99)},
+        plot_kwargs={"title": "Trip duration percentiles by pickup hour", "y_title": "Minutes"},
+    ),
+    # ---- demand_cube.py ----
+    ChartSpec(
+        name="hourly_demand_by_borough",
+        module="demand_cube",
+        chart_class="DemandCubeCharts",
+        loader="q_hourly_demand",
+        plotter="plot_hourly_demand",
+    ),
+    ChartSpec(
+        name="daily_demand_by_borough",
+        module="demand_cube",
+        chart_class="DemandCubeCharts",
+        loader="q_daily_demand",
+        plotter="plot_daily_demand",
+    ),
+]
+
+
+def _query(
+    name: str, module: str, chart_class: str, method: str, sql_only: bool = False, **kwargs
+) -> QuerySpec:
+    return QuerySpec(name=name, module=module, chart_class=chart_class, method=method, kwargs=kwargs,
+                     sql_only=sql_only)
+
+
+QUERIES: List[QuerySpec] = [
+    # ---- plot_1_extended.py ----
+    _query("weather_multidim", "plot_1_extended", "TaxiCharts", "q_weather_multidim"),
+    _query("dropoff_trips_by_neighborhood", "plot_1_extended", "TaxiCharts",
+           "q_dropoff_trips_by_neighborhood", sql_only=True),
+    _query("avg_revenue_by_vendor", "plot_1_extended", "TaxiCharts",
+           "q_avg_revenue_by_vendor", sql_only=True),
+    _query("trips_by_apparent_temp_category", "plot_1_extended", "TaxiCharts",
+           "q_trips_by_apparent_temp_category", sql_only=True),
+    _query("max_daily_revenue_january_2025", "plot_1_extended", "TaxiCharts",
+           "q_max_daily_revenue_january_2025", sql_only=True),
+    _query("christmas_trips_by_neighborhood_pu", "plot_1_extended", "TaxiCharts",
+           "q_christmas_day_trips_by_neighborhood_pu", sql_only=True),
+    _query("christmas_trips_by_neighborhood_do", "plot_1_extended", "TaxiCharts",
+           "q_christmas_day_trips_by_neighborhood_do", sql_only=True),
+    _query("holiday_trips_by_neighborhood_pu", "plot_1_extended", "TaxiCharts",
+           "q_holiday_day_trips_by_neighborhood_pu", sql_only=True),
+    _query("holiday_trips_by_neighborhood_do", "plot_1_extended", "TaxiCharts",
+           "q_holiday_day_trips_by_neighborhood_do", sql_only=True),
+    # ---- plot_trips_by_month_year.py ----
+    _query("revenue_by_year_month", "plot_trips_by_month_year", "TaxiCharts",
+           "q_revenue_by_year_month", sql_only=True),
+    _query("rolling_metrics", "plot_trips_by_month_year", "TaxiCharts", "q_rolling_metrics", sql_only=True),
+    # ---- plot_avg_by_weather_category.py ----
+    _query("agg_rainy", "plot_avg_by_weather_category", "TaxiCharts", "load_agg_rainy"),
+    _query("agg_snowy", "plot_avg_by_weather_category", "TaxiCharts", "load_agg_snowy"),
+    _query("agg_rain_intensity", "plot_avg_by_weather_category", "TaxiCharts", "load_agg_rain_intensity"),
+    _query("agg_wind_intensity", "plot_avg_by_weather_category", "TaxiCharts", "load_agg_wind_intensity"),
+    _query("agg_snow_intensity", "plot_avg_by_weather_category", "TaxiCharts", "load_agg_snow_intensity"),
+    # ---- plot_avg_by_weather_cat_borough.py ----
+    _query("rainy_by_borough", "plot_avg_by_weather_cat_borough", "TaxiChartsByBorough", "load_rainy_by_borough"),
+    _query("snowy_by_borough", "plot_avg_by_weather_cat_borough", "TaxiChartsByBorough", "load_snowy_by_borough"),
+    _query("intensity_by_borough", "plot_avg_by_weather_cat_borough", "TaxiChartsByBorough",
+           "load_intensity_by_borough"),
+    _query("trip_distance_by_borough", "plot_avg_by_weather_cat_borough", "TaxiChartsByBorough",
+           "trip_distance_borough"),
+    # ---- weather_elasticity.py ----
+    _query("weather_effects_rain", "weather_elasticity", "WeatherElasticity", "q_weather_effects",
+           factor="rain_intensity"),
+    _query("weather_effects_snow", "weather_elasticity", "WeatherElasticity", "q_weather_effects",
+           factor="snow_intensity"),
+    _query("weather_effects_temperature", "weather_elasticity", "WeatherElasticity", "q_weather_effects",
+           factor="temperature_category"),
+    _query("od_top_flows", "od_matrix", "ODMatrixCharts", "q_top_flows", k=20),
+    _query("od_top_flows_revenue", "od_matrix", "ODMatrixCharts", "q_top_flows", k=20, measure="revenue"),
+    _query("od_zone_marginals", "od_matrix", "ODMatrixCharts", "q_zone_marginals"),
+    _query("od_borough_flows", "od_matrix", "ODMatrixCharts", "q_borough_flows"),
+    # ---- quantile_sketch.py ----
+    _query("fare_quantiles_by_borough", "quantile_sketch", "QuantileCharts", "q_quantiles",
+           measure="total_amount", by="borough", sql_only=True),
+    _query("duration_quantiles_by_hour", "quantile_sketch", "QuantileCharts", "q_quantiles",
+           measure="trip_duration_minutes", by="pickup_hour", sql_only=True),
+    _query("distance_quantiles_by_rain", "quantile_sketch", "QuantileCharts", "q_quantiles",
+           measure="trip_distance", by="rain_intensity", sql_only=True),
+    _query("tip_quantiles_by_month", "quantile_sketch", "QuantileCharts", "q_quantiles",
+           measure="tip_percentage", by="month", sql_only=True),
+    # ---- demand_cube.py ----
+    _query("cube_hourly_demand", "demand_cube", "DemandCubeCharts", "q_hourly_demand"),
+    _query("cube_daily_demand", "demand_cube", "DemandCubeCharts", "q_daily_demand"),
+    _query("cube_weather_demand", "demand_cube", "DemandCubeCharts", "q_weather_demand"),
+]
+
+# Colonne di dm_weather_dt ammesse come "weather category" (finiscono nel SQL)
+WEATHER_CATEGORIES = [
+    "rain_intensity",
+    "snow_intensity",
+    "wind_intensity",
+    "temperature_category",
+    "apparent_temperature_category",
+]
+
+
+def get_query(name: str) -> QuerySpec:
+    for spec in QUERIES:
+        if spec.name == name:
+            return spec
+    raise KeyError(f"Query non registrata: {name}")
+
+
+def get_chart(name: str) -> ChartSpec:
+    for spec in CHARTS:
+        if spec.name == name:
+            return spec
+    raise KeyError(f"Grafico non registrato: {name}")
@@ -0,0 +1,452 @@
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from chart_base import NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+from od_matrix import HOURS, UNKNOWN_WEATHER, load_zones
+
+px = lazy_module("plotly.express")
+
+# cubo denso su disco: <project_root>/demand_cube/<db>/<weather_col>/{trips,revenue}.npy + axes.json
+CUBE_DIR = "demand_cube"
+META_FILE = "axes.json"
+AXES = ("date", "hour", "zone", "weather")
+# uint32 / float32: 4 byte per cella; le somme si fanno in int64 / float64
+MEASURES = {"trips": np.uint32, "revenue": np.float32}
+SUM_DTYPES = {"trips": np.int64, "revenue": np.float64}
+
+Fingerprint = Tuple[int, ...]
+
+
+@dataclass
+class DemandCube:
+    """
+    Cubo denso giorno di pickup x ora x zona di pickup x categoria meteo, con trips e revenue.
+
+    I due array sono .npy aperti in memory-map (np.load(mmap_mode="r")): aprire il cubo legge
+    solo axes.json, una fetta per periodo è una vista senza copie e le somme toccano le sole
+    celle selezionate. Nessuna connessione DuckDB: lo legge anche una dashboard che si
+    aggiorna ogni secondo (is_stale() dice quando riaprirlo dopo un refresh).
+
+    Assi (metadati in axes.json):
+    - date: giorni consecutivi da `start` (anni interi, l'asse cresce di un anno alla volta);
+    - hour: 0-23;
+    - zone: id_neighborhood (indice diretto in zone_names / zone_boroughs);
+    - weather: indice in weather_labels (categorie di `weather_col`, più "Unknown").
+    """
+    directory: Path
+    start: date
+    weather_col: str
+    weather_labels: np.ndarray
+    zone_names: np.ndarray
+    zone_boroughs: np.ndarray
+    fingerprints: Dict[str, List[int]]
+    arrays: Dict[str, np.ndarray] = field(repr=False)
+    meta_mtime: int = 0
+
+    # -------------------------
+    # APERTURA
+    # -------------------------
+
+    @classmethod
+    def open(cls, directory: Path) -> "DemandCube":
+        directory = Path(directory)
+        meta_path = directory / META_FILE
+        mtime = meta_path.stat().st_mtime_ns
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        return cls(
+            directory=directory,
+            start=date.fromisoformat(meta["start"]),
+            weather_col=meta["weather_col"],
+            weather_labels=np.array(meta["weather_labels"], dtype=str),
+            zone_names=np.array(meta["zone_names"], dtype=str),
+            zone_boroughs=np.array(meta["zone_boroughs"], dtype=str),
+            fingerprints=meta["fingerprints"],
+            arrays={m: np.load(directory / f"{m}.npy", mmap_mode="r") for m in MEASURES},
+            meta_mtime=mtime,
+        )
+
+    def is_stale(self) -> bool:
+        """True se un refresh ha riscritto il cubo dopo l'apertura."""
+        try:
+            return (self.directory / META_FILE).stat().st_mtime_ns != self.meta_mtime
+        except FileNotFoundError:
+            return True
+
+    @property
+    def capacity(self) -> int:
+        return self.arrays["trips"].shape[0]
+
+    @property
+    def dates(self) -> List[date]:
+        """Giorni con dati (quelli con impronta)."""
+        return sorted(date.fromisoformat(d) for d in self.fingerprints)
+
+    @property
+    def boroughs(self) -> np.ndarray:
+        return np.unique(self.zone_boroughs)
+
+    def day_index(self, day: date) -> int:
+        return (day - self.start).days
+
+    # -------------------------
+    # SELEZIONE
+    # -------------------------
+
+    def _date_bounds(self, start_date: Optional[date], end_date: Optional[date]) -> Tuple[int, int]:
+        lo = 0 if start_date is None else min(max(self.day_index(start_date), 0), self.capacity)
+        hi = self.capacity if end_date is None else min(max(self.day_index(end_date), lo), self.capacity)
+        return lo, hi
+
+    @staticmethod
+    def _borough_mask(boroughs: Sequence[str], labels: np.ndarray) -> np.ndarray:
+        wanted = [b.strip().lower() for b in boroughs]
+        return np.isin(np.char.lower(labels.astype(str)), wanted)
+
+    def select(
+        self,
+        measure: str = "trips",
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        hours: Optional[Sequence[int]] = None,
+        boroughs: Optional[Sequence[str]] = None,
+        weather: Optional[Sequence[str]] = None,
+    ) -> np.ndarray:
+        """
+        Sotto-cubo (date, hour, zone, weather) per periodo [start_date, end_date), ore,
+        borough di pickup e categorie meteo. Con il solo periodo è una vista sul memory-map.
+        """
+        if measure not in MEASURES:
+            raise ValueError(f"measure deve essere una di {list(MEASURES)}")
+        lo, hi = self._date_bounds(start_date, end_date)
+        cube = self.arrays[measure][lo:hi]
+        if hours is not None:
+            cube = cube[:, np.asarray(list(hours), dtype=np.int64)]
+        if boroughs is not None:
+            cube = cube[:, :, np.flatnonzero(self._borough_mask(boroughs, self.zone_boroughs))]
+        if weather is not None:
+            cube = cube[..., np.flatnonzero(np.isin(self.weather_labels, list(weather)))]
+        return cube
+
+    def total(
+        self,
+        measure: str = "trips",
+        by: Sequence[str] = (),
+        boroughs: Optional[Sequence[str]] = None,
+        **selection,
+    ) -> np.ndarray:
+        """
+        Somma della selezione sugli assi non in `by`; gli assi restano nell'ordine di AXES.
+        "borough" al posto di "zone" raggruppa le zone per borough (ordine di `boroughs`).
+        """
+        unknown = set(by) - set(AXES) - {"borough"}
+        if unknown:
+            raise ValueError(f"assi sconosciuti: {sorted(unknown)}")
+        rollup = "borough" in by
+        # il roll-up vuole l'asse zone completo: il filtro sui borough si applica dopo
+        cube = self.select(measure, boroughs=None if rollup else boroughs, **selection)
+        keep = [a for a in AXES if a in by or (a == "zone" and rollup)]
+        out = cube.sum(axis=tuple(i for i, a in enumerate(AXES) if a not in keep), dtype=SUM_DTYPES[measure])
+        if rollup:
+            axis = keep.index("zone")
+            out = self.rollup_boroughs(out, axis)
+            if boroughs is not None:
+                out = np.compress(self._borough_mask(boroughs, self.boroughs), out, axis=axis)
+        return out
+
+    def rollup_boroughs(self, values: np.ndarray, axis: int) -> np.ndarray:
+        """Somma le zone (asse `axis`, completo) per borough: prodotto con la matrice zona -> borough."""
+        codes = np.searchsorted(self.boroughs, self.zone_boroughs)
+        onehot = np.zeros((len(self.zone_boroughs), len(self.boroughs)), dtype=values.dtype)
+        onehot[np.arange(len(codes)), codes] = 1
+        return np.moveaxis(np.tensordot(np.moveaxis(values, axis, -1), onehot, axes=1), -1, axis)
+
+    def axis_labels(
+        self,
+        start_date: Optional[date] = None,
+        end_date: Optional[date] = None,
+        hours: Optional[Sequence[int]] = None,
+        boroughs: Optional[Sequence[str]] = None,
+        weather: Optional[Sequence[str]] = None,
+    ) -> Dict[str, list]:
+        """Etichette degli assi di total() per la stessa selezione."""
+        lo, hi = self._date_bounds(start_date, end_date)
+        zones = np.ones(len(self.zone_names), dtype=bool)
+        all_boroughs = np.ones(len(self.boroughs), dtype=bool)
+        if boroughs is not None:
+            zones = self._borough_mask(boroughs, self.zone_boroughs)
+            all_boroughs = self._borough_mask(boroughs, self.boroughs)
+        return {
+            "date": [self.start + timedelta(days=i) for i in range(lo, hi)],
+            "hour": list(range(HOURS)) if hours is None else list(hours),
+            "zone": list(self.zone_names[zones]),
+            "borough": list(self.boroughs[all_boroughs]),
+            "weather": list(self.weather_labels if weather is None
+                            else self.weather_labels[np.isin(self.weather_labels, list(weather))]),
+        }
+
+    def frame(self, by: Sequence[str], **selection) -> pd.DataFrame:
+        """trips e revenue sommati per gli assi `by`, in formato lungo con le etichette (celle vuote escluse)."""
+        ordered = sorted(by, key=lambda a: AXES.index("zone" if a == "borough" else a))
+        labels = self.axis_labels(**selection)
+        index = pd.MultiIndex.from_product([labels[a] for a in ordered], names=ordered)
+        df = pd.DataFrame(
+            {m: self.total(m, by=ordered, **selection).ravel() for m in MEASURES}, index=index
+        ).reset_index()
+        return df[df["trips"] > 0].reset_index(drop=True)
+
+
+# ----------------------------
+# COSTRUZIONE
+# ----------------------------
+
+def _write_meta(directory: Path, meta: Dict) -> None:
+    tmp = directory / (META_FILE + ".tmp")
+    tmp.write_text(json.dumps(meta), encoding="utf-8")
+    os.replace(tmp, directory / META_FILE)
+
+
+def _year_capacity(start: date, last: date) -> int:
+    """Giorni da start al 31 dicembre dell'anno di `last`."""
+    return (date(last.year, 12, 31) - start).days + 1
+
+
+def _allocate(directory: Path, measure: str, shape: Tuple[int, ...], previous: Optional[np.ndarray] = None) -> None:
+    """Nuovo .npy (eventualmente con i giorni di `previous` copiati), sostituito atomicamente."""
+    tmp = directory / f"{measure}.{os.getpid()}.tmp.npy"
+    arr = np.lib.format.open_memmap(tmp, mode="w+", dtype=MEASURES[measure], shape=shape)
+    if previous is not None:
+        arr[: previous.shape[0]] = previous
+    arr.flush()
+    del arr
+    os.replace(tmp, directory / f"{measure}.npy")
+
+
+@dataclass
+class DemandCubeCharts(ChartBase):
+    """
+    Domanda (trips, revenue) per giorno x ora x zona x meteo, dal cubo denso su disco.
+
+    - refresh(): ricalcola dalla narrow solo i giorni nuovi o cambiati (impronta per giorno:
+      righe, max key_taxi_trip, trip senza meteo) e li scrive in place nel memory-map;
+      zone o categorie meteo nuove, o giorni prima dell'inizio dell'asse, ricostruiscono tutto;
+    - cube(): il DemandCube aperto, riaperto dopo ogni refresh;
+    - q_*: profili per ora, serie giornaliere e mix meteo per borough, senza query DuckDB.
+
+    Il filtro supporta periodo e borough di pickup (granularità del cubo).
+    """
+    weather_col: str = "rain_intensity"
+    cube_dir: Optional[Path] = None
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        if self.cube_dir is None:
+            self.cube_dir = self.project_root / CUBE_DIR / self.db_path.stem / self.weather_col
+        self._cube: Optional[DemandCube] = None
+        self._refreshed_for: Optional[Path] = None
+
+    # ----------------------------
+    # COSTRUZIONE / CACHE
+    # ----------------------------
+
+    def fingerprints(self) -> Dict[str, Fingerprint]:
+        df = self._sql(f"""
+        SELECT
+            pickup_date,
+            COUNT(*) AS n,
+            MAX(key_taxi_trip) AS max_key,
+            COUNT(*) FILTER (WHERE key_weather = -1) AS no_weather
+        FROM {self.schema}.{NARROW_TABLE}
+        WHERE pickup_date IS NOT NULL
+        GROUP BY pickup_date
+        """)
+        return {
+            pd.Timestamp(r.pickup_date).date().isoformat(): (int(r.n), int(r.max_key), int(r.no_weather))
+            for r in df.itertuples()
+        }
+
+    def weather_labels(self) -> List[str]:
+        df = self._sql(f"""
+        SELECT DISTINCT {self.weather_col}::VARCHAR AS label
+        FROM {self.schema}.dm_weather_dt
+        WHERE {self.weather_col} IS NOT NULL
+        """)
+        return sorted(set(df["label"]) | {UNKNOWN_WEATHER})
+
+    def refresh(self) -> List[date]:
+        """Aggiorna il cubo; ritorna i giorni ricalcolati."""
+        current = self.fingerprints()
+        if not current:
+            return []
+        zones = load_zones(self)
+        labels = self.weather_labels()
+        first, last = date.fromisoformat(min(current)), date.fromisoformat(max(current))
+
+        directory = self.cube_dir
+        directory.mkdir(parents=True, exist_ok=True)
+        meta_path = directory / META_FILE
+        meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else None
+        rebuild = (
+            meta is None
+            or meta["weather_labels"] != labels
+            or meta["zone_names"] != zones["neighborhood_name"].tolist()
+            or meta["zone_boroughs"] != zones["borough_name"].tolist()
+            or date.fromisoformat(meta["start"]) > first
+            or any(not (directory / f"{m}.npy").exists() for m in MEASURES)
+        )
+        if rebuild:
+            start = date(first.year, 1, 1)
+            shape = (_year_capacity(start, last), HOURS, len(zones), len(labels))
+            for measure in MEASURES:
+                _allocate(directory, measure, shape)
+            meta = {
+                "start": start.isoformat(),
+                "weather_col": self.weather_col,
+                "weather_labels": labels,
+                "zone_names": zones["neighborhood_name"].tolist(),
+                "zone_boroughs": zones["borough_name"].tolist(),
+                "fingerprints": {},
+            }
+        start = date.fromisoformat(meta["start"])
+
+        # asse date esaurito: nuovo file con un anno in più (copia dei giorni esistenti)
+        capacity = np.load(directory / "trips.npy", mmap_mode="r").shape[0]
+        if (last - start).days >= capacity:
+            for measure in MEASURES:
+                previous = np.load(directory / f"{measure}.npy", mmap_mode="r")
+                _allocate(directory, measure, (_year_capacity(start, last), *previous.shape[1:]), previous)
+
+        stored = meta["fingerprints"]
+        stale = sorted(d for d, fp in current.items() if stored.get(d) != list(fp))
+        vanished = sorted(set(stored) - set(current))
+        if not stale and not vanished:
+            return []
+
+        arrays = {m: np.lib.format.open_memmap(directory / f"{m}.npy", mode="r+") for m in MEASURES}
+        for day in vanished:
+            for arr in arrays.values():
+                arr[(date.fromisoformat(day) - start).days] = 0
+            stored.pop(day)
+        # un mese alla volta: il risultato della GROUP BY resta piccolo anche nel primo build
+        by_month: Dict[Tuple[int, int], List[str]] = {}
+        for day in stale:
+            by_month.setdefault((int(day[:4]), int(day[5:7])), []).append(day)
+        for days in by_month.values():
+            day_list = ", ".join(f"DATE '{d}'" for d in days)
+            df = self._sql(f"""
+            SELECT
+                t.pickup_date,
+                t.pickup_hour AS hour,
+                z.id_neighborhood AS zone,
+                COALESCE(t.{self.weather_col}::VARCHAR, '{UNKNOWN_WEATHER}') AS weather,
+                COUNT(*) AS trips,
+                SUM(t.total_amount)::DOUBLE AS revenue
+            FROM {self.schema}.{NARROW_TABLE} t
+            JOIN {self.schema}.dm_zone z ON t.key_zone_pickup = z.key_zone
+            WHERE t.pickup_date IN ({day_list})
+              AND t.pickup_hour IS NOT NULL
+            GROUP BY ALL
+            """)
+            index = (
+                (pd.to_datetime(df["pickup_date"]).dt.date - start).map(lambda d: d.days).to_numpy(dtype=np.int64),
+                df["hour"].to_numpy(dtype=np.int64),
+                df["zone"].to_numpy(dtype=np.int64),
+                np.searchsorted(np.array(labels), df["weather"].to_numpy(dtype=str)),
+            )
+            for day in days:
+                for arr in arrays.values():
+                    arr[(date.fromisoformat(day) - start).days] = 0
+            # GROUP BY: ogni cella compare una sola volta, assegnazione diretta
+            arrays["trips"][index] = df["trips"].to_numpy()
+            arrays["revenue"][index] = df["revenue"].to_numpy()
+            for day in days:
+                stored[day] = list(current[day])
+        for arr in arrays.values():
+            arr.flush()
+        del arrays
+
+        meta["fingerprints"] = stored
+        meta["updated_at"] = datetime.now().isoformat(timespec="seconds")
+        # metadati per ultimi: un lettore che riapre il cubo vede i giorni già scritti
+        _write_meta(directory, meta)
+        self._cube = None
+        return [date.fromisoformat(d) for d in stale]
+
+    def cube(self) -> DemandCube:
+        """Il cubo aperto (refresh al primo uso e a ogni nuovo snapshot, come od_matrix.py)."""
+        if self._refreshed_for != self.current_db_path():
+            self.refresh()
+            self._refreshed_for = self.current_db_path()
+        if self._cube is None or self._cube.is_stale():
+            self._cube = DemandCube.open(self.cube_dir)
+        return self._cube
+
+    @staticmethod
+    def _selection(filters: Optional[ChartFilter]) -> Dict:
+        filters = filters or ChartFilter()
+        if filters.dropoff_borough or filters.vendor or filters.exclude_outliers:
+            raise ValueError("il cubo di domanda supporta solo periodo e borough di pickup")
+        return {
+            "start_date": date.fromisoformat(filters.start_date) if filters.start_date else None,
+            "end_date": date.fromisoformat(filters.end_date) if filters.end_date else None,
+            "boroughs": [filters.pickup_borough] if filters.pickup_borough else None,
+        }
+
+    # ----------------------------
+    # QUERY
+    # ----------------------------
+
+    def q_hourly_demand(self, filters: Optional[ChartFilter] = None, weather: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """Trips e revenue per ora del giorno e borough di pickup."""
+        return self.cube().frame(by=("hour", "borough"), weather=weather, **self._selection(filters))
+
+    def q_daily_demand(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Serie giornaliera per borough di pickup."""
+        return self.cube().frame(by=("date", "borough"), **self._selection(filters))
+
+    def q_weather_demand(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Trips, revenue e quota dei trip per categoria meteo e borough."""
+        df = self.cube().frame(by=("borough", "weather"), **self._selection(filters))
+        df["trip_share"] = df["trips"] / df.groupby("borough")["trips"].transform("sum")
+        return df
+
+    # ----------------------------
+    # PLOT
+    # ----------------------------
+
+    def plot_hourly_demand(self, df: pd.DataFrame, title: str = "Trips by pickup hour"):
+        fig = px.line(df, x="hour", y="trips", color="borough", markers=True,
+                      hover_data=["revenue"], title=title, template="simple_white")
+        fig.update_layout(title_x=0.5, xaxis_title="Pickup hour", yaxis_title="Trips")
+        return self._show(fig)
+
+    def plot_daily_demand(self, df: pd.DataFrame, title: str = "Daily trips by borough"):
+        fig = px.line(df, x="date", y="trips", color="borough",
+                      hover_data=["revenue"], title=title, template="simple_white")
+        fig.update_layout(title_x=0.5, xaxis_title="", yaxis_title="Trips")
+        return self._show(fig)
+
+
+# ---- ESEMPIO USO ----
+if __name__ == "__main__":
+    charts = DemandCubeCharts(db_filename="taxi_trips.duckdb", schema="dwh_datamart")
+    print("Giorni ricalcolati:", len(charts.refresh()))
+
+    # lettura diretta del cubo, senza DuckDB (es. dashboard operativa)
+    cube = DemandCube.open(charts.cube_dir)
+    last = cube.dates[-1]
+    print("Trip per ora, ultimo giorno:", cube.total("trips", by=("hour",), start_date=last,
+                                                     end_date=last + timedelta(days=1)))
+
+    charts.plot_hourly_demand(charts.q_hourly_demand())
+    charts.plot_daily_demand(charts.q_daily_demand())
@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """
+    Segnaposto di un modulo importato al primo accesso a un attributo.
+
+    `px = lazy_module("plotly.express")` a livello di modulo costa solo la creazione
+    dell'oggetto: plotly (o pandas) viene caricato quando un plot_* lo usa davvero,
+    non da chi chiede soltanto i dati (cli.py query, API).
+    """
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: ModuleType | None = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self) -> str:
+        state = "caricato" if self._module is not None else "non caricato"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
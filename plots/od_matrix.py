@@ -0,0 +1,466 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from chart_base import NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+
+px = lazy_module("plotly.express")
+
+HOURS = 24
+MEASURES = ("trips", "revenue")
+UNKNOWN_WEATHER = "Unknown"
+# cache delle matrici mensili: <project_root>/od_matrix/<db>/<weather_col>/YYYY-MM.npz
+OD_CACHE_DIR = "od_matrix"
+
+
+@dataclass
+class ODMatrix:
+    """
+    Matrice origine-destinazione sparsa (formato COO) zona x zona x ora x categoria meteo.
+
+    Ogni elemento non nullo è una tupla (origin, dest, hour, weather) con trips e revenue:
+    origin/dest sono id_neighborhood (indici diretti nella tabella `zones`), weather è
+    un codice in `weather_labels`. Le operazioni (top-k, marginali, differenze) lavorano
+    sugli array numpy con bincount / argpartition / unique, senza tornare a DuckDB.
+    """
+    origin: np.ndarray
+    dest: np.ndarray
+    hour: np.ndarray
+    weather: np.ndarray
+    trips: np.ndarray
+    revenue: np.ndarray
+    weather_labels: np.ndarray
+    zones: pd.DataFrame = field(repr=False)
+
+    @property
+    def n_zones(self) -> int:
+        return len(self.zones)
+
+    @property
+    def nnz(self) -> int:
+        return len(self.trips)
+
+    # -------------------------
+    # PERSISTENZA
+    # -------------------------
+
+    def save(self, path: Path, fingerprint: Tuple[int, ...]) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # nome temporaneo per processo: più worker (report) possono ricostruire lo stesso mese
+        tmp = path.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(
+            tmp,
+            origin=self.origin, dest=self.dest, hour=self.hour, weather=self.weather,
+            trips=self.trips, revenue=self.revenue, weather_labels=self.weather_labels,
+            fingerprint=np.asarray(fingerprint, dtype=np.int64),
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, zones: pd.DataFrame) -> Tuple["ODMatrix", Tuple[int, ...]]:
+        with np.load(path) as data:
+            matrix = cls(
+                origin=data["origin"], dest=data["dest"], hour=data["hour"], weather=data["weather"],
+                trips=data["trips"], revenue=data["revenue"],
+                weather_labels=data["weather_labels"], zones=zones,
+            )
+            return matrix, tuple(int(v) for v in data["fingerprint"])
+
+    # -------------------------
+    # ALGEBRA
+    # -------------------------
+
+    @classmethod
+    def concat(cls, matrices: Sequence["ODMatrix"], zones: pd.DataFrame) -> "ODMatrix":
+        """Somma di più matrici (es. mesi): categorie meteo riallineate e duplicati sommati."""
+        labels = np.array(sorted({str(lbl) for m in matrices for lbl in m.weather_labels}), dtype=str)
+        parts = []
+        for m in matrices:
+            remap = np.searchsorted(labels, m.weather_labels.astype(str)).astype(np.uint8)
+            parts.append((m.origin, m.dest, m.hour, remap[m.weather], m.trips, m.revenue))
+        if not parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, empty, empty, empty, empty, np.zeros(0), labels, zones)
+        cols = [np.concatenate(c) for c in zip(*parts)]
+        return cls(*cols, weather_labels=labels, zones=zones)._coalesce()
+
+    def _linear(self, dims: Sequence[str]) -> Tuple[np.ndarray, List[int]]:
+        sizes = {"origin": self.n_zones, "dest": self.n_zones, "hour": HOURS, "weather": len(self.weather_labels)}
+        index = np.zeros(self.nnz, dtype=np.int64)
+        for dim in dims:
+            index = index * sizes[dim] + getattr(self, dim).astype(np.int64)
+        return index, [sizes[d] for d in dims]
+
+    def _coalesce(self) -> "ODMatrix":
+        dims = ("origin", "dest", "hour", "weather")
+        index, shape = self._linear(dims)
+        keys, inverse = np.unique(index, return_inverse=True)
+        coords = np.unravel_index(keys, shape)
+        return ODMatrix(
+            *[c.astype(getattr(self, d).dtype) for c, d in zip(coords, dims)],
+            trips=np.bincount(inverse, weights=self.trips, minlength=len(keys)).astype(np.int64),
+            revenue=np.bincount(inverse, weights=self.revenue, minlength=len(keys)),
+            weather_labels=self.weather_labels,
+            zones=self.zones,
+        )
+
+    def select(
+        self,
+        hours: Optional[Sequence[int]] = None,
+        weather: Optional[Sequence[str]] = None,
+        origin_borough: Optional[str] = None,
+        dest_borough: Optional[str] = None,
+    ) -> "ODMatrix":
+        """Sottomatrice per ore del giorno, categorie meteo e borough di origine/destinazione."""
+        mask = np.ones(self.nnz, dtype=bool)
+        if hours is not None:
+            mask &= np.isin(self.hour, list(hours))
+        if weather is not None:
+            codes = np.flatnonzero(np.isin(self.weather_labels.astype(str), list(weather)))
+            mask &= np.isin(self.weather, codes)
+        borough = self.zones["borough_name"].str.lower().to_numpy()
+        if origin_borough:
+            mask &= borough[self.origin] == origin_borough.strip().lower()
+        if dest_borough:
+            mask &= borough[self.dest] == dest_borough.strip().lower()
+        return ODMatrix(
+            self.origin[mask], self.dest[mask], self.hour[mask], self.weather[mask],
+            self.trips[mask], self.revenue[mask], self.weather_labels, self.zones,
+        )
+
+    def flows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Flussi zona -> zona (ore e meteo sommati): indice lineare origin * n_zones + dest, trips, revenue."""
+        index, _ = self._linear(("origin", "dest"))
+        keys, inverse = np.unique(index, return_inverse=True)
+        return (
+            keys,
+            np.bincount(inverse, weights=self.trips, minlength=len(keys)),
+            np.bincount(inverse, weights=self.revenue, minlength=len(keys)),
+        )
+
+    def dense(self, measure: str = "trips") -> np.ndarray:
+        """Matrice densa n_zones x n_zones (per heatmap o algebra lineare)."""
+        out = np.zeros(self.n_zones * self.n_zones)
+        np.add.at(out, self._linear(("origin", "dest"))[0], getattr(self, measure))
+        return out.reshape(self.n_zones, self.n_zones)
+
+    def top_k(self, k: int = 20, measure: str = "trips") -> pd.DataFrame:
+        keys, trips, revenue = self.flows()
+        values = trips if measure == "trips" else revenue
+        k = min(k, len(keys))
+        top = np.argpartition(-values, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+        top = top[np.argsort(-values[top], kind="stable")]
+        return self._flow_frame(keys[top], {"trips": trips[top].astype(np.int64), "revenue": revenue[top]})
+
+    def marginals(self) -> pd.DataFrame:
+        """Per zona: trip/revenue in uscita (somma di riga) e in entrata (somma di colonna)."""
+        n = self.n_zones
+        out = self.zones[["id_neighborhood", "neighborhood_name", "borough_name"]].copy()
+        out["trips_out"] = np.bincount(self.origin, weights=self.trips, minlength=n).astype(np.int64)
+        out["trips_in"] = np.bincount(self.dest, weights=self.trips, minlength=n).astype(np.int64)
+        out["revenue_out"] = np.bincount(self.origin, weights=self.revenue, minlength=n)
+        out["revenue_in"] = np.bincount(self.dest, weights=self.revenue, minlength=n)
+        out["net_trips"] = out["trips_in"] - out["trips_out"]
+        active = (out["trips_out"] > 0) | (out["trips_in"] > 0)
+        return out[active].sort_values("trips_out", ascending=False).reset_index(drop=True)
+
+    def diff(self, other: "ODMatrix", k: Optional[int] = 20, measure: str = "trips") -> pd.DataFrame:
+        """Flussi di `other` meno flussi di self, ordinati per variazione assoluta (top k)."""
+        keys_a, trips_a, rev_a = self.flows()
+        keys_b, trips_b, rev_b = other.flows()
+        keys = np.union1d(keys_a, keys_b)
+
+        def align(src_keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+            out = np.zeros(len(keys))
+            out[np.searchsorted(keys, src_keys)] = values
+            return out
+
+        a = {"trips": align(keys_a, trips_a), "revenue": align(keys_a, rev_a)}
+        b = {"trips": align(keys_b, trips_b), "revenue": align(keys_b, rev_b)}
+        delta = b[measure] - a[measure]
+        order = np.argsort(-np.abs(delta), kind="stable")[:k]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pct = np.where(a[measure][order] > 0, delta[order] / a[measure][order], np.nan)
+        return self._flow_frame(keys[order], {
+            f"{measure}_a": a[measure][order],
+            f"{measure}_b": b[measure][order],
+            f"{measure}_delta": delta[order],
+            f"{measure}_delta_pct": pct,
+        })
+
+    def _flow_frame(self, keys: np.ndarray, values: Dict[str, np.ndarray]) -> pd.DataFrame:
+        origin, dest = np.divmod(keys, self.n_zones)
+        zones = self.zones.reset_index(drop=True)
+        out = pd.DataFrame({
+            "origin_neighborhood": zones["neighborhood_name"].to_numpy()[origin],
+            "origin_borough": zones["borough_name"].to_numpy()[origin],
+            "dest_neighborhood": zones["neighborhood_name"].to_numpy()[dest],
+            "dest_borough": zones["borough_name"].to_numpy()[dest],
+        })
+        for name, col in values.items():
+            out[name] = col
+        return out
+
+
+def load_zones(charts: ChartBase) -> pd.DataFrame:
+    """Una riga per id_neighborhood (indice = id), dalla versione corrente di dm_zone."""
+    df = charts._sql(f"""
+    SELECT id_neighborhood, neighborhood_name, borough_name
+    FROM {charts.schema}.dm_zone
+    QUALIFY row_number() OVER (PARTITION BY id_neighborhood ORDER BY is_current DESC, valid_from DESC) = 1
+    """)
+    n = int(df["id_neighborhood"].max()) + 1 if len(df) else 1
+    zones = pd.DataFrame({"id_neighborhood": np.arange(n)})
+    zones = zones.merge(df, on="id_neighborhood", how="left")
+    zones["neighborhood_name"] = zones["neighborhood_name"].fillna("unknown")
+    zones["borough_name"] = zones["borough_name"].fillna("unknown")
+    return zones
+
+
+@dataclass
+class ODMatrixCharts(ChartBase):
+    """
+    Flussi origine-destinazione tra zone, da matrici mensili precalcolate.
+
+    - refresh(): una sola GROUP BY su dm_trip_narrow per i mesi nuovi o cambiati
+      (impronta = righe e max key_taxi_trip del mese), salvata in .npz per mese;
+    - load_matrix(): somma dei mesi richiesti, letti da disco e tenuti in memoria
+      (alla prima chiamata, e a ogni nuovo snapshot, refresh() verifica le impronte);
+    - q_*: top-k flussi, marginali per zona, differenze tra periodi, flussi tra borough.
+
+    `weather_col` è la colonna di dm_weather_dt usata come dimensione meteo.
+    Il periodo di ChartFilter ha granularità mensile: viene esteso ai mesi interi.
+    """
+    weather_col: str = "rain_intensity"
+    cache_dir: Optional[Path] = None
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        if self.cache_dir is None:
+            self.cache_dir = self.project_root / OD_CACHE_DIR / self.db_path.stem / self.weather_col
+        self._zones: Optional[pd.DataFrame] = None
+        self._matrices: Dict[date, Tuple[float, ODMatrix]] = {}
+        self._refreshed_for: Optional[Path] = None
+
+    # ----------------------------
+    # COSTRUZIONE / CACHE
+    # ----------------------------
+
+    def zones(self) -> pd.DataFrame:
+        if self._zones is None:
+            self._zones = load_zones(self)
+        return self._zones
+
+    def _path(self, month: date) -> Path:
+        return self.cache_dir / f"{month:%Y-%m}.npz"
+
+    def fingerprints(self) -> Dict[date, Tuple[int, ...]]:
+        df = self._sql(f"""
+        SELECT
+            year,
+            month,
+            COUNT(*) AS n,
+            MAX(key_taxi_trip) AS max_key,
+            -- il meteo delle righe già caricate può essere riparato (repair_missing_weather_narrow)
+            COUNT(*) FILTER (WHERE key_weather = -1) AS no_weather
+        FROM {self.schema}.{NARROW_TABLE}
+        WHERE year IS NOT NULL
+        GROUP BY year, month
+        """)
+        return {
+            date(int(r.year), int(r.month), 1): (int(r.n), int(r.max_key), int(r.no_weather))
+            for r in df.itertuples()
+        }
+
+    def refresh(self, months: Optional[Sequence[date]] = None) -> List[date]:
+        """Ricostruisce le matrici mensili mancanti o con impronta diversa; ritorna i mesi ricostruiti."""
+        current = self.fingerprints()
+        if months is not None:
+            current = {m: fp for m, fp in current.items() if m in set(months)}
+        stale = []
+        for month, fp in current.items():
+            path = self._path(month)
+            if not path.exists() or ODMatrix.load(path, self.zones())[1] != fp:
+                stale.append(month)
+        if not stale:
+            return []
+
+        month_preds = " OR ".join(f"(t.year = {m.year} AND t.month = {m.month})" for m in stale)
+        df = self._sql(f"""
+        SELECT
+            t.year,
+            t.month,
+            zp.id_neighborhood AS origin,
+            zd.id_neighborhood AS dest,
+            t.pickup_hour AS hour,
+            COALESCE(t.{self.weather_col}, '{UNKNOWN_WEATHER}') AS weather,
+            COUNT(*) AS trips,
+            SUM(t.total_amount)::DOUBLE AS revenue
+        FROM {self.schema}.{NARROW_TABLE} t
+        JOIN {self.schema}.dm_zone zp ON t.key_zone_pickup = zp.key_zone
+        JOIN {self.schema}.dm_zone zd ON t.key_zone_dropoff = zd.key_zone
+        WHERE t.year IS NOT NULL
+          AND t.pickup_hour IS NOT NULL
+          AND ({month_preds})
+        GROUP BY ALL
+        """)
+        zones = self.zones()
+        for (year, month), part in df.groupby(["year", "month"]):
+            labels, codes = np.unique(part["weather"].to_numpy(dtype=str), return_inverse=True)
+            matrix = ODMatrix(
+                origin=part["origin"].to_numpy(dtype=np.uint16),
+                dest=part["dest"].to_numpy(dtype=np.uint16),
+                hour=part["hour"].to_numpy(dtype=np.uint8),
+                weather=codes.astype(np.uint8),
+                trips=part["trips"].to_numpy(dtype=np.int64),
+                revenue=part["revenue"].to_numpy(dtype=np.float64),
+                weather_labels=labels,
+                zones=zones,
+            )
+            matrix.save(self._path(date(int(year), int(month), 1)), current[date(int(year), int(month), 1)])
+        return stale
+
+    def cached_months(self) -> List[date]:
+        if not self.cache_dir.exists():
+            return []
+        return sorted(date.fromisoformat(p.stem + "-01") for p in self.cache_dir.glob("????-??.npz"))
+
+    def load_matrix(self, start_month: Optional[date] = None, end_month: Optional[date] = None) -> ODMatrix:
+        """Somma delle matrici mensili tra start_month ed end_month (inclusi)."""
+        # impronte verificate una volta per file letto (DB o snapshot pubblicato)
+        if self._refreshed_for != self.current_db_path():
+            self.refresh()
+            self._refreshed_for = self.current_db_path()
+        months = self.cached_months()
+        selected = [m for m in months
+                    if (start_month is None or m >= start_month.replace(day=1))
+                    and (end_month is None or m <= end_month)]
+
+        matrices = []
+        for month in selected:
+            path = self._path(month)
+            mtime = path.stat().st_mtime
+            cached = self._matrices.get(month)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, ODMatrix.load(path, self.zones())[0])
+                self._matrices[month] = cached
+            matrices.append(cached[1])
+        return ODMatrix.concat(matrices, self.zones())
+
+    def _filtered_matrix(
+        self, filters: Optional[ChartFilter], hours: Optional[Sequence[int]] = None,
+        weather: Optional[Sequence[str]] = None,
+    ) -> ODMatrix:
+        filters = filters or ChartFilter()
+        if filters.vendor:
+            raise ValueError("le matrici OD non hanno la dimensione vendor")
+        if filters.exclude_outliers:
+            raise ValueError("le matrici OD includono tutti i trip (exclude_outliers non supportato)")
+        start = date.fromisoformat(filters.start_date) if filters.start_date else None
+        # end_date escluso: ultimo mese = mese del giorno precedente
+        end = (date.fromisoformat(filters.end_date) - timedelta(days=1)).replace(day=1) if filters.end_date else None
+        matrix = self.load_matrix(start, end)
+        return matrix.select(hours=hours, weather=weather,
+                             origin_borough=filters.pickup_borough, dest_borough=filters.dropoff_borough)
+
+    # ----------------------------
+    # QUERY
+    # ----------------------------
+
+    def q_top_flows(
+        self,
+        k: int = 20,
+        measure: str = "trips",
+        hours: Optional[Sequence[int]] = None,
+        weather: Optional[Sequence[str]] = None,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        if measure not in MEASURES:
+            raise ValueError(f"measure deve essere uno di {MEASURES}")
+        return self._filtered_matrix(filters, hours, weather).top_k(k, measure)
+
+    def q_zone_marginals(
+        self,
+        hours: Optional[Sequence[int]] = None,
+        weather: Optional[Sequence[str]] = None,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        return self._filtered_matrix(filters, hours, weather).marginals()
+
+    def q_flow_changes(
+        self,
+        period_a: Tuple[str, str],
+        period_b: Tuple[str, str],
+        k: int = 20,
+        measure: str = "trips",
+    ) -> pd.DataFrame:
+        """Variazione dei flussi tra due periodi [start, end) ISO (es. stesso mese di due anni)."""
+        a = self._filtered_matrix(ChartFilter(*period_a))
+        b = self._filtered_matrix(ChartFilter(*period_b))
+        return a.diff(b, k=k, measure=measure)
+
+    def q_borough_flows(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Flussi aggregati borough -> borough (trips, revenue)."""
+        matrix = self._filtered_matrix(filters)
+        borough = matrix.zones["borough_name"].to_numpy()
+        df = pd.DataFrame({
+            "origin_borough": borough[matrix.origin],
+            "dest_borough": borough[matrix.dest],
+            "trips": matrix.trips,
+            "revenue": matrix.revenue,
+        })
+        return df.groupby(["origin_borough", "dest_borough"], as_index=False)[["trips", "revenue"]].sum()
+
+    # ----------------------------
+    # PLOT
+    # ----------------------------
+
+    def plot_top_flows(self, df: pd.DataFrame, title: str = "Top origin-destination flows"):
+        df = df.assign(flow=df["origin_neighborhood"] + " → " + df["dest_neighborhood"])
+        fig = px.bar(
+            df.iloc[::-1],
+            x="trips",
+            y="flow",
+            orientation="h",
+            color="origin_borough",
+            hover_data=["revenue", "dest_borough"],
+            title=title,
+            template="simple_white",
+        )
+        fig.update_layout(title_x=0.5, yaxis_title="", xaxis_title="Trips", height=max(400, 28 * len(df)))
+        return self._show(fig)
+
+    def plot_borough_flows(self, df: pd.DataFrame, title: str = "Trips between boroughs"):
+        pivot = df.pivot(index="origin_borough", columns="dest_borough", values="trips").fillna(0)
+        fig = px.imshow(
+            pivot,
+            text_auto=".3s",
+            color_continuous_scale="Blues",
+            labels={"x": "Dropoff borough", "y": "Pickup borough", "color": "Trips"},
+            title=title,
+            template="simple_white",
+        )
+        fig.update_layout(title_x=0.5)
+        return self._show(fig)
+
+
+# ---- ESEMPIO USO ----
+if __name__ == "__main__":
+    od = ODMatrixCharts(db_filename="taxi_trips.duckdb", schema="dwh_datamart")
+    print("Mesi ricostruiti:", od.refresh())
+
+    df_top = od.q_top_flows(k=20)
+    print(df_top)
+    od.plot_top_flows(df_top)
+
+    od.plot_borough_flows(od.q_borough_flows())
+    print(od.q_zone_marginals().head(20))
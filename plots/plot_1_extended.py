@@ -1,16 +1,22 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import duckdb
-import pandas as pd
-import plotly.express as px
+from approx import SAMPLE_TABLE, stratified_sql
+from chart_base import DAILY_METRICS_TABLE, NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+from sharded import Aggregate
+
+px = lazy_module("plotly.express")
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 @dataclass
-class TaxiCharts:
+class TaxiCharts(ChartBase):
     """
     Utility per estrarre dati da DuckDB (dbt marts) e creare grafici con Plotly.
 
@@ -20,28 +26,8 @@ class TaxiCharts:
     Nota:
     - Se alcune colonne differiscono nel tuo mart, modifica solo le query qui sotto.
     """
-    db_filename: str = "taxi_trips.duckdb"
-    project_root: Optional[Path] = None
-    schema: str = "dwh_datamart"
     highlight_borough: str = "manhattan"
 
-    def __post_init__(self) -> None:
-        if self.project_root is None:
-            # plots/qualcosa.py -> parents[1] = root progetto
-            self.project_root = Path(__file__).resolve().parents[1]
-        self.db_path = (self.project_root / self.db_filename).resolve()
-
-        if not self.db_path.exists():
-            raise FileNotFoundError(f"DuckDB non trovato: {self.db_path}")
-
-    def _connect(self) -> duckdb.DuckDBPyConnection:
-        return duckdb.connect(str(self.db_path), read_only=True)
-
-    def _sql(self, query: str) -> pd.DataFrame:
-        """Esegue SQL e ritorna un DataFrame."""
-        with self._connect() as con:
-            return con.execute(query).df()
-
     # ----------------------------
     # DATASETS (QUERY)
     # ----------------------------
@@ -50,100 +36,154 @@ class TaxiCharts:
         self,
         start_date: str = "2024-01-01",
         end_date: str = "2024-04-01",
+        approx: bool = False,
+        filters: Optional[ChartFilter] = None,
     ) -> pd.DataFrame:
         """
         Query multidimensionale (borough pickup x day_name x weekend x season) con KPI.
+        Con approx=True usa il campione stratificato e aggiunge gli intervalli *_ci_low/_ci_high.
+        Il periodo di `filters`, se presente, ha la precedenza su start_date/end_date.
         """
-        sql = f"""
-        SELECT
-            -- Dimensioni
-            zp.borough_name AS pickup_borough,
-            d.day_name,
-            d.is_weekend,
-            d.season,
-
-            -- Misure aggregate
-            COUNT(*) AS total_trips,
-            SUM(f.total_amount) AS total_revenue,
-            AVG(f.total_amount) AS avg_fare,
-            AVG(f.trip_distance) AS avg_distance,
-            AVG(f.trip_duration_minutes) AS avg_duration,
-            SUM(f.tip_amount) AS total_tips,
-
-            -- Misure calcolate
-            SUM(f.total_amount) / NULLIF(COUNT(*), 0) AS revenue_per_trip,
-            SUM(f.trip_distance) / NULLIF(COUNT(*), 0) AS distance_per_trip
-        FROM {self.schema}.dm_fact_taxi_trip f
-        INNER JOIN {self.schema}.dm_zone zp
-            ON f.key_zone_pickup = zp.key_zone
-            AND zp.is_current = TRUE
-        INNER JOIN {self.schema}.dm_date d
-            ON f.key_date_pickup = d.key_date
-        LEFT JOIN {self.schema}.dm_weather w
-            ON f.key_weather = w.key_weather
-        WHERE d.date >= '{start_date}'
-          AND d.date <  '{end_date}'
-        GROUP BY
-            zp.borough_name,
-            d.day_name,
-            d.is_weekend,
-            d.season
-        """
-        df = self._sql(sql)
+        filters = (filters or ChartFilter()).with_defaults(start_date, end_date)
+        if approx:
+            return self._q_weather_multidim_approx(filters)
+        df = self._aggregate(Aggregate(
+            # Dimensioni
+            group_by={
+                "pickup_borough": "f.pickup_borough",
+                "day_name": "f.day_name",
+                "is_weekend": "f.is_weekend",
+                "season": "f.season",
+            },
+            # Misure aggregate
+            measures={
+                "total_trips": ("count", "*"),
+                "total_revenue": ("sum", "f.total_amount"),
+                "avg_fare": ("avg", "f.total_amount"),
+                "avg_distance": ("avg", "f.trip_distance"),
+                "avg_duration": ("avg", "f.trip_duration_minutes"),
+                "total_tips": ("sum", "f.tip_amount"),
+                "total_distance": ("sum", "f.trip_distance"),
+            },
+            where=f"{self._fact_where(filters)} AND f.pickup_borough IS NOT NULL",
+            # Misure calcolate
+            derived={
+                "revenue_per_trip": "total_revenue / NULLIF(total_trips, 0)",
+                "distance_per_trip": "total_distance / NULLIF(total_trips, 0)",
+            },
+        ), filters)
+        df = df.drop(columns="total_distance")
         # Normalizzazioni utili
         df["pickup_borough"] = df["pickup_borough"].astype(str).str.lower()
         df["day_name"] = df["day_name"].astype(str)
         df["season"] = df["season"].astype(str)
         return df
 
-    def q_dropoff_trips_by_neighborhood(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-            z.neighborhood_name,
-            z.borough_name,
-            COUNT(*) AS total_trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_zone z ON f.key_zone_dropoff = z.key_zone
-        GROUP BY z.neighborhood_name, z.borough_name
-        ORDER BY total_trips DESC
-        """
-        return self._sql(sql)
-
-    def q_avg_revenue_by_vendor(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-            v.vendor_name,
-            AVG(f.total_amount) AS avg_revenue
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_vendor v ON f.key_vendor = v.key_vendor
-        GROUP BY v.vendor_name
-        ORDER BY avg_revenue DESC
-        """
-        return self._sql(sql)
-
-    def q_trips_by_apparent_temp_category(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-            w.apparent_temperature_category,
-            COUNT(*) AS total_trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_weather w ON f.key_weather = w.key_weather
-        GROUP BY w.apparent_temperature_category
-        ORDER BY total_trips DESC
+    def _q_weather_multidim_approx(self, filters: ChartFilter) -> pd.DataFrame:
+        rows_sql = f"""
+            SELECT
+                zp.borough_name AS pickup_borough,
+                d.day_name,
+                d.is_weekend,
+                d.season,
+                s.total_amount,
+                s.trip_distance,
+                s.trip_duration_minutes,
+                s.tip_amount,
+                s.key_date_pickup,
+                s.stratum_borough,
+                s.stratum_rows,
+                s.stratum_sample_rows
+            FROM {self.schema}.{SAMPLE_TABLE} s
+            INNER JOIN {self.schema}.dm_zone zp
+                ON s.key_zone_pickup = zp.key_zone
+                AND zp.is_current = TRUE
+            INNER JOIN {self.schema}.dm_date d
+                ON s.key_date_pickup = d.key_date
+            WHERE {self._fact_where(filters, alias="s")}
         """
-        return self._sql(sql)
+        sql = stratified_sql(
+            rows_sql,
+            group_cols=["pickup_borough", "day_name", "is_weekend", "season"],
+            count_name="total_trips",
+            sums={"total_revenue": "total_amount", "total_tips": "tip_amount"},
+            avgs={
+                "avg_fare": "total_amount",
+                "avg_distance": "trip_distance",
+                "avg_duration": "trip_duration_minutes",
+            },
+        )
+        df = self._sql(sql)
+        df["revenue_per_trip"] = df["avg_fare"]
+        df["distance_per_trip"] = df["avg_distance"]
+        df["pickup_borough"] = df["pickup_borough"].astype(str).str.lower()
+        df["day_name"] = df["day_name"].astype(str)
+        df["season"] = df["season"].astype(str)
+        return df
 
-    def q_max_daily_revenue_january_2025(self) -> pd.DataFrame:
+    def q_dropoff_trips_by_neighborhood(
+        self,
+        approx: bool = False,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        if approx:
+            rows_sql = f"""
+                SELECT
+                    z.neighborhood_name,
+                    z.borough_name,
+                    s.key_date_pickup,
+                    s.stratum_borough,
+                    s.stratum_rows,
+                    s.stratum_sample_rows
+                FROM {self.schema}.{SAMPLE_TABLE} s
+                JOIN {self.schema}.dm_zone z ON s.key_zone_dropoff = z.key_zone
+                WHERE {self._fact_where(filters, alias="s")}
+            """
+            sql = stratified_sql(
+                rows_sql,
+                group_cols=["neighborhood_name", "borough_name"],
+                count_name="total_trips",
+            ) + "\nORDER BY total_trips DESC"
+            return self._sql(sql)
+
+        return self._aggregate(Aggregate(
+            group_by={"neighborhood_name": "f.dropoff_neighborhood", "borough_name": "f.dropoff_borough"},
+            measures={"total_trips": ("count", "*")},
+            where=f"{self._fact_where(filters)} AND f.dropoff_neighborhood IS NOT NULL",
+            order_by="total_trips DESC",
+        ), filters)
+
+    def q_avg_revenue_by_vendor(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"vendor_name": "f.vendor_name"},
+            measures={"avg_revenue": ("avg", "f.total_amount")},
+            where=f"{self._fact_where(filters)} AND f.vendor_name IS NOT NULL",
+            order_by="avg_revenue DESC",
+        ), filters)
+
+    def q_trips_by_apparent_temp_category(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"apparent_temperature_category": "f.apparent_temperature_category"},
+            measures={"total_trips": ("count", "*")},
+            where=f"{self._fact_where(filters)} AND f.key_weather <> -1",
+            order_by="total_trips DESC",
+        ), filters)
+
+    def q_max_daily_revenue_january_2025(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        filters = (filters or ChartFilter()).with_defaults("2025-01-01", "2025-02-01")
+        return self.q_max_daily_revenue(filters)
+
+    def q_max_daily_revenue(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Giorno (o giorni, a parità) con il revenue massimo nel periodo del filtro."""
         sql = f"""
         WITH daily AS (
           SELECT
-              d.date,
+              f.pickup_date AS date,
               SUM(f.total_amount) AS daily_revenue
-          FROM {self.schema}.dm_fact_taxi_trip f
-          JOIN {self.schema}.dm_date d ON f.key_date_pickup = d.key_date
-          WHERE d.year = 2025
-            AND d.month_name = 'january'
-          GROUP BY d.date
+          FROM {self.schema}.{NARROW_TABLE} f
+          WHERE {self._fact_where(filters)}
+            AND f.pickup_date IS NOT NULL
+          GROUP BY f.pickup_date
         )
         SELECT
           d.date,
@@ -156,76 +196,63 @@ class TaxiCharts:
         """
         return self._sql(sql)
 
-    def q_revenue_by_year_month(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-          d.year,
-          d.month_name,
-          SUM(f.total_amount) AS revenue
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_date d ON f.key_date_pickup = d.key_date
-        GROUP BY d.year, d.month_name
-        ORDER BY d.year, d.month_name
-        """
-        return self._sql(sql)
-
-    def q_christmas_day_trips_by_neighborhood_pu(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-          z.neighborhood_name,
-          COUNT(*) AS trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_date d ON f.key_date_pickup = d.key_date
-        JOIN {self.schema}.dm_zone z ON f.key_zone_pickup = z.key_zone
-        WHERE d.is_holiday IS TRUE
-          AND d.holiday_name = 'Christmas Day'
-        GROUP BY z.neighborhood_name
-        ORDER BY trips DESC
-        """
-        return self._sql(sql)
-
-    def q_christmas_day_trips_by_neighborhood_do(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-          z.neighborhood_name,
-          COUNT(*) AS trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_date d ON f.key_date_dropoff = d.key_date
-        JOIN {self.schema}.dm_zone z ON f.key_zone_dropoff = z.key_zone
-        WHERE d.is_holiday IS TRUE
-          AND d.holiday_name = 'Christmas Day'
-        GROUP BY z.neighborhood_name
-        ORDER BY trips DESC
-        """
-        return self._sql(sql)
-
-    def q_holiday_day_trips_by_neighborhood_pu(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-          z.neighborhood_name,
-          COUNT(*) AS trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_date d ON f.key_date_pickup = d.key_date
-        JOIN {self.schema}.dm_zone z ON f.key_zone_pickup = z.key_zone
-        WHERE d.is_holiday IS TRUE
-        GROUP BY z.neighborhood_name
-        ORDER BY trips DESC
-        """
-        return self._sql(sql)
-
-    def q_holiday_day_trips_by_neighborhood_do(self) -> pd.DataFrame:
-        sql = f"""
-        SELECT
-          z.neighborhood_name,
-          COUNT(*) AS trips
-        FROM {self.schema}.dm_fact_taxi_trip f
-        JOIN {self.schema}.dm_date d ON f.key_date_dropoff = d.key_date
-        JOIN {self.schema}.dm_zone z ON f.key_zone_dropoff = z.key_zone
-        WHERE d.is_holiday IS TRUE
-        GROUP BY z.neighborhood_name
-        ORDER BY trips DESC
-        """
-        return self._sql(sql)
+    def q_revenue_by_year_month(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        daily_where = self._daily_where(filters)
+        if daily_where is not None:
+            # somme giornaliere precalcolate (dm_daily_metrics): poche migliaia di righe
+            sql = f"""
+            SELECT
+              d.year,
+              d.month_name,
+              SUM(d.revenue) AS revenue
+            FROM {self.schema}.{DAILY_METRICS_TABLE} d
+            WHERE {daily_where}
+            GROUP BY d.year, d.month_name
+            ORDER BY d.year, d.month_name
+            """
+            return self._sql(sql)
+        return self._aggregate(Aggregate(
+            group_by={"year": "f.year", "month_name": "f.month_name"},
+            measures={"revenue": ("sum", "f.total_amount")},
+            where=f"{self._fact_where(filters)} AND f.year IS NOT NULL",
+            order_by="year, month_name",
+        ), filters)
+
+    def q_christmas_day_trips_by_neighborhood_pu(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"neighborhood_name": "f.pickup_neighborhood"},
+            measures={"trips": ("count", "*")},
+            where=(f"f.is_holiday IS TRUE AND {self._fact_where(filters)}"
+                   " AND f.holiday_name = 'Christmas Day' AND f.pickup_neighborhood IS NOT NULL"),
+            order_by="trips DESC",
+        ), filters)
+
+    def q_christmas_day_trips_by_neighborhood_do(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"neighborhood_name": "f.dropoff_neighborhood"},
+            measures={"trips": ("count", "*")},
+            where=(f"f.dropoff_is_holiday IS TRUE AND {self._fact_where(filters)}"
+                   " AND f.dropoff_holiday_name = 'Christmas Day' AND f.dropoff_neighborhood IS NOT NULL"),
+            order_by="trips DESC",
+        ), filters)
+
+    def q_holiday_day_trips_by_neighborhood_pu(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"neighborhood_name": "f.pickup_neighborhood"},
+            measures={"trips": ("count", "*")},
+            where=(f"f.is_holiday IS TRUE AND {self._fact_where(filters)}"
+                   " AND f.pickup_neighborhood IS NOT NULL"),
+            order_by="trips DESC",
+        ), filters)
+
+    def q_holiday_day_trips_by_neighborhood_do(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        return self._aggregate(Aggregate(
+            group_by={"neighborhood_name": "f.dropoff_neighborhood"},
+            measures={"trips": ("count", "*")},
+            where=(f"f.dropoff_is_holiday IS TRUE AND {self._fact_where(filters)}"
+                   " AND f.dropoff_neighborhood IS NOT NULL"),
+            order_by="trips DESC",
+        ), filters)
 
     # ----------------------------
     # PLOTS
@@ -250,8 +277,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Total trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_top_pickup_neighborhoods(
         self,
@@ -272,8 +298,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Total trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_avg_revenue_by_vendor(
         self,
@@ -290,8 +315,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="Avg revenue", tickformat="$~s")
         fig.update_xaxes(title_text="Vendor")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_trips_by_temp_category(
         self,
@@ -308,8 +332,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="Total trips", tickformat="~s")
         fig.update_xaxes(title_text="Apparent temperature category")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_christmas_trips_top_neighborhoods_pu(
         self,
@@ -329,8 +352,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_holiday_trips_top_neighborhoods_pu(
         self,
@@ -350,8 +372,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_christmas_trips_top_neighborhoods_do(
         self,
@@ -371,8 +392,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_holiday_trips_top_neighborhoods_do(
         self,
@@ -392,8 +412,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="", categoryorder="total ascending")
         fig.update_xaxes(title_text="Trips", tickformat="~s")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_tip_rate_by_temp(
         self,
@@ -410,8 +429,7 @@ class TaxiCharts:
         fig.update_yaxes(title_text="Tip rate (tips / total)", tickformat=".2%")
         fig.update_xaxes(title_text="Apparent temperature category")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
 
 # ---- ESEMPIO USO (PyCharm: tasto destro -> Run) ----
@@ -1,64 +1,55 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from pathlib import Path
 from typing import Optional
 
-import duckdb
 import pandas as pd
-import plotly.express as px
+
+from chart_base import NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+
+px = lazy_module("plotly.express")
 
 
 @dataclass
-class TaxiChartsByBorough:
+class TaxiChartsByBorough(ChartBase):
     """
     Analisi taxi normalizzata per record meteo,
     con breakdown per borough e condizioni meteo.
     """
-    db_filename: str = "taxi_trips.duckdb"
-    project_root: Optional[Path] = None
-    schema: str = "dwh_datamart"
-
-    def __post_init__(self) -> None:
-        if self.project_root is None:
-            self.project_root = Path(__file__).resolve().parents[1]
-        self.db_path = (self.project_root / self.db_filename).resolve()
-
-        if not self.db_path.exists():
-            raise FileNotFoundError(f"DuckDB non trovato: {self.db_path}")
-
-    def _connect(self) -> duckdb.DuckDBPyConnection:
-        return duckdb.connect(str(self.db_path), read_only=True)
 
     # ------------------------------------------------------------------
     # LOADERS
     # ------------------------------------------------------------------
 
     def _load_df(self, sql: str, value_col: str, label_col: str) -> pd.DataFrame:
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df[value_col] = df[value_col].astype(float)
         df[label_col] = df[label_col].astype(str)
         df["borough"] = df["borough"].astype(str)
         return df
 
-    def load_rainy_by_borough(self) -> pd.DataFrame:
+    def load_rainy_by_borough(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT is_rainy, COUNT(DISTINCT key_weather) AS total_weather
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY is_rainy
         ),
         taxi_totals AS (
             SELECT
-                w.is_rainy,
+                t.is_rainy,
                 COUNT(*) AS taxi_trips,
-                z.borough_name AS borough
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w ON w.key_weather = t.key_weather
-            JOIN {self.schema}.dm_zone z ON z.key_zone = t.key_zone_pickup
-            GROUP BY w.is_rainy, z.borough_name
+                t.pickup_borough AS borough
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+              AND t.pickup_borough IS NOT NULL
+            GROUP BY t.is_rainy, t.pickup_borough
         )
         SELECT
             t.is_rainy,
@@ -73,22 +64,25 @@ class TaxiChartsByBorough:
         df["condition"] = df["is_rainy"].map({"true": "Rainy", "false": "Not rainy"})
         return df
 
-    def load_snowy_by_borough(self) -> pd.DataFrame:
+    def load_snowy_by_borough(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT is_snowy, COUNT(DISTINCT key_weather) AS total_weather
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY is_snowy
         ),
         taxi_totals AS (
             SELECT
-                w.is_snowy,
+                t.is_snowy,
                 COUNT(*) AS taxi_trips,
-                z.borough_name AS borough
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w ON w.key_weather = t.key_weather
-            JOIN {self.schema}.dm_zone z ON z.key_zone = t.key_zone_pickup
-            GROUP BY w.is_snowy, z.borough_name
+                t.pickup_borough AS borough
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+              AND t.pickup_borough IS NOT NULL
+            GROUP BY t.is_snowy, t.pickup_borough
         )
         SELECT
             t.is_snowy,
@@ -103,22 +97,29 @@ class TaxiChartsByBorough:
         df["condition"] = df["is_snowy"].map({"true": "Snowy", "false": "Not snowy"})
         return df
 
-    def load_intensity_by_borough(self, intensity_col: str) -> pd.DataFrame:
+    def load_intensity_by_borough(
+        self,
+        intensity_col: str,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT {intensity_col}, COUNT(DISTINCT key_weather) AS total_weather
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY {intensity_col}
         ),
         taxi_totals AS (
             SELECT
-                w.{intensity_col},
-                z.borough_name AS borough,
+                t.{intensity_col},
+                t.pickup_borough AS borough,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w ON w.key_weather = t.key_weather
-            JOIN {self.schema}.dm_zone z ON z.key_zone = t.key_zone_pickup
-            GROUP BY w.{intensity_col}, z.borough_name
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+              AND t.pickup_borough IS NOT NULL
+            GROUP BY t.{intensity_col}, t.pickup_borough
         )
         SELECT
             t.{intensity_col} AS intensity,
@@ -131,17 +132,16 @@ class TaxiChartsByBorough:
         """
         return self._load_df(sql, "trips_per_category", "intensity")
 
-    def trip_distance_borough(self) -> pd.DataFrame:
+    def trip_distance_borough(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
         sql = f"""
-        select z.borough_name , avg(f.trip_distance)
-        from {self.schema}.dm_fact_taxi_trip f
-        join {self.schema}.dm_zone z
-            on f.key_zone_pickup = z.key_zone
-        WHERE f.Airport_fee = 0
-        GROUP BY z.borough_name
+        select f.pickup_borough AS borough_name, avg(f.trip_distance)
+        from {self.schema}.{NARROW_TABLE} f
+        WHERE f.airport_fee = 0
+          AND f.pickup_borough IS NOT NULL
+          AND {self._fact_where(filters)}
+        GROUP BY f.pickup_borough
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         # Adatta le colonne
         df = df.rename(columns={
@@ -184,8 +184,7 @@ class TaxiChartsByBorough:
         fig.update_yaxes(type="log")
         fig.update_yaxes(title_text="Avg taxi trips per weather record")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_by_borough_2(
             self,
@@ -204,6 +203,8 @@ class TaxiChartsByBorough:
 
         # (Categorical + sort)
         if category_order is not None:
+            # Solo le categorie presenti: plotly fallisce su categorie vuote
+            category_order = [c for c in category_order if c in set(d[color])]
             d[color] = pd.Categorical(d[color], categories=category_order, ordered=True)
             d = d.sort_values([x, color])
 
@@ -229,8 +230,7 @@ class TaxiChartsByBorough:
         fig.update_yaxes(title_text="Avg taxi trips per weather record")
         fig.update_layout(title_x=0.5)
 
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_by_trip_distance(
             self,
@@ -266,8 +266,7 @@ class TaxiChartsByBorough:
         fig.update_yaxes(title_text="Avg trip distance (miles or km)")
 
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
 
 # ------------------------------------------------------------------
@@ -309,7 +308,7 @@ if __name__ == "__main__":
         category_order=rain_order,
     )
 
-    wind_order = ["No Wind", "Light wind", "Moderate Wind", "Strong Wind", "Very Strong Wind"]
+    wind_order = ["No Wind", "Light Wind", "Moderate Wind", "Strong Wind", "Very Strong Wind"]
     # Wind intensity by borough
     df_wind_int = charts.load_intensity_by_borough("wind_intensity")
     charts.plot_by_borough_2(
@@ -1,56 +1,53 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from pathlib import Path
 from typing import Optional, List
 
-import duckdb
 import pandas as pd
-import plotly.express as px
+
+from approx import SAMPLE_TABLE, stratified_sql
+from chart_base import NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+
+px = lazy_module("plotly.express")
 
 
 @dataclass
-class TaxiCharts:
+class TaxiCharts(ChartBase):
     """
     Utility per estrarre dati da DuckDB (dbt marts) e creare grafici con Plotly.
     Pensata per uso in PyCharm: fig.show() apre una vista interattiva (browser o inline).
     """
-    db_filename: str = "taxi_trips.duckdb"
-    project_root: Optional[Path] = None
-    schema: str = "dwh_datamart"
-
-    def __post_init__(self) -> None:
-        if self.project_root is None:
-            self.project_root = Path(__file__).resolve().parents[1]
-        self.db_path = (self.project_root / self.db_filename).resolve()
-
-        if not self.db_path.exists():
-            raise FileNotFoundError(f"DuckDB non trovato: {self.db_path}")
-
-    def _connect(self) -> duckdb.DuckDBPyConnection:
-        return duckdb.connect(str(self.db_path), read_only=True)
 
     # -------------------------
     # LOADERS (QUERY -> DF)
     # -------------------------
 
-    def load_agg_rainy(self) -> pd.DataFrame:
+    def load_agg_rainy(self, approx: bool = False, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        if approx:
+            df = self._load_agg_approx("is_rainy", "trips_per_weather", filters)
+            df["label"] = df["is_rainy"].map({True: "Rainy", False: "Not rainy"})
+            return df
+
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT
                 is_rainy,
                 COUNT(DISTINCT key_weather) AS total_weather
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY is_rainy
         ),
         taxi_totals AS (
             SELECT
-                w.is_rainy,
+                t.is_rainy,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w
-                ON w.key_weather = t.key_weather
-            GROUP BY w.is_rainy
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+            GROUP BY t.is_rainy
         )
         SELECT
             t.is_rainy,
@@ -61,30 +58,36 @@ class TaxiCharts:
             ON t.is_rainy = w.is_rainy
         ORDER BY t.is_rainy;
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df["trips_per_weather"] = df["trips_per_weather"].astype(float)
         df["label"] = df["is_rainy"].map({True: "Rainy", False: "Not rainy"})
         return df
 
-    def load_agg_snowy(self) -> pd.DataFrame:
+    def load_agg_snowy(self, approx: bool = False, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        if approx:
+            df = self._load_agg_approx("is_snowy", "trips_per_weather", filters)
+            df["label"] = df["is_snowy"].map({True: "Snowy", False: "Not snowy"})
+            return df
+
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT
                 is_snowy,
                 COUNT(DISTINCT key_weather) AS total_weather
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY is_snowy
         ),
         taxi_totals AS (
             SELECT
-                w.is_snowy,
+                t.is_snowy,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w
-                ON w.key_weather = t.key_weather
-            GROUP BY w.is_snowy
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+            GROUP BY t.is_snowy
         )
         SELECT
             t.is_snowy,
@@ -95,30 +98,36 @@ class TaxiCharts:
             ON t.is_snowy = w.is_snowy
         ORDER BY t.is_snowy;
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df["trips_per_weather"] = df["trips_per_weather"].astype(float)
         df["label"] = df["is_snowy"].map({True: "Snowy", False: "Not snowy"})
         return df
 
-    def load_agg_rain_intensity(self) -> pd.DataFrame:
+    def load_agg_rain_intensity(self, approx: bool = False, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        if approx:
+            df = self._load_agg_approx("rain_intensity", "trips_per_category", filters)
+            df["label"] = df["rain_intensity"].astype(str)
+            return df
+
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT
                 rain_intensity,
                 COUNT(DISTINCT key_weather) AS total_weather_rain
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY rain_intensity
         ),
         taxi_totals AS (
             SELECT
-                w.rain_intensity,
+                t.rain_intensity,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w
-                ON w.key_weather = t.key_weather
-            GROUP BY w.rain_intensity
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+            GROUP BY t.rain_intensity
         )
         SELECT
             t.rain_intensity,
@@ -128,31 +137,37 @@ class TaxiCharts:
         JOIN weather_totals w
             ON t.rain_intensity = w.rain_intensity;
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df["trips_per_category"] = df["trips_per_category"].astype(float)
         # label leggibile (di solito già ok, ma uniformiamo)
         df["label"] = df["rain_intensity"].astype(str)
         return df
 
-    def load_agg_wind_intensity(self) -> pd.DataFrame:
+    def load_agg_wind_intensity(self, approx: bool = False, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        if approx:
+            df = self._load_agg_approx("wind_intensity", "trips_per_category", filters)
+            df["label"] = df["wind_intensity"].astype(str)
+            return df
+
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT
                 wind_intensity,
                 COUNT(DISTINCT key_weather) AS total_weather_wind
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY wind_intensity
         ),
         taxi_totals AS (
             SELECT
-                w.wind_intensity,
+                t.wind_intensity,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w
-                ON w.key_weather = t.key_weather
-            GROUP BY w.wind_intensity
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+            GROUP BY t.wind_intensity
         )
         SELECT
             t.wind_intensity,
@@ -162,30 +177,36 @@ class TaxiCharts:
         JOIN weather_totals w
             ON t.wind_intensity = w.wind_intensity;
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df["trips_per_category"] = df["trips_per_category"].astype(float)
         df["label"] = df["wind_intensity"].astype(str)
         return df
 
-    def load_agg_snow_intensity(self) -> pd.DataFrame:
+    def load_agg_snow_intensity(self, approx: bool = False, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        if approx:
+            df = self._load_agg_approx("snow_intensity", "trips_per_category", filters)
+            df["label"] = df["snow_intensity"].astype(str)
+            return df
+
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
         sql = f"""
         WITH weather_totals AS (
             SELECT
                 snow_intensity,
                 COUNT(DISTINCT key_weather) AS total_weather_snow
-            FROM {self.schema}.dm_weather_dt
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
             GROUP BY snow_intensity
         ),
         taxi_totals AS (
             SELECT
-                w.snow_intensity,
+                t.snow_intensity,
                 COUNT(*) AS taxi_trips
-            FROM {self.schema}.dm_fact_taxi_trip t
-            JOIN {self.schema}.dm_weather_dt w
-                ON w.key_weather = t.key_weather
-            GROUP BY w.snow_intensity
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {self._fact_where(filters, alias="t")}
+              AND t.key_weather <> -1
+            GROUP BY t.snow_intensity
         )
         SELECT
             t.snow_intensity,
@@ -195,13 +216,61 @@ class TaxiCharts:
         JOIN weather_totals w
             ON t.snow_intensity = w.snow_intensity;
         """
-        with self._connect() as con:
-            df = con.execute(sql).df()
+        df = self._sql(sql)
 
         df["trips_per_category"] = df["trips_per_category"].astype(float)
         df["label"] = df["snow_intensity"].astype(str)
         return df
 
+    def _load_agg_approx(
+        self,
+        weather_col: str,
+        ratio_col: str,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        """
+        Versione approssimata dei loader: taxi_trips stimati sul campione stratificato
+        (con intervallo di confidenza), totali meteo esatti (dm_weather_dt è piccola).
+        """
+        rows_sql = f"""
+            SELECT
+                w.{weather_col},
+                s.key_date_pickup,
+                s.stratum_borough,
+                s.stratum_rows,
+                s.stratum_sample_rows
+            FROM {self.schema}.{SAMPLE_TABLE} s
+            JOIN {self.schema}.dm_weather_dt w
+                ON w.key_weather = s.key_weather
+            WHERE {self._fact_where(filters, alias="s")}
+        """
+        taxi_totals = stratified_sql(rows_sql, group_cols=[weather_col], count_name="taxi_trips")
+        filters_weather = (filters or ChartFilter()).weather_predicates("w")
+        sql = f"""
+        WITH weather_totals AS (
+            SELECT
+                {weather_col},
+                COUNT(DISTINCT key_weather) AS total_weather
+            FROM {self.schema}.dm_weather_dt w
+            WHERE {filters_weather}
+            GROUP BY {weather_col}
+        ),
+        taxi_totals AS ({taxi_totals})
+        SELECT
+            t.{weather_col},
+            t.taxi_trips,
+            t.taxi_trips_ci_low,
+            t.taxi_trips_ci_high,
+            t.taxi_trips / w.total_weather AS {ratio_col},
+            t.taxi_trips_ci_low / w.total_weather AS {ratio_col}_ci_low,
+            t.taxi_trips_ci_high / w.total_weather AS {ratio_col}_ci_high
+        FROM taxi_totals t
+        JOIN weather_totals w
+            ON t.{weather_col} = w.{weather_col}
+        ORDER BY t.{weather_col};
+        """
+        return self._sql(sql)
+
     # -------------------------
     # PLOTS
     # -------------------------
@@ -238,8 +307,7 @@ class TaxiCharts:
         fig.update_xaxes(title_text="")
         fig.update_yaxes(title_text="Trips per weather record")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
     def plot_trips_per_category(
         self,
@@ -267,8 +335,7 @@ class TaxiCharts:
         fig.update_xaxes(title_text="")
         fig.update_yaxes(title_text="Trips per weather record")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
 
 
 if __name__ == "__main__":
@@ -301,7 +368,7 @@ if __name__ == "__main__":
     charts.plot_trips_per_category(
         df_wind_int,
         title="Avg taxi trips per weather record by wind intensity",
-        order = ["No Wind", "Light wind", "Moderate Wind", "Strong Wind", "Very Strong Wind"],
+        order = ["No Wind", "Light Wind", "Moderate Wind", "Strong Wind", "Very Strong Wind"],
     )
 
     # 5) Snow intensity
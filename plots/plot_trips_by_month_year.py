@@ -1,16 +1,21 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import duckdb
-import pandas as pd
-import plotly.express as px
+from chart_base import DAILY_METRICS_TABLE, ROLLING_METRICS_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+from sharded import Aggregate
+
+px = lazy_module("plotly.express")
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 
 @dataclass
-class TaxiCharts:
+class TaxiCharts(ChartBase):
     """
     Utility per estrarre dati da DuckDB (dbt marts) e creare grafici con Plotly.
 
@@ -20,45 +25,60 @@ class TaxiCharts:
     Nota:
     - Se alcune colonne differiscono nel tuo mart, modifica solo le query qui sotto.
     """
-    db_filename: str = "taxi_trips.duckdb"
-    project_root: Optional[Path] = None
-    schema: str = "dwh_datamart"
     highlight_borough: str = "manhattan"
 
-    def __post_init__(self) -> None:
-        if self.project_root is None:
-            # plots/qualcosa.py -> parents[1] = root progetto
-            self.project_root = Path(__file__).resolve().parents[1]
-        self.db_path = (self.project_root / self.db_filename).resolve()
-
-        if not self.db_path.exists():
-            raise FileNotFoundError(f"DuckDB non trovato: {self.db_path}")
-
-    def _connect(self) -> duckdb.DuckDBPyConnection:
-        return duckdb.connect(str(self.db_path), read_only=True)
-
-    def _sql(self, query: str) -> pd.DataFrame:
-        """Esegue SQL e ritorna un DataFrame."""
-        with self._connect() as con:
-            return con.execute(query).df()
-
     # ----------------------------
     # DATASETS (QUERY)
     # ----------------------------
 
-    def q_revenue_by_year_month(self) -> pd.DataFrame:
-        sql = f"""
+    def q_revenue_by_year_month(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        daily_where = self._daily_where(filters)
+        if daily_where is not None:
+            # somme giornaliere precalcolate (dm_daily_metrics): poche migliaia di righe
+            sql = f"""
             SELECT
               d.year,
-              EXTRACT(MONTH FROM d.date) AS month_num,
+              d.month AS month_num,
               d.month_name,
-              SUM(f.total_amount) AS revenue
-            FROM {self.schema}.dm_fact_taxi_trip f
-            JOIN {self.schema}.dm_date d
-              ON f.key_date_pickup = d.key_date
-            GROUP BY d.year, month_num, d.month_name
-            ORDER BY d.year, month_num
+              SUM(d.revenue) AS revenue
+            FROM {self.schema}.{DAILY_METRICS_TABLE} d
+            WHERE {daily_where}
+            GROUP BY d.year, d.month, d.month_name
+            ORDER BY d.year, d.month
             """
+            return self._sql(sql)
+        return self._aggregate(Aggregate(
+            group_by={"year": "f.year", "month_num": "f.month", "month_name": "f.month_name"},
+            measures={"revenue": ("sum", "f.total_amount")},
+            where=f"{self._fact_where(filters)} AND f.year IS NOT NULL",
+            order_by="year, month_num",
+        ), filters)
+
+    def q_rolling_metrics(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """
+        Serie giornaliera con medie mobili 7/28 giorni e variazione anno su anno (stesso giorno
+        della settimana, -364 giorni), sommando i borough selezionati da dm_daily_metrics_rolling.
+        """
+        daily_where = self._daily_where(filters, alias="r")
+        if daily_where is None:
+            raise ValueError("q_rolling_metrics supporta solo periodo e borough di pickup")
+        sql = f"""
+        SELECT
+          r.pickup_date,
+          SUM(r.trips) AS trips,
+          SUM(r.revenue) AS revenue,
+          SUM(r.trips_7d) / 7.0 AS trips_avg_7d,
+          SUM(r.trips_28d) / 28.0 AS trips_avg_28d,
+          SUM(r.revenue_7d) / 7.0 AS revenue_avg_7d,
+          SUM(r.revenue_28d) / 28.0 AS revenue_avg_28d,
+          SUM(r.revenue_28d) / NULLIF(SUM(r.trips_28d), 0) AS avg_fare_28d,
+          SUM(r.trips_28d) / NULLIF(SUM(r.trips_28d_py), 0) - 1 AS trips_yoy_28d,
+          SUM(r.revenue_28d) / NULLIF(SUM(r.revenue_28d_py), 0) - 1 AS revenue_yoy_28d
+        FROM {self.schema}.{ROLLING_METRICS_TABLE} r
+        WHERE {daily_where}
+        GROUP BY r.pickup_date
+        ORDER BY r.pickup_date
+        """
         return self._sql(sql)
 
     # ----------------------------------------------------------------
@@ -88,8 +108,38 @@ class TaxiCharts:
         fig.update_yaxes(title_text="Revenue", tickformat="$~s")
         fig.update_xaxes(title_text="Month")
         fig.update_layout(title_x=0.5)
-        fig.show()
-        return fig
+        return self._show(fig)
+
+    def plot_rolling_metrics(self, df: pd.DataFrame, metric: str = "trips", title: Optional[str] = None):
+        """Valore giornaliero, medie mobili 7/28 giorni e (asse destro) variazione YoY a 28 giorni."""
+        d = df.melt(
+            id_vars="pickup_date",
+            value_vars=[metric, f"{metric}_avg_7d", f"{metric}_avg_28d"],
+            var_name="series",
+            value_name="value",
+        )
+        fig = px.line(
+            d,
+            x="pickup_date",
+            y="value",
+            color="series",
+            template="simple_white",
+            title=title or f"Daily {metric} with 7/28-day moving averages",
+        )
+        fig.add_scatter(
+            x=df["pickup_date"],
+            y=df[f"{metric}_yoy_28d"],
+            name="YoY (28d)",
+            yaxis="y2",
+            line={"dash": "dot", "color": "grey"},
+        )
+        fig.update_layout(
+            title_x=0.5,
+            yaxis={"title": metric.capitalize()},
+            yaxis2={"title": "YoY change (28d)", "overlaying": "y", "side": "right", "tickformat": ".0%"},
+        )
+        fig.update_xaxes(title_text="Date")
+        return self._show(fig)
 
 
 if __name__ == "__main__":
@@ -97,3 +147,6 @@ if __name__ == "__main__":
     # 1) Revenue by year & month (line chart)
     df_rev = charts.q_revenue_by_year_month()
     charts.plot_revenue_by_year_month(df_rev)
+    # 2) Trip giornalieri con medie mobili e variazione anno su anno
+    df_roll = charts.q_rolling_metrics()
+    charts.plot_rolling_metrics(df_roll, metric="trips")
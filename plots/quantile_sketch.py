@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Sequence
+
+from chart_base import NARROW_TABLE, SKETCH_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+
+px = lazy_module("plotly.express")
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MEASURES = ("total_amount", "trip_duration_minutes", "trip_distance", "tip_percentage")
+WEATHER_COLUMNS = (
+    "rain_intensity",
+    "snow_intensity",
+    "temperature_category",
+    "apparent_temperature_category",
+    "wind_intensity",
+    "is_rainy",
+    "is_snowy",
+)
+# raggruppamenti -> (espressione sullo sketch `s`, espressione su dm_trip_narrow `t`)
+GROUPS = {
+    "borough": ("s.borough", "COALESCE(lower(t.pickup_borough), 'unknown')"),
+    "pickup_hour": ("s.pickup_hour", "t.pickup_hour"),
+    "pickup_date": ("s.pickup_date", "t.pickup_date"),
+    "month": ("date_trunc('month', s.pickup_date)", "date_trunc('month', t.pickup_date)"),
+    **{col: (f"COALESCE(w.{col}::VARCHAR, 'Unknown')", f"COALESCE(t.{col}::VARCHAR, 'Unknown')")
+       for col in WEATHER_COLUMNS},
+}
+DEFAULT_QUANTILES = (0.5, 0.9, 0.95)
+
+
+def quantile_label(q: float) -> str:
+    """0.5 -> 'p50', 0.995 -> 'p99.5'."""
+    return f"p{q * 100:g}"
+
+
+@dataclass
+class QuantileCharts(ChartBase):
+    """
+    Percentili di importo, durata, distanza e mancia per borough / ora / giorno / meteo.
+
+    Le medie dei grafici esistenti sono sensibili agli outlier; qui i quantili vengono dagli
+    sketch giornalieri di dm_daily_quantile_sketch (bucket logaritmici, errore relativo
+    <= sketch_relative_accuracy): per qualsiasi periodo si sommano i conteggi per bucket
+    e si cerca il bucket del rango richiesto, senza rileggere i trip.
+    Con filtri che lo sketch non conosce (dropoff, vendor, outlier) o exact=True si calcolano
+    quantili esatti (quantile_disc) su dm_trip_narrow.
+    """
+
+    def q_quantiles(
+        self,
+        measure: str = "total_amount",
+        by: Optional[str] = "borough",
+        quantiles: Sequence[float] = DEFAULT_QUANTILES,
+        filters: Optional[ChartFilter] = None,
+        exact: bool = False,
+    ) -> pd.DataFrame:
+        """Colonne: [by], trips, pXX per ogni quantile richiesto."""
+        if measure not in MEASURES:
+            raise ValueError(f"measure deve essere una di {MEASURES}")
+        if by is not None and by not in GROUPS:
+            raise ValueError(f"by deve essere None o uno di {list(GROUPS)}")
+        if not quantiles or any(not 0 <= q <= 1 for q in quantiles):
+            raise ValueError("quantiles deve contenere valori in [0, 1]")
+
+        sketch_where = None if exact else self._daily_where(filters, alias="s")
+        if sketch_where is None:
+            return self._exact_quantiles(measure, by, quantiles, filters)
+
+        group = GROUPS[by][0] if by else "NULL"
+        weather_join = (
+            f"LEFT JOIN {self.schema}.dm_weather_dt w ON s.key_weather = w.key_weather"
+            if by in WEATHER_COLUMNS else ""
+        )
+        # rango ceil(q * n), la stessa convenzione di quantile_disc
+        picks = ",\n          ".join(
+            f'MIN(value) FILTER (WHERE cum >= {q} * total) AS "{quantile_label(q)}"'
+            for q in quantiles
+        )
+        sql = f"""
+        WITH merged AS (
+          SELECT {group} AS grp, s.bucket, MIN(s.bucket_value) AS value, SUM(s.n) AS n
+          FROM {self.schema}.{SKETCH_TABLE} s
+          {weather_join}
+          WHERE s.measure = '{measure}'
+            AND {sketch_where}
+          GROUP BY ALL
+        ),
+        ranked AS (
+          SELECT
+            grp,
+            value,
+            SUM(n) OVER (PARTITION BY grp ORDER BY value ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW) AS cum,
+            SUM(n) OVER (PARTITION BY grp) AS total
+          FROM merged
+        )
+        SELECT
+          {f'grp AS "{by}",' if by else ''}
+          MAX(total)::BIGINT AS trips,
+          {picks}
+        FROM ranked
+        GROUP BY grp
+        ORDER BY grp
+        """
+        return self._sql(sql)
+
+    def _exact_quantiles(
+        self,
+        measure: str,
+        by: Optional[str],
+        quantiles: Sequence[float],
+        filters: Optional[ChartFilter],
+    ) -> pd.DataFrame:
+        group = GROUPS[by][1] if by else None
+        picks = ",\n          ".join(
+            f'quantile_disc(t.{measure}::DOUBLE, {q}) AS "{quantile_label(q)}"' for q in quantiles
+        )
+        sql = f"""
+        SELECT
+          {f'{group} AS "{by}",' if by else ''}
+          COUNT(t.{measure}) AS trips,
+          {picks}
+        FROM {self.schema}.{NARROW_TABLE} t
+        WHERE t.pickup_date IS NOT NULL
+          AND {self._fact_where(filters, alias="t")}
+        {'GROUP BY ALL ORDER BY 1' if by else ''}
+        """
+        return self._sql(sql)
+
+    # ----------------------------
+    # PLOT
+    # ----------------------------
+
+    def plot_quantiles(self, df: pd.DataFrame, title: str = "Percentiles", y_title: str = ""):
+        value_cols = [c for c in df.columns if c.startswith("p") and c[1:2].isdigit()]
+        by = next((c for c in df.columns if c not in value_cols and c != "trips"), None)
+        long = df.melt(id_vars=[c for c in (by, "trips") if c], value_vars=value_cols,
+                       var_name="percentile", value_name="value")
+        kwargs = dict(x=by, y="value", color="percentile", hover_data=["trips"],
+                      title=title, template="simple_white")
+        if by in ("pickup_hour", "pickup_date", "month"):
+            fig = px.line(long, markers=True, **kwargs)
+        else:
+            fig = px.bar(long, barmode="group", **kwargs)
+        fig.update_yaxes(title_text=y_title)
+        fig.update_layout(title_x=0.5)
+        return self._show(fig)
+
+
+# ---- ESEMPIO USO ----
+if __name__ == "__main__":
+    charts = QuantileCharts(db_filename="taxi_trips.duckdb", schema="dwh_datamart")
+
+    df_fare = charts.q_quantiles("total_amount", by="borough")
+    print(df_fare)
+    charts.plot_quantiles(df_fare, title="Total amount percentiles by borough", y_title="USD")
+
+    df_duration = charts.q_quantiles("trip_duration_minutes", by="pickup_hour", quantiles=(0.5, 0.9, 0.99))
+    charts.plot_quantiles(df_duration, title="Trip duration percentiles by pickup hour", y_title="Minutes")
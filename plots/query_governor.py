@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import duckdb
+
+# Variabili d'ambiente lette da QueryGovernor.from_env() (come QUERY_PROFILE_* per il profiler)
+ENV_MAX_HEAVY = "QUERY_MAX_HEAVY"
+ENV_TIMEOUT = "QUERY_TIMEOUT_S"
+ENV_QUEUE_TIMEOUT = "QUERY_QUEUE_TIMEOUT_S"
+ENV_MEMORY_LIMIT = "QUERY_MEMORY_LIMIT"
+
+# Query "pesanti": leggono tabelle a livello di trip. Le tabelle aggregate (metriche
+# giornaliere, sketch, campione, cubo) restano fuori dalla coda.
+HEAVY_TABLES = ("dm_trip_narrow", "dm_fact_taxi_trip", "dm_fact_taxi_trip_readable", "ods_taxi_trip")
+# intervallo con cui chi è in coda ricontrolla cancellazione e scadenza
+QUEUE_POLL_S = 0.1
+
+
+class QueryTimeout(RuntimeError):
+    """La query ha superato il tempo massimo ed è stata interrotta."""
+
+
+class QueryCancelled(RuntimeError):
+    """La query è stata annullata (CancelToken.cancel) prima o durante l'esecuzione."""
+
+
+class QueryQueueFull(RuntimeError):
+    """Nessuno slot per query pesanti libero entro queue_timeout_s."""
+
+
+class CancelToken:
+    """
+    Annullamento cooperativo: cancel() interrompe (con.interrupt) le query in corso
+    legate al token e fa fallire subito quelle in coda o successive.
+    Si può chiamare da un altro thread (es. un notebook mentre la query gira).
+    """
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections: Set[duckdb.DuckDBPyConnection] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._event.set()
+            for con in self._connections:
+                con.interrupt()
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise QueryCancelled("Query annullata")
+
+    def _attach(self, con: duckdb.DuckDBPyConnection) -> None:
+        with self._lock:
+            self.check()
+            self._connections.add(con)
+
+    def _detach(self, con: duckdb.DuckDBPyConnection) -> None:
+        with self._lock:
+            self._connections.discard(con)
+
+
+class _Deadline:
+    """Timer che interrompe la connessione allo scadere, mai dopo la fine della query."""
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, timeout_s: float) -> None:
+        self._con = con
+        self._lock = threading.Lock()
+        self._done = False
+        self.expired = False
+        self._timer = threading.Timer(timeout_s, self._expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _expire(self) -> None:
+        with self._lock:
+            if not self._done:
+                self.expired = True
+                self._con.interrupt()
+
+    def stop(self) -> None:
+        with self._lock:
+            self._done = True
+        self._timer.cancel()
+
+
+@dataclass
+class QueryGovernor:
+    """
+    Limiti di esecuzione per le query dei grafici (ChartBase._sql) e dell'API.
+
+    - Al più `max_heavy` query pesanti (HEAVY_TABLES) in parallelo; le altre aspettano
+      in coda (fino a `queue_timeout_s`, poi QueryQueueFull). max_heavy=None: nessuna coda. Le query leggere (tabelle
+      aggregate) non passano dalla coda: gli utenti interattivi restano reattivi mentre
+      una query storica lunga gira in background.
+    - `timeout_s`: tempo massimo di esecuzione (default, sovrascrivibile per query); allo
+      scadere la connessione viene interrotta e si alza QueryTimeout.
+    - CancelToken: annullamento cooperativo dall'esterno (QueryCancelled).
+    - `memory_limit` (es. '4GB'): in DuckDB il limite vale per l'intera istanza, condivisa da
+      tutte le connessioni del processo sullo stesso file; con max_heavy slot ogni query
+      pesante ne ha circa 1/max_heavy, oltre si spilla su disco o si alza OutOfMemory.
+    """
+    max_heavy: Optional[int] = 2
+    timeout_s: Optional[float] = None
+    queue_timeout_s: Optional[float] = None
+    memory_limit: Optional[str] = None
+    heavy_tables: Tuple[str, ...] = HEAVY_TABLES
+
+    def __post_init__(self) -> None:
+        if self.max_heavy is not None and self.max_heavy < 1:
+            raise ValueError("max_heavy deve essere None o >= 1")
+        self._slots = threading.BoundedSemaphore(self.max_heavy) if self.max_heavy else None
+        self._heavy_re = re.compile(r"\b(" + "|".join(map(re.escape, self.heavy_tables)) + r")\b")
+        self._lock = threading.Lock()
+        self._stats = {"running": 0, "queued": 0, "timeouts": 0, "cancelled": 0, "rejected": 0}
+
+    @classmethod
+    def from_env(cls) -> Optional["QueryGovernor"]:
+        values = {name: os.environ.get(name) for name in (ENV_MAX_HEAVY, ENV_TIMEOUT, ENV_QUEUE_TIMEOUT, ENV_MEMORY_LIMIT)}
+        if not any(values.values()):
+            return None
+        return cls(
+            max_heavy=int(values[ENV_MAX_HEAVY] or 2),
+            timeout_s=float(values[ENV_TIMEOUT]) if values[ENV_TIMEOUT] else None,
+            queue_timeout_s=float(values[ENV_QUEUE_TIMEOUT]) if values[ENV_QUEUE_TIMEOUT] else None,
+            memory_limit=values[ENV_MEMORY_LIMIT] or None,
+        )
+
+    def is_heavy(self, sql: str) -> bool:
+        return self._heavy_re.search(sql) is not None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += delta
+
+    @contextmanager
+    def slot(self, heavy: bool = True, token: Optional[CancelToken] = None) -> Iterator[None]:
+        """Attende uno slot per query pesanti (no-op per le leggere)."""
+        if token is not None:
+            token.check()
+        if not heavy or self._slots is None:
+            yield
+            return
+        deadline = None if self.queue_timeout_s is None else time.monotonic() + self.queue_timeout_s
+        self._count("queued")
+        try:
+            while not self._slots.acquire(timeout=QUEUE_POLL_S):
+                if token is not None and token.cancelled:
+                    self._count("cancelled")
+                    token.check()
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._count("rejected")
+                    raise QueryQueueFull(
+                        f"Nessuno slot libero per query pesanti entro {self.queue_timeout_s}s "
+                        f"({self.max_heavy} in esecuzione)"
+                    )
+        finally:
+            self._count("queued", -1)
+        self._count("running")
+        try:
+            yield
+        finally:
+            self._count("running", -1)
+            self._slots.release()
+
+    @contextmanager
+    def run(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        sql: str,
+        token: Optional[CancelToken] = None,
+        timeout_s: Optional[float] = None,
+    ) -> Iterator[None]:
+        """
+        Contesto di esecuzione di `sql` su `con`: coda, limite di memoria, timeout e
+        annullamento. Gli InterruptException di DuckDB diventano QueryTimeout/QueryCancelled.
+        """
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        with self.slot(self.is_heavy(sql), token):
+            if self.memory_limit:
+                con.execute(f"SET memory_limit = '{self.memory_limit}'")
+            if token is not None:
+                token._attach(con)
+            deadline = _Deadline(con, timeout_s) if timeout_s else None
+            try:
+                yield
+            except duckdb.InterruptException as exc:
+                if deadline is not None and deadline.expired:
+                    self._count("timeouts")
+                    raise QueryTimeout(f"Query interrotta dopo {timeout_s}s") from exc
+                if token is not None and token.cancelled:
+                    self._count("cancelled")
+                    raise QueryCancelled("Query annullata") from exc
+                raise
+            finally:
+                if deadline is not None:
+                    deadline.stop()
+                if token is not None:
+                    token._detach(con)
+
+
+_DEFAULT: Optional[QueryGovernor] = None
+_DEFAULT_LOADED = False
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_governor() -> Optional[QueryGovernor]:
+    """
+    Governor condiviso del processo (da QUERY_MAX_HEAVY / QUERY_TIMEOUT_S / ...), o None:
+    il limite sulle query pesanti ha senso solo se tutte le istanze di grafici lo condividono.
+    """
+    global _DEFAULT, _DEFAULT_LOADED
+    with _DEFAULT_LOCK:
+        if not _DEFAULT_LOADED:
+            _DEFAULT = QueryGovernor.from_env()
+            _DEFAULT_LOADED = True
+        return _DEFAULT
@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import duckdb
+
+from lazy_import import lazy_module
+
+# pandas serve solo agli aggregati (summary/percentiles), non a execute()
+pd = lazy_module("pandas")
+
+# Variabili d'ambiente lette da QueryProfiler.from_env() (ChartBase le usa se non
+# riceve un profiler esplicito): così si attiva in produzione senza toccare il codice.
+ENV_SLOW_LOG = "QUERY_PROFILE_SLOW_LOG"
+ENV_TIMING_LOG = "QUERY_PROFILE_TIMING_LOG"
+ENV_THRESHOLD = "QUERY_PROFILE_THRESHOLD_S"
+ENV_SAMPLE_RATE = "QUERY_PROFILE_SAMPLE_RATE"
+
+# Larghezza in byte dei tipi DuckDB (stima dei byte letti dagli scan)
+TYPE_BYTES = {
+    "BOOLEAN": 1, "TINYINT": 1, "UTINYINT": 1, "SMALLINT": 2, "USMALLINT": 2,
+    "INTEGER": 4, "UINTEGER": 4, "BIGINT": 8, "UBIGINT": 8, "HUGEINT": 16,
+    "FLOAT": 4, "DOUBLE": 8, "DATE": 4, "TIME": 8, "TIMESTAMP": 8,
+    "TIMESTAMP WITH TIME ZONE": 8, "INTERVAL": 16, "UUID": 16,
+}
+# VARCHAR e tipi non in tabella: dimensione del descrittore stringa (16 byte)
+DEFAULT_TYPE_BYTES = 16
+SCAN_OPERATORS = ("SEQ_SCAN", "TABLE_SCAN", "READ_PARQUET", "PARQUET_SCAN")
+TOP_OPERATORS = 8
+
+
+def _type_bytes(data_type: str) -> int:
+    data_type = data_type.upper()
+    if data_type.startswith("DECIMAL"):
+        # DECIMAL(p,s): 2/4/8/16 byte a seconda della precisione
+        precision = int(data_type[data_type.index("(") + 1:].split(",")[0]) if "(" in data_type else 18
+        return 2 if precision <= 4 else 4 if precision <= 9 else 8 if precision <= 18 else 16
+    return TYPE_BYTES.get(data_type, DEFAULT_TYPE_BYTES)
+
+
+def caller_name() -> str:
+    """
+    Metodo "pubblico" del grafico che ha lanciato la query (es. TaxiCharts.q_weather_multidim):
+    si risale lo stack saltando gli helper privati (_sql, _load_df, *_approx, ...).
+    """
+    frame = sys._getframe(1)
+    fallback = None
+    while frame is not None:
+        code = frame.f_code
+        owner = frame.f_locals.get("self")
+        if owner is not None and not code.co_name.startswith("_") and hasattr(owner, "_sql"):
+            return f"{type(owner).__name__}.{code.co_name}"
+        if fallback is None and Path(code.co_filename).name not in ("chart_base.py", "query_profiler.py"):
+            fallback = code.co_name
+        frame = frame.f_back
+    return fallback or "unknown"
+
+
+@dataclass
+class QueryProfiler:
+    """
+    Strumentazione delle query dei grafici (ChartBase._sql).
+
+    - Ogni query: tempo, righe restituite, metodo chiamante; statistiche in memoria
+      (summary() con p50/p90/p99) ed eventuale `timing_log` JSONL (una riga per query).
+    - Una frazione `sample_rate` delle query gira con il profiling JSON di DuckDB:
+      tempi per operatore, cardinalità e stima dei byte letti dagli scan.
+    - Le query sopra `threshold_s` finiscono nello `slow_log` JSONL con SQL e profilo
+      (o il piano EXPLAIN, se la query non era campionata e explain_slow=True).
+
+    Senza campionamento il costo è un perf_counter e un append: si può lasciare attivo.
+    """
+    slow_log: Optional[Path] = None
+    threshold_s: float = 1.0
+    sample_rate: float = 0.0
+    timing_log: Optional[Path] = None
+    explain_slow: bool = True
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._timings: Dict[str, List[float]] = defaultdict(list)
+        self._rows: Dict[str, List[int]] = defaultdict(list)
+        self._column_types: Dict[str, Dict[str, str]] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["QueryProfiler"]:
+        slow_log = os.environ.get(ENV_SLOW_LOG)
+        timing_log = os.environ.get(ENV_TIMING_LOG)
+        if not slow_log and not timing_log:
+            return None
+        return cls(
+            slow_log=Path(slow_log) if slow_log else None,
+            timing_log=Path(timing_log) if timing_log else None,
+            threshold_s=float(os.environ.get(ENV_THRESHOLD, 1.0)),
+            sample_rate=float(os.environ.get(ENV_SAMPLE_RATE, 0.0)),
+        )
+
+    # -------------------------
+    # ESECUZIONE
+    # -------------------------
+
+    def execute(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        sql: str,
+        caller: str,
+        fetch: Optional[Callable[[duckdb.DuckDBPyConnection], Any]] = None,
+    ) -> pd.DataFrame:
+        """Esegue e misura `sql`; `fetch` (default .df()) legge il risultato, che deve avere len()."""
+        with self._lock:
+            sampled = self.sample_rate > 0 and self._rng.random() < self.sample_rate
+
+        profile_path = None
+        if sampled:
+            fd, profile_path = tempfile.mkstemp(prefix="duckdb_profile_", suffix=".json")
+            os.close(fd)
+            con.execute("PRAGMA enable_profiling='json'")
+            con.execute(f"PRAGMA profiling_output='{Path(profile_path).as_posix()}'")
+
+        t0 = time.perf_counter()
+        try:
+            cursor = con.execute(sql)
+            df = cursor.df() if fetch is None else fetch(cursor)
+        finally:
+            if sampled:
+                con.execute("PRAGMA disable_profiling")
+        elapsed = time.perf_counter() - t0
+
+        record: Dict[str, Any] = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "query": caller,
+            "elapsed_s": round(elapsed, 6),
+            "rows": len(df),
+            "sql_hash": hashlib.sha1(sql.encode()).hexdigest()[:12],
+            "sampled": sampled,
+        }
+        if profile_path is not None:
+            record["profile"] = self._read_profile(Path(profile_path), con)
+
+        slow = elapsed >= self.threshold_s
+        if slow and self.slow_log is not None:
+            if "profile" not in record and self.explain_slow:
+                record["plan"] = "\n".join(r[1] for r in con.execute(f"EXPLAIN {sql}").fetchall())
+            record["sql"] = sql
+
+        self._record(record, slow)
+        return df
+
+    def _record(self, record: Dict[str, Any], slow: bool) -> None:
+        with self._lock:
+            self._timings[record["query"]].append(record["elapsed_s"])
+            self._rows[record["query"]].append(record["rows"])
+            if self.timing_log is not None:
+                timing = {k: record[k] for k in ("ts", "query", "elapsed_s", "rows", "sql_hash", "sampled")}
+                if "profile" in record:
+                    timing["scan_bytes_est"] = record["profile"]["scan_bytes_est"]
+                _append_jsonl(self.timing_log, timing)
+            if slow and self.slow_log is not None:
+                _append_jsonl(self.slow_log, record)
+
+    # -------------------------
+    # PROFILO DUCKDB
+    # -------------------------
+
+    def _read_profile(self, path: Path, con: duckdb.DuckDBPyConnection) -> Dict[str, Any]:
+        try:
+            tree = json.loads(path.read_text() or "{}")
+        except ValueError:
+            tree = {}
+        finally:
+            path.unlink(missing_ok=True)
+
+        operators: List[Dict[str, Any]] = []
+        scans: List[Dict[str, Any]] = []
+
+        def walk(node: Dict[str, Any]) -> None:
+            for child in node.get("children", []):
+                name = child.get("name", "").strip()
+                op = {"name": name, "timing_s": child.get("timing", 0.0), "rows": child.get("cardinality", 0)}
+                operators.append(op)
+                if name.startswith(SCAN_OPERATORS):
+                    scans.append(self._scan_info(child, con))
+                walk(child)
+
+        walk(tree)
+        operators.sort(key=lambda o: o["timing_s"], reverse=True)
+        return {
+            "total_s": tree.get("timing"),
+            "operators": operators[:TOP_OPERATORS],
+            "scans": scans,
+            # stima: righe uscite dallo scan x larghezza delle colonne proiettate
+            # (DuckDB 0.10 non espone i byte letti; con i filtri spinti nello scan è un limite inferiore)
+            "scan_bytes_est": sum(s["bytes_est"] for s in scans),
+        }
+
+    def _scan_info(self, node: Dict[str, Any], con: duckdb.DuckDBPyConnection) -> Dict[str, Any]:
+        sections = [s.strip() for s in node.get("extra_info", "").split("[INFOSEPARATOR]")]
+        table = sections[0].splitlines()[0] if sections and sections[0] else ""
+        columns = sections[1].splitlines() if len(sections) > 1 else []
+        types = self._table_types(table, con)
+        width = sum(_type_bytes(types.get(c, "")) for c in columns)
+        rows = node.get("cardinality", 0)
+        return {"table": table, "columns": columns, "rows": rows, "bytes_est": rows * width}
+
+    def _table_types(self, table: str, con: duckdb.DuckDBPyConnection) -> Dict[str, str]:
+        if table not in self._column_types:
+            rows = con.execute(
+                "SELECT column_name, data_type FROM duckdb_columns() WHERE table_name = ?", [table]
+            ).fetchall()
+            self._column_types[table] = dict(rows)
+        return self._column_types[table]
+
+    # -------------------------
+    # AGGREGATI
+    # -------------------------
+
+    def summary(self) -> pd.DataFrame:
+        """Percentili per metodo chiamante sulle query di questo processo."""
+        with self._lock:
+            records = [
+                {"query": q, "elapsed_s": t, "rows": r}
+                for q in self._timings
+                for t, r in zip(self._timings[q], self._rows[q])
+            ]
+        return _percentiles(pd.DataFrame(records, columns=["query", "elapsed_s", "rows"]))
+
+    @staticmethod
+    def percentiles(paths: Iterable[Path]) -> pd.DataFrame:
+        """Percentili per query aggregando più log JSONL (timing o slow log, anche di run diversi)."""
+        records = []
+        for path in paths:
+            with open(path, encoding="utf-8") as fh:
+                records += [json.loads(line) for line in fh if line.strip()]
+        return _percentiles(pd.DataFrame(records, columns=["query", "elapsed_s", "rows"]))
+
+
+def _percentiles(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty:
+        return pd.DataFrame(columns=["query", "count", "p50_s", "p90_s", "p99_s", "max_s", "avg_rows"])
+    g = df.groupby("query")
+    out = pd.DataFrame({
+        "count": g["elapsed_s"].size(),
+        "p50_s": g["elapsed_s"].quantile(0.50),
+        "p90_s": g["elapsed_s"].quantile(0.90),
+        "p99_s": g["elapsed_s"].quantile(0.99),
+        "max_s": g["elapsed_s"].max(),
+        "avg_rows": g["rows"].mean(),
+    })
+    return out.sort_values("p90_s", ascending=False).reset_index()
+
+
+def _append_jsonl(path: Path, record: Dict[str, Any]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as fh:
+        fh.write(json.dumps(record, default=str) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Percentili per query dai log JSONL del profiler.")
+    parser.add_argument("logs", type=Path, nargs="+", help="timing log / slow log (anche di più run)")
+    args = parser.parse_args()
+    with pd.option_context("display.width", 160, "display.max_rows", None):
+        print(QueryProfiler.percentiles(args.logs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import argparse
+import html
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from chart_registry import CHARTS, get_chart
+
+PLOTLY_JS = "plotly.min.js"
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{plotly_js}"></script>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def _render_chart(name: str, db_filename: str, project_root: Optional[str]) -> Dict[str, Any]:
+    """
+    Eseguito nei worker del process pool: query + figura + div HTML (senza plotly.js).
+    Gli errori vengono riportati nel risultato, così un grafico rotto non blocca il report.
+    """
+    spec = get_chart(name)
+    result: Dict[str, Any] = {"name": name, "status": "ok", "pid": os.getpid()}
+    t0 = time.perf_counter()
+    try:
+        charts = spec.build(
+            db_filename=db_filename,
+            project_root=Path(project_root) if project_root else None,
+            show=False,
+        )
+        df = getattr(charts, spec.loader)(**spec.loader_kwargs)
+        t1 = time.perf_counter()
+        fig = getattr(charts, spec.plotter)(df, **spec.plot_kwargs)
+        t2 = time.perf_counter()
+        result["html"] = fig.to_html(full_html=False, include_plotlyjs=False)
+        t3 = time.perf_counter()
+        result.update(
+            rows=len(df),
+            query_s=round(t1 - t0, 4),
+            plot_s=round(t2 - t1, 4),
+            render_s=round(t3 - t2, 4),
+        )
+    except Exception as exc:  # noqa: BLE001 - riportato nel manifest
+        result.update(status="error", error=f"{type(exc).__name__}: {exc}")
+    result["total_s"] = round(time.perf_counter() - t0, 4)
+    return result
+
+
+def _write_plotly_js(out_dir: Path) -> None:
+    """Scrive una sola copia di plotly.js, condivisa da tutte le pagine del report."""
+    from plotly.offline import get_plotlyjs
+
+    (out_dir / PLOTLY_JS).write_text(get_plotlyjs(), encoding="utf-8")
+
+
+def export_report(
+    out_dir: Path,
+    names: Optional[List[str]] = None,
+    combined: bool = False,
+    workers: Optional[int] = None,
+    db_filename: str = "taxi_trips.duckdb",
+    project_root: Optional[Path] = None,
+) -> Dict[str, Any]:
+    """
+    Esporta i grafici del registry in HTML standalone senza display.
+
+    - combined=False: un file <nome>.html per grafico; combined=True: un unico report.html.
+    - Ogni grafico viene calcolato in un processo separato (ProcessPoolExecutor).
+    - Scrive manifest.json con tempi per grafico (query / plot / render) e gli errori.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    names = names or [spec.name for spec in CHARTS]
+    for name in names:
+        get_chart(name)  # fallisce subito su nomi non registrati
+
+    started = time.perf_counter()
+    _write_plotly_js(out_dir)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_render_chart, name, db_filename, str(project_root) if project_root else None)
+            for name in names
+        ]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results[res["name"]] = res
+
+    ordered = [results[name] for name in names]
+    if combined:
+        sections = [
+            f'<section id="{r["name"]}">\n{r["html"]}\n</section>'
+            if r["status"] == "ok"
+            else f'<section id="{r["name"]}"><pre>{html.escape(r["error"])}</pre></section>'
+            for r in ordered
+        ]
+        (out_dir / "report.html").write_text(
+            PAGE_TEMPLATE.format(title="Taxi trips report", plotly_js=PLOTLY_JS, body="\n".join(sections)),
+            encoding="utf-8",
+        )
+    for r in ordered:
+        div = r.pop("html", None)
+        if r["status"] != "ok":
+            continue
+        if combined:
+            r["file"] = "report.html"
+        else:
+            r["file"] = f'{r["name"]}.html'
+            (out_dir / r["file"]).write_text(
+                PAGE_TEMPLATE.format(title=html.escape(r["name"]), plotly_js=PLOTLY_JS, body=div),
+                encoding="utf-8",
+            )
+
+    manifest = {
+        "generated_at": datetime.now().isoformat(timespec="seconds"),
+        "combined": combined,
+        "workers": workers or os.cpu_count(),
+        "total_s": round(time.perf_counter() - started, 4),
+        "charts": ordered,
+    }
+    (out_dir / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export headless dei grafici in HTML.")
+    parser.add_argument("--out", type=Path, default=Path(__file__).resolve().parents[1] / "reports")
+    parser.add_argument("--charts", nargs="*", help="nomi dal registry (default: tutti)")
+    parser.add_argument("--combined", action="store_true", help="un unico report.html")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--db", default="taxi_trips.duckdb")
+    args = parser.parse_args(argv)
+
+    manifest = export_report(
+        out_dir=args.out,
+        names=args.charts,
+        combined=args.combined,
+        workers=args.workers,
+        db_filename=args.db,
+    )
+    failed = [c["name"] for c in manifest["charts"] if c["status"] != "ok"]
+    print(f"Report in {args.out} ({manifest['total_s']}s, {len(manifest['charts'])} grafici)")
+    if failed:
+        print(f"Grafici falliti: {', '.join(failed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
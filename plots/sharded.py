@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import duckdb
+
+from lazy_import import lazy_module
+from query_governor import QueryTimeout
+
+# pandas solo per unire i parziali: chart_base importa questo modulo
+pd = lazy_module("pandas")
+
+# Shard Parquet di dm_trip_narrow scritti da build_shards.py: shards/<db>/dm_trip_narrow/
+SHARD_DIR = "shards"
+SHARD_TABLE = "dm_trip_narrow"
+SHARD_MANIFEST = "manifest.json"
+
+# Aggregati scomponibili: funzione -> (parziali per shard, unione dei parziali).
+# {expr} è l'espressione sulla tabella, {name} la colonna di output; AVG viaggia come
+# somma + conteggio dei valori non NULL e si chiude solo dopo l'unione.
+DECOMPOSABLE = {
+    "count": (["COUNT({expr}) AS {name}"], "COALESCE(SUM({name}), 0)::BIGINT"),
+    "sum": (["SUM({expr}) AS {name}"], "SUM({name})"),
+    "min": (["MIN({expr}) AS {name}"], "MIN({name})"),
+    "max": (["MAX({expr}) AS {name}"], "MAX({name})"),
+    "avg": (["SUM({expr}) AS {name}__sum", "COUNT({expr}) AS {name}__n"],
+            "SUM({name}__sum) / NULLIF(SUM({name}__n), 0)"),
+}
+
+
+@dataclass(frozen=True)
+class Aggregate:
+    """
+    Aggregazione group-by su dm_trip_narrow (alias `f`), eseguibile su una tabella
+    o scomposta per shard.
+
+    - group_by: colonna di output -> espressione
+    - measures: colonna di output -> (funzione in DECOMPOSABLE, espressione)
+    - derived: colonne calcolate sulle misure già aggregate (es. rapporti)
+    - where / order_by: SQL; order_by usa i nomi delle colonne di output
+    """
+    group_by: Dict[str, str]
+    measures: Dict[str, Tuple[str, str]]
+    where: str = "TRUE"
+    derived: Optional[Dict[str, str]] = None
+    order_by: Optional[str] = None
+
+    def __post_init__(self) -> None:
+        unknown = {func for func, _ in self.measures.values()} - set(DECOMPOSABLE)
+        if unknown:
+            raise ValueError(f"Aggregati non scomponibili: {sorted(unknown)}")
+
+    def _finish(self, inner: str) -> str:
+        cols = ", ".join([*self.group_by, *self.measures])
+        derived = "".join(f", {expr} AS {name}" for name, expr in (self.derived or {}).items())
+        order = f"ORDER BY {self.order_by}" if self.order_by else ""
+        return f"SELECT {cols}{derived} FROM ({inner}) a {order}"
+
+    def _select(self, measure_cols: List[str], source: str) -> str:
+        groups = [f"{expr} AS {name}" for name, expr in self.group_by.items()]
+        group_by = "GROUP BY ALL" if groups else ""
+        return f"""
+        SELECT {', '.join([*groups, *measure_cols])}
+        FROM {source} f
+        WHERE {self.where}
+        {group_by}
+        """
+
+    def sql(self, table: str) -> str:
+        """Query diretta su `table` (percorso locale, un solo processo)."""
+        measures = [f"{func.upper()}({expr}) AS {name}" for name, (func, expr) in self.measures.items()]
+        return self._finish(self._select(measures, table))
+
+    def partial_sql(self, source: str) -> str:
+        """Aggregati parziali su un singolo shard."""
+        measures = [
+            col.format(expr=expr, name=name)
+            for name, (func, expr) in self.measures.items()
+            for col in DECOMPOSABLE[func][0]
+        ]
+        return self._select(measures, source)
+
+    def merge_sql(self, partials: str) -> str:
+        """Unione dei parziali di tutti gli shard (registrati come `partials`)."""
+        cols = [*self.group_by, *(
+            f"{DECOMPOSABLE[func][1].format(name=name)} AS {name}"
+            for name, (func, _) in self.measures.items()
+        )]
+        group_by = "GROUP BY ALL" if self.group_by else ""
+        return self._finish(f"SELECT {', '.join(cols)} FROM {partials} {group_by}")
+
+
+def _partial_aggregate(path: str, sql: str, threads: int) -> pd.DataFrame:
+    """Worker: aggregato parziale di uno shard in un DuckDB in memoria."""
+    con = duckdb.connect()
+    try:
+        con.execute(f"SET threads = {threads}")
+        return con.execute(sql.replace("{source}", f"read_parquet('{path}')")).df()
+    finally:
+        con.close()
+
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def shared_pool(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """
+    Pool di processi condiviso da tutte le ShardSet del processo (creato al primo uso).
+    spawn e non fork: il server API ha thread e connessioni DuckDB aperte.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            atexit.register(_POOL.shutdown, cancel_futures=True)
+        return _POOL
+
+
+class ShardSet:
+    """
+    Shard di un DB letti dal manifest di build_shards.py; esegue un Aggregate in
+    scatter-gather: parziali per shard in parallelo (pool di processi o `executor`
+    passato, anche verso altre macchine che vedono gli stessi file), unione in memoria.
+    """
+
+    def __init__(self, directory: Path, manifest: Dict, executor: Optional[Executor] = None) -> None:
+        self.directory = directory
+        self.manifest = manifest
+        self.executor = executor
+
+    @classmethod
+    def open(cls, project_root: Path, db_path: Path, executor: Optional[Executor] = None) -> Optional["ShardSet"]:
+        directory = project_root / SHARD_DIR / db_path.stem / SHARD_TABLE
+        try:
+            manifest = json.loads((directory / SHARD_MANIFEST).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        return cls(directory, manifest, executor)
+
+    def fingerprint(self) -> List[int]:
+        """[righe, max key_taxi_trip, checksum]: le impronte degli shard ricomposte sull'intera tabella."""
+        prints = [s["fingerprint"] for s in self.manifest["shards"].values()]
+        checksum = 0
+        for p in prints:
+            checksum ^= p[2]
+        return [sum(p[0] for p in prints), max((p[1] for p in prints), default=-1), checksum]
+
+    def paths(self, date_range: Tuple[Optional[int], Optional[int]] = (None, None)) -> List[str]:
+        """File degli shard che possono contenere key_date_pickup in [lo, hi)."""
+        lo, hi = date_range
+        return [
+            (self.directory / s["file"]).as_posix()
+            for _, s in sorted(self.manifest["shards"].items())
+            if (lo is None or s["max_date_key"] >= lo) and (hi is None or s["min_date_key"] < hi)
+        ]
+
+    def aggregate(
+        self,
+        agg: Aggregate,
+        date_range: Tuple[Optional[int], Optional[int]] = (None, None),
+        timeout_s: Optional[float] = None,
+    ) -> pd.DataFrame:
+        paths = self.paths(date_range)
+        partial_sql = agg.partial_sql("{source}")
+        if not paths:
+            # periodo fuori da tutti gli shard: basta lo schema dei parziali
+            paths, partial_sql = self.paths()[:1], partial_sql + " LIMIT 0"
+        cpus = os.cpu_count() or 1
+        threads = max(1, cpus // min(len(paths), cpus))
+        executor = self.executor or shared_pool()
+        futures = [executor.submit(_partial_aggregate, p, partial_sql, threads) for p in paths]
+        _, pending = wait(futures, timeout=timeout_s)
+        if pending:
+            # gli shard non ancora partiti non partono più; quelli in corso finiscono a vuoto
+            for f in pending:
+                f.cancel()
+            raise QueryTimeout(f"Aggregazione sugli shard oltre {timeout_s}s")
+        frames = [f.result() for f in futures]
+        con = duckdb.connect()
+        try:
+            con.register("partials", pd.concat(frames, ignore_index=True))
+            return con.execute(agg.merge_sql("partials")).df()
+        finally:
+            con.close()
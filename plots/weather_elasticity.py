@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from chart_base import NARROW_TABLE, ChartBase
+from chart_filters import ChartFilter
+from lazy_import import lazy_module
+
+px = lazy_module("plotly.express")
+
+# Fattore meteo -> categoria di riferimento (baseline) dell'effetto
+FACTORS: Dict[str, object] = {
+    "is_rainy": False,
+    "is_snowy": False,
+    "rain_intensity": "No Rain",
+    "snow_intensity": "No Snow",
+    "temperature_category": "Mild",
+    "apparent_temperature_category": "Feels Mild",
+    "wind_intensity": "Light Wind",
+}
+HOURS_PER_WEEK = 168
+
+
+def bootstrap_effects(
+    trips: np.ndarray,
+    day: np.ndarray,
+    cell: np.ndarray,
+    group: np.ndarray,
+    is_ref: np.ndarray,
+    n_boot: int = 2000,
+    ci: float = 0.95,
+    seed: int = 0,
+    batch_size: int = 250,
+) -> pd.DataFrame:
+    """
+    Effetto relativo di ogni gruppo (categoria meteo) rispetto alla baseline, a parità di cella.
+
+    Input: una riga per ora osservata con `trips`, indice del giorno `day`, della cella
+    di controllo `cell` (borough x ora della settimana), del gruppo `group`, e `is_ref`
+    (ora nella categoria di riferimento). Ogni cella deve avere almeno un'ora di riferimento.
+
+    Stima (standardizzazione indiretta):
+        mu_c     = media dei trip nelle ore di riferimento della cella c
+        effect_g = sum_{h in g} trips_h / sum_{h in g} mu_{c(h)} - 1
+
+    Intervalli: bootstrap a cluster sui giorni (le ore dello stesso giorno sono correlate)
+    con pesi di Poisson(1). Tutto è ridotto a somme giornaliere, quindi ogni batch di
+    replicati è un solo prodotto matriciale pesi (B x giorni) @ aggregati (giorni x colonne);
+    la cella senza ore di riferimento in un replicato usa la media del campione completo.
+    """
+    n_days = int(day.max()) + 1
+    n_cells = int(cell.max()) + 1
+    n_groups = int(group.max()) + 1
+    trips = trips.astype(float)
+
+    def per_day(index: np.ndarray, size: int, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        return np.bincount(index, weights=weights, minlength=n_days * size).reshape(n_days, size)
+
+    ref_trips = per_day(day[is_ref] * n_cells + cell[is_ref], n_cells, trips[is_ref])
+    ref_hours = per_day(day[is_ref] * n_cells + cell[is_ref], n_cells)
+    group_trips = per_day(day * n_groups + group, n_groups, trips)
+
+    # coppie (gruppo, cella) osservate, ordinate per gruppo: reduceat somma per gruppo
+    pairs, pair_idx = np.unique(group * n_cells + cell, return_inverse=True)
+    pair_cell = pairs % n_cells
+    pair_group = pairs // n_cells
+    starts = np.flatnonzero(np.r_[True, np.diff(pair_group) != 0])
+    present = pair_group[starts]
+    pair_hours = per_day(day * len(pairs) + pair_idx, len(pairs))
+
+    agg = np.hstack([ref_trips, ref_hours, group_trips, pair_hours])
+    c1, c2, c3 = n_cells, 2 * n_cells, 2 * n_cells + n_groups
+    total = agg.sum(axis=0)
+    mu_full = total[:c1] / total[c1:c2]
+
+    def estimate(weighted: np.ndarray) -> tuple:
+        s_trips, s_hours = weighted[:, :c1], weighted[:, c1:c2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mu = np.where(s_hours > 0, s_trips / s_hours, mu_full)
+        expected = np.add.reduceat(mu[:, pair_cell] * weighted[:, c3:], starts, axis=1)
+        observed = weighted[:, c2:c3][:, present]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return observed / expected - 1.0, observed, expected
+
+    point, observed, expected = estimate(total[None, :])
+
+    rng = np.random.default_rng(seed)
+    replicates: List[np.ndarray] = []
+    for start in range(0, n_boot, batch_size):
+        size = min(batch_size, n_boot - start)
+        weights = rng.poisson(1.0, (size, n_days)).astype(float)
+        replicates.append(estimate(weights @ agg)[0])
+    boot = np.vstack(replicates) if replicates else np.full((0, len(present)), np.nan)
+
+    alpha = (1.0 - ci) / 2
+    if len(boot):
+        low, high = np.nanquantile(boot, [alpha, 1 - alpha], axis=0)
+    else:
+        low = high = np.full(len(present), np.nan)
+    return pd.DataFrame({
+        "group": present,
+        "hours": np.bincount(group, minlength=n_groups)[present],
+        "trips": observed[0],
+        "expected_trips": expected[0],
+        "effect": point[0],
+        "effect_ci_low": low,
+        "effect_ci_high": high,
+    })
+
+
+@dataclass
+class WeatherElasticity(ChartBase):
+    """
+    Effetto del meteo sulla domanda di taxi (trip orari per borough) con intervalli bootstrap.
+
+    Rispetto ai rapporti trip / record meteo dei grafici per categoria, qui ogni ora è
+    confrontata con la baseline della stessa cella (borough x ora della settimana) nelle
+    ore con meteo di riferimento (FACTORS): l'effetto è la variazione relativa della domanda.
+    """
+    n_boot: int = 2000
+    ci: float = 0.95
+    seed: int = 0
+
+    # ----------------------------
+    # DATASET
+    # ----------------------------
+
+    def load_hourly(self, filters: Optional[ChartFilter] = None) -> pd.DataFrame:
+        """Una riga per (borough, ora) di dm_weather_dt nel periodo coperto dai trip, con i trip (0 se nessuno)."""
+        filters = filters or ChartFilter()
+        fact_where = self._fact_where(filters, alias="t")
+        sql = f"""
+        WITH trips AS (
+            SELECT t.key_weather, COUNT(*) AS trips
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE t.key_weather <> -1
+              AND {fact_where}
+            GROUP BY t.key_weather
+        ),
+        span AS (
+            SELECT MIN(t.pickup_date) AS first_day, MAX(t.pickup_date) AS last_day
+            FROM {self.schema}.{NARROW_TABLE} t
+            WHERE {fact_where}
+        )
+        SELECT
+            lower(w.borough_name) AS borough,
+            w.weather_date,
+            (isodow(w.weather_date) - 1) * 24 + hour(w.weather_time) AS hour_of_week,
+            w.temperature,
+            w.rain,
+            w.snowfall,
+            w.wind_speed,
+            w.is_rainy,
+            w.is_snowy,
+            w.rain_intensity,
+            w.snow_intensity,
+            w.temperature_category,
+            w.apparent_temperature_category,
+            w.wind_intensity,
+            COALESCE(tr.trips, 0) AS trips
+        FROM {self.schema}.dm_weather_dt w
+        CROSS JOIN span
+        LEFT JOIN trips tr ON tr.key_weather = w.key_weather
+        WHERE w.weather_date BETWEEN span.first_day AND span.last_day
+          AND lower(w.borough_name) <> 'unknown'
+          AND {filters.weather_predicates("w")}
+        """
+        return self._sql(sql)
+
+    def q_weather_effects(
+        self,
+        factor: str = "rain_intensity",
+        by_borough: bool = False,
+        filters: Optional[ChartFilter] = None,
+    ) -> pd.DataFrame:
+        """
+        Effetto relativo (es. -0.08 = -8% di trip) di ogni categoria di `factor` rispetto
+        a FACTORS[factor], controllando per borough x ora della settimana.
+        Colonne: [borough], category, hours, trips, expected_trips, effect, effect_ci_low/high.
+        """
+        if factor not in FACTORS:
+            raise ValueError(f"factor deve essere uno di {list(FACTORS)}")
+        columns = ["borough"] * by_borough + ["category", "hours", "trips", "expected_trips",
+                                              "effect", "effect_ci_low", "effect_ci_high", "is_reference"]
+        df = self.load_hourly(filters)
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+
+        borough_code, boroughs = pd.factorize(df["borough"], sort=True)
+        cell = borough_code * HOURS_PER_WEEK + df["hour_of_week"].to_numpy(dtype=np.int64)
+        is_ref = (df[factor] == FACTORS[factor]).to_numpy()
+
+        # celle senza nessuna ora di riferimento: nessuna baseline, si escludono
+        keep = np.bincount(cell[is_ref], minlength=len(boroughs) * HOURS_PER_WEEK)[cell] > 0
+        df, cell, is_ref = df[keep], cell[keep], is_ref[keep]
+        if df.empty:
+            # es. temperature_category su un periodo solo invernale: nessuna ora "Mild"
+            return pd.DataFrame(columns=columns)
+
+        keys = ["borough", factor] if by_borough else [factor]
+        group, labels = pd.MultiIndex.from_frame(df[keys].astype(str)).factorize(sort=True)
+        _, cell = np.unique(cell, return_inverse=True)
+        day, _ = pd.factorize(df["weather_date"])
+
+        out = bootstrap_effects(
+            trips=df["trips"].to_numpy(),
+            day=day,
+            cell=cell,
+            group=group,
+            is_ref=is_ref,
+            n_boot=self.n_boot,
+            ci=self.ci,
+            seed=self.seed,
+        )
+        labels = pd.DataFrame(list(labels), columns=keys).iloc[out.pop("group")].reset_index(drop=True)
+        out = pd.concat([labels.rename(columns={factor: "category"}), out], axis=1)
+        out["is_reference"] = out["category"] == str(FACTORS[factor])
+        return out
+
+    # ----------------------------
+    # PLOT
+    # ----------------------------
+
+    def plot_weather_effects(
+        self,
+        df: pd.DataFrame,
+        title: str = "Weather effect on taxi demand (vs baseline, 95% CI)",
+        category_order: Optional[List[str]] = None,
+    ):
+        color = "borough" if "borough" in df.columns else None
+        if category_order:
+            category_order = [c for c in category_order if c in set(df["category"])]
+        fig = px.scatter(
+            df,
+            x="category",
+            y="effect",
+            color=color,
+            error_y=df["effect_ci_high"] - df["effect"],
+            error_y_minus=df["effect"] - df["effect_ci_low"],
+            hover_data=["hours", "trips", "expected_trips"],
+            category_orders={"category": category_order} if category_order else None,
+            title=title,
+            template="simple_white",
+        )
+        fig.add_hline(y=0, line_dash="dot", line_color="grey")
+        fig.update_yaxes(title_text="Change in trips vs baseline", tickformat=".0%")
+        fig.update_xaxes(title_text="")
+        fig.update_layout(title_x=0.5)
+        return self._show(fig)
+
+
+# ---- ESEMPIO USO ----
+if __name__ == "__main__":
+    elasticity = WeatherElasticity(db_filename="taxi_trips.duckdb", schema="dwh_datamart")
+
+    df_rain = elasticity.q_weather_effects("rain_intensity")
+    print(df_rain)
+    elasticity.plot_weather_effects(df_rain, title="Rain intensity effect on taxi demand")
+
+    df_temp = elasticity.q_weather_effects("temperature_category", by_borough=True)
+    elasticity.plot_weather_effects(df_temp, title="Temperature effect on taxi demand by borough")
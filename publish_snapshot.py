@@ -0,0 +1,179 @@
+"""
+Pubblicazione di uno snapshot di sola lettura dei datamart per i grafici e l'API.
+
+I grafici (plots/) aprono il DuckDB in read_only: mentre dbt scrive sul file il lock
+li blocca per tutta la durata del run. Dopo un build riuscito questo script:
+
+1. copia le tabelle degli schemi pubblicati (default dwh_datamart) in un nuovo file
+   `snapshots/<db>/<db>_<timestamp>.duckdb` (scritto come .tmp e rinominato a copia finita);
+2. sposta in modo atomico il puntatore `snapshots/<db>/CURRENT` (JSON: file, sorgente,
+   righe per tabella) con os.replace;
+3. elimina gli snapshot più vecchi oltre `--keep` (quelli ancora aperti vengono ritentati
+   alla pubblicazione successiva).
+
+ChartBase e l'API seguono il puntatore: le query leggono sempre uno snapshot immutabile,
+mai il file su cui lavora la pipeline. Uso tipico: `dbt run && python publish_snapshot.py`.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import duckdb
+
+from init_duckdb import BASE_DIR, DB_PATH
+
+# stessi nomi letti da plots/chart_base.py (read_snapshot_pointer)
+SNAPSHOT_DIR = BASE_DIR / "snapshots"
+SNAPSHOT_POINTER = "CURRENT"
+DEFAULT_SCHEMAS = ["dwh_datamart"]
+
+
+def snapshot_dir(db_path: Path, root: Path = SNAPSHOT_DIR) -> Path:
+    return root / db_path.stem
+
+
+def local_view_sql(sql: str, schemas: List[str]) -> str:
+    """
+    Toglie il catalogo dai riferimenti a tre parti (catalogo.schema.tabella) di una vista:
+    dbt crea le viste con nomi qualificati (taxi_trips.dwh_datamart.dm_fact_taxi_trip), ma
+    nello snapshot il catalogo ha il nome del file dello snapshot. Si riconoscono dallo schema
+    (uno di `schemas`), non dal nome del catalogo: il file sorgente può essere stato copiato
+    o rinominato dopo il run di dbt.
+    """
+    names = "|".join(re.escape(schema) for schema in schemas)
+    return re.sub(rf'(?<![\w."])(?:"[^"]+"|\w+)\.(?="?(?:{names})"?\.)', "", sql)
+
+
+def copy_schemas(db_path: Path, out_path: Path, schemas: List[str]) -> Dict[str, int]:
+    """Copia tabelle (e viste) degli schemi indicati in un nuovo file DuckDB; ritorna le righe per tabella."""
+    rows: Dict[str, int] = {}
+    con = duckdb.connect(str(out_path))
+    try:
+        # READ_ONLY: fallisce subito se un writer (dbt) ha ancora il file
+        con.execute(f"ATTACH '{db_path.as_posix()}' AS src (READ_ONLY)")
+        placeholders = ", ".join("?" for _ in schemas)
+        tables = con.execute(f"""
+            SELECT schema_name, table_name FROM duckdb_tables()
+            WHERE database_name = 'src' AND schema_name IN ({placeholders})
+            ORDER BY schema_name, table_name
+        """, schemas).fetchall()
+        views = con.execute(f"""
+            SELECT schema_name, sql FROM duckdb_views()
+            WHERE database_name = 'src' AND schema_name IN ({placeholders}) AND NOT internal
+        """, schemas).fetchall()
+        src_schemas = [r[0] for r in con.execute(
+            "SELECT schema_name FROM duckdb_schemas() WHERE database_name = 'src'"
+        ).fetchall()]
+        if not tables:
+            raise RuntimeError(f"Nessuna tabella negli schemi {schemas} di {db_path}")
+
+        for schema in schemas:
+            con.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        for schema, table in tables:
+            con.execute(f'CREATE TABLE "{schema}"."{table}" AS SELECT * FROM src."{schema}"."{table}"')
+            rows[f"{schema}.{table}"] = con.execute(f'SELECT COUNT(*) FROM "{schema}"."{table}"').fetchone()[0]
+        for schema, sql in views:
+            con.execute(f'SET schema = "{schema}"')
+            con.execute(local_view_sql(sql, src_schemas))
+        con.execute("DETACH src")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+    return rows
+
+
+def check_snapshot(path: Path) -> None:
+    """Apre lo snapshot come lo aprono grafici e API e interroga ogni vista: uno snapshot rotto non viene pubblicato."""
+    con = duckdb.connect(str(path), read_only=True)
+    try:
+        views = con.execute(
+            "SELECT schema_name, view_name FROM duckdb_views() WHERE NOT internal"
+        ).fetchall()
+        for schema, view in views:
+            con.execute(f'SELECT * FROM "{schema}"."{view}" LIMIT 0')
+    finally:
+        con.close()
+
+
+def publish_snapshot(
+    db_path: Path = DB_PATH,
+    schemas: List[str] = DEFAULT_SCHEMAS,
+    keep: int = 3,
+    root: Path = SNAPSHOT_DIR,
+) -> Path:
+    t0 = time.perf_counter()
+    db_path = db_path.resolve()
+    if not db_path.exists():
+        raise FileNotFoundError(f"DuckDB non trovato: {db_path}")
+    out_dir = snapshot_dir(db_path, root)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    published_at = datetime.now()
+    name = f"{db_path.stem}_{published_at:%Y%m%dT%H%M%S}.duckdb"
+    tmp = out_dir / (name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        rows = copy_schemas(db_path, tmp, schemas)
+        os.replace(tmp, out_dir / name)
+        try:
+            check_snapshot(out_dir / name)
+        except duckdb.Error:
+            (out_dir / name).unlink(missing_ok=True)
+            raise
+    finally:
+        tmp.unlink(missing_ok=True)
+        Path(str(tmp) + ".wal").unlink(missing_ok=True)
+
+    pointer = out_dir / SNAPSHOT_POINTER
+    pointer_tmp = out_dir / (SNAPSHOT_POINTER + ".tmp")
+    pointer_tmp.write_text(json.dumps({
+        "snapshot": name,
+        "source": str(db_path),
+        "published_at": published_at.isoformat(timespec="seconds"),
+        "schemas": schemas,
+        "tables": rows,
+    }, indent=2), encoding="utf-8")
+    os.replace(pointer_tmp, pointer)
+
+    removed = prune_snapshots(out_dir, keep)
+    print(f"Snapshot {name} pubblicato in {time.perf_counter() - t0:.1f}s "
+          f"({len(rows)} tabelle, {sum(rows.values()):,} righe); rimossi {removed} snapshot vecchi.")
+    return out_dir / name
+
+
+def prune_snapshots(out_dir: Path, keep: int) -> int:
+    """Elimina gli snapshot oltre i `keep` più recenti (mai quello puntato da CURRENT)."""
+    current = json.loads((out_dir / SNAPSHOT_POINTER).read_text(encoding="utf-8"))["snapshot"]
+    snapshots = sorted(out_dir.glob("*.duckdb"), key=lambda p: p.name, reverse=True)
+    removed = 0
+    for path in snapshots[max(1, keep):]:
+        if path.name == current:
+            continue
+        try:
+            path.unlink()
+            removed += 1
+        except PermissionError:
+            # ancora aperto da un lettore (Windows): si riprova alla prossima pubblicazione
+            pass
+    return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pubblica uno snapshot read-only dei datamart per grafici e API.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--schemas", nargs="+", default=DEFAULT_SCHEMAS, help="schemi copiati nello snapshot")
+    parser.add_argument("--keep", type=int, default=3, help="snapshot conservati (compreso il corrente)")
+    parser.add_argument("--snapshot-dir", type=Path, default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+    publish_snapshot(args.db, args.schemas, args.keep, args.snapshot_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Refresh continuo a micro-batch: osserva data/taxi_trip/ e data/weather_dt/ e, per ogni
+arrivo di file, aggiorna solo la catena interessata invece dell'intero progetto dbt.
+
+- trip: i soli parquet nuovi entrano in ods_taxi_trip con ods_trip_dedup.append_new_trips
+  (Bloom filter, nessuna rilettura dello storico raw), poi `dbt run` dei modelli a valle
+  (ods_taxi_trip+, escluso ods_taxi_trip stesso). Con --dbt-ods anche la ODS passa da dbt.
+- meteo: `dbt run -s ods_weather_dt+` (le viste raw leggono già i CSV nuovi via glob;
+  il post-hook di dm_fact_taxi_trip ricollega i trip rimasti senza meteo).
+- opzionale il punteggio degli outlier dei trip nuovi (score_outliers.py);
+- infine lo snapshot read-only per grafici e API (publish_snapshot.py), opzionale l'export Parquet.
+
+I modelli a valle sono incrementali, quindi ogni run lavora sulle sole righe nuove.
+I modelli ricostruiti per intero a ogni run (default: dm_fact_taxi_trip_sample) sono
+esclusi e vanno aggiornati dal build completo periodico.
+
+Controllo del flusso:
+- debounce: un batch parte quando per `debounce_s` non arrivano né cambiano file
+  (anche i file ancora in scrittura restano fuori finché la dimensione non è stabile);
+- attesa massima: con arrivi continui un batch parte comunque dopo `max_wait_s`;
+- back-pressure: un solo refresh alla volta; i file arrivati durante il run si accumulano
+  e confluiscono nel batch successivo, al massimo `max_batch_files` per batch;
+- errori: i file restano in coda e il retry avviene con attesa crescente (fino a max_backoff_s).
+
+Lo stato (file già caricati, con dimensione e mtime) è in refresh_watch_state.json: al primo
+avvio i file presenti sono considerati già caricati, salvo --catch-up.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from init_duckdb import BASE_DIR, DATA_DIR, DB_PATH
+
+STATE_PATH = BASE_DIR / "refresh_watch_state.json"
+# tipo di sorgente -> (cartella sotto data/, pattern dei file)
+WATCHED = {
+    "taxi_trip": ("taxi_trip", "*.parquet"),
+    "weather": ("weather_dt", "*/*.csv"),
+}
+# modelli dbt da cui parte la catena di ogni sorgente
+CHAIN_ROOTS = {"taxi_trip": "ods_taxi_trip", "weather": "ods_weather_dt"}
+FULL_REBUILD_MODELS = ["dm_fact_taxi_trip_sample"]
+
+FileKey = Tuple[int, int]  # (dimensione, mtime_ns)
+
+
+def scan(data_dir: Path) -> Dict[str, Tuple[str, FileKey]]:
+    """Tutti i file osservati: percorso -> (sorgente, (dimensione, mtime_ns))."""
+    found: Dict[str, Tuple[str, FileKey]] = {}
+    for kind, (folder, pattern) in WATCHED.items():
+        for path in sorted((data_dir / folder).glob(pattern)):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            found[str(path)] = (kind, (st.st_size, st.st_mtime_ns))
+    return found
+
+
+@dataclass
+class RefreshWatcher:
+    db_path: Path = DB_PATH
+    data_dir: Path = DATA_DIR
+    state_path: Path = STATE_PATH
+    poll_s: float = 5.0
+    debounce_s: float = 30.0
+    max_wait_s: float = 300.0
+    max_batch_files: int = 50
+    max_backoff_s: float = 900.0
+    dbt_ods: bool = False
+    exclude: List[str] = field(default_factory=lambda: list(FULL_REBUILD_MODELS))
+    score_outliers: bool = False
+    publish: bool = True
+    export: bool = False
+    profiles_dir: Optional[Path] = None
+
+    def __post_init__(self) -> None:
+        self.loaded: Dict[str, FileKey] = {}
+        self._seen: Dict[str, FileKey] = {}
+        self._first_pending: Optional[float] = None
+        self._last_change: Optional[float] = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    # ----------------------------
+    # STATO
+    # ----------------------------
+
+    def load_state(self, catch_up: bool = False) -> None:
+        if self.state_path.exists():
+            data = json.loads(self.state_path.read_text(encoding="utf-8"))
+            self.loaded = {path: tuple(key) for path, key in data["loaded"].items()}
+        elif not catch_up:
+            self.loaded = {path: key for path, (_, key) in scan(self.data_dir).items()}
+            self.save_state()
+
+    def save_state(self) -> None:
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        tmp.write_text(json.dumps({"loaded": self.loaded}, indent=1), encoding="utf-8")
+        os.replace(tmp, self.state_path)
+
+    # ----------------------------
+    # CICLO
+    # ----------------------------
+
+    def pending(self) -> Dict[str, Tuple[str, FileKey]]:
+        """File nuovi o modificati rispetto all'ultimo caricamento."""
+        return {p: v for p, v in scan(self.data_dir).items() if self.loaded.get(p) != v[1]}
+
+    def poll(self, now: float) -> Optional[Dict[str, Tuple[str, FileKey]]]:
+        """Un giro di osservazione; ritorna il batch da caricare quando debounce/attesa lo consentono."""
+        pending = self.pending()
+        if not pending:
+            self._seen = {}
+            self._first_pending = self._last_change = None
+            return None
+        current = {p: v[1] for p, v in pending.items()}
+        previous, self._seen = self._seen, current
+        if current != previous:
+            self._last_change = now
+            if self._first_pending is None:
+                self._first_pending = now
+        if now < self._retry_at:
+            return None
+
+        if now - self._last_change >= self.debounce_s:
+            ready = pending
+        elif now - self._first_pending >= self.max_wait_s:
+            # arrivi continui oltre l'attesa massima: si caricano i file fermi dal giro precedente
+            ready = {p: v for p, v in pending.items() if previous.get(p) == v[1]}
+        else:
+            return None
+        oldest = sorted(ready, key=lambda p: ready[p][1][1])[: self.max_batch_files]
+        return {p: ready[p] for p in oldest} or None
+
+    def refresh(self, batch: Dict[str, Tuple[str, FileKey]]) -> bool:
+        """Carica un batch; True se l'intera catena è andata a buon fine."""
+        from cli import run_dbt
+
+        t0 = time.perf_counter()
+        kinds = {kind for kind, _ in batch.values()}
+        trip_files = [Path(p) for p, (kind, _) in batch.items() if kind == "taxi_trip"]
+        print(f"Refresh di {len(batch)} file ({', '.join(sorted(kinds))})...")
+
+        select = [CHAIN_ROOTS[kind] + "+" for kind in sorted(kinds)]
+        exclude = list(self.exclude)
+        if trip_files and not self.dbt_ods:
+            from ods_trip_dedup import append_new_trips
+            # in un retry dopo un errore di dbt i trip già accodati vengono scartati come duplicati
+            append_new_trips(self.db_path, files=trip_files)
+            exclude.append(CHAIN_ROOTS["taxi_trip"])
+        if run_dbt(select, exclude, profiles_dir=self.profiles_dir) != 0:
+            return False
+
+        if self.score_outliers:
+            from score_outliers import score_outliers
+            score_outliers(self.db_path)
+        if self.publish:
+            from publish_snapshot import publish_snapshot
+            publish_snapshot(self.db_path)
+        if self.export:
+            from export_parquet import export_parquet
+            export_parquet(self.db_path)
+        print(f"Refresh completato in {time.perf_counter() - t0:.1f}s.")
+        return True
+
+    def step(self, now: Optional[float] = None) -> bool:
+        """Un giro completo (osservazione + eventuale refresh); True se è stato caricato un batch."""
+        now = time.monotonic() if now is None else now
+        batch = self.poll(now)
+        if batch is None:
+            return False
+        try:
+            ok = self.refresh(batch)
+        except Exception as exc:  # noqa: BLE001 - il watcher non si ferma, ritenta
+            print(f"Refresh fallito: {type(exc).__name__}: {exc}")
+            ok = False
+        if not ok:
+            self._failures += 1
+            delay = min(self.max_backoff_s, self.poll_s * 2 ** self._failures)
+            self._retry_at = time.monotonic() + delay
+            print(f"Nuovo tentativo tra {delay:.0f}s ({len(batch)} file restano in coda).")
+            return False
+        self._failures = 0
+        self._retry_at = 0.0
+        for path, (_, key) in batch.items():
+            self.loaded[path] = key
+        self.save_state()
+        self._seen = {}
+        self._first_pending = self._last_change = None
+        return True
+
+    def run_forever(self) -> None:
+        print(f"In ascolto su {self.data_dir} (poll {self.poll_s}s, debounce {self.debounce_s}s, "
+              f"attesa massima {self.max_wait_s}s, max {self.max_batch_files} file per batch).")
+        while True:
+            loaded = self.step()
+            if not loaded:
+                time.sleep(self.poll_s)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Refresh continuo a micro-batch all'arrivo di nuovi file.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--data-dir", type=Path, default=DATA_DIR)
+    parser.add_argument("--state", type=Path, default=STATE_PATH)
+    parser.add_argument("--poll", type=float, default=5.0, help="secondi tra due scansioni")
+    parser.add_argument("--debounce", type=float, default=30.0, help="secondi senza nuovi arrivi prima del batch")
+    parser.add_argument("--max-wait", type=float, default=300.0, help="attesa massima con arrivi continui")
+    parser.add_argument("--max-batch-files", type=int, default=50)
+    parser.add_argument("--dbt-ods", action="store_true", help="ods_taxi_trip via dbt invece del caricamento Bloom")
+    parser.add_argument("--exclude", nargs="*", default=FULL_REBUILD_MODELS,
+                        help="modelli esclusi dai micro-batch (ricostruiti dal build completo)")
+    parser.add_argument("--score-outliers", action="store_true", help="segnala i trip anomali dopo ogni batch")
+    parser.add_argument("--no-publish", action="store_true", help="non pubblicare lo snapshot dopo ogni batch")
+    parser.add_argument("--export", action="store_true", help="export Parquet incrementale dopo ogni batch")
+    parser.add_argument("--profiles-dir", type=Path, default=None)
+    parser.add_argument("--catch-up", action="store_true",
+                        help="senza stato salvato, carica anche i file già presenti")
+    parser.add_argument("--once", action="store_true", help="un solo giro (es. da cron), senza debounce")
+    args = parser.parse_args()
+
+    watcher = RefreshWatcher(
+        db_path=args.db,
+        data_dir=args.data_dir,
+        state_path=args.state,
+        poll_s=args.poll,
+        debounce_s=0.0 if args.once else args.debounce,
+        max_wait_s=args.max_wait,
+        max_batch_files=args.max_batch_files,
+        dbt_ods=args.dbt_ods,
+        exclude=args.exclude,
+        score_outliers=args.score_outliers,
+        publish=not args.no_publish,
+        export=args.export,
+        profiles_dir=args.profiles_dir,
+    )
+    watcher.load_state(catch_up=args.catch_up)
+    if args.once:
+        watcher.step()
+    else:
+        watcher.run_forever()
+
+
+if __name__ == "__main__":
+    main()
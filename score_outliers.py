@@ -0,0 +1,291 @@
+"""
+Punteggio degli outlier dei trip: scrive la colonna outlier_flags di dm_fact_taxi_trip
+(e di dm_trip_narrow, letta dai grafici).
+
+La ODS azzera solo gli importi negativi e scarta le durate non positive: velocità assurde,
+tariffe per miglio fuori scala o trip di giorni arrivano nella fact e spostano tutte le medie.
+Per ogni trip si valutano tre misure, sul logaritmo (distribuzioni molto asimmetriche):
+
+- velocità media (mph) = trip_distance / durata;
+- tariffa per miglio = fare_amount / trip_distance;
+- durata in minuti.
+
+Statistiche robuste per zona di pickup x ora (mediana e MAD, dm_trip_outlier_stats); le
+coppie con meno di MIN_GROUP_TRIPS valori usano quelle dell'ora su tutte le zone.
+Un valore è anomalo se il modified z-score 0.6745 * (x - mediana) / MAD supera la soglia
+in valore assoluto, oppure se supera i limiti fissi (MAX_SPEED_MPH, MAX_DURATION_MIN).
+Distanza o tariffa nulle lasciano senza punteggio velocità e tariffa per miglio.
+
+outlier_flags è una bitmask (FLAG_*): 0 = trip plausibile, NULL = non ancora valutato.
+I grafici la filtrano con ChartFilter(exclude_outliers=True).
+
+Ogni run valuta le sole righe con outlier_flags NULL (i trip accodati dall'ultimo run), a
+blocchi di key_taxi_trip: le misure escono da DuckDB con fetchnumpy e il punteggio è calcolato
+con NumPy sull'intero blocco (lookup delle statistiche per indice, nessun ciclo per trip).
+Le statistiche si ricalcolano quando la fact è cresciuta di oltre STATS_REFRESH_GROWTH;
+--rescore rivaluta tutta la fact con statistiche nuove.
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+from init_duckdb import DB_PATH
+
+SCHEMA = "dwh_datamart"
+FACT_TABLE = "dm_fact_taxi_trip"
+NARROW_TABLE = "dm_trip_narrow"
+STATS_TABLE = "dm_trip_outlier_stats"
+BATCH_ROWS = 2_000_000
+
+# bit di outlier_flags
+FLAG_SPEED = 1
+FLAG_FARE_PER_MILE = 2
+FLAG_DURATION = 4
+# misura -> (bit, espressione sul logaritmo, su dm_fact_taxi_trip `f`)
+METRICS = {
+    "speed_mph": (
+        FLAG_SPEED,
+        "CASE WHEN f.trip_distance > 0 THEN ln(f.trip_distance / (f.trip_duration_minutes / 60)) END",
+    ),
+    "fare_per_mile": (
+        FLAG_FARE_PER_MILE,
+        "CASE WHEN f.trip_distance > 0 AND f.fare_amount > 0 THEN ln(f.fare_amount / f.trip_distance) END",
+    ),
+    "duration_min": (
+        FLAG_DURATION,
+        "CASE WHEN f.trip_duration_minutes > 0 THEN ln(f.trip_duration_minutes) END",
+    ),
+}
+MAX_SPEED_MPH = 100.0
+MAX_DURATION_MIN = 24 * 60.0
+Z_THRESHOLD = 3.5  # Iglewicz-Hoaglin
+MIN_GROUP_TRIPS = 30
+# MAD minima sul logaritmo (~1%): gruppi con valori quasi tutti uguali non segnalano tutto il resto
+MAD_FLOOR = 0.01
+STATS_REFRESH_GROWTH = 0.2
+
+
+# ----------------------------
+# STATISTICHE ROBUSTE
+# ----------------------------
+
+def _metrics_select(where: str) -> str:
+    logs = ",\n            ".join(f"({expr})::DOUBLE AS {name}" for name, (_, expr) in METRICS.items())
+    return f"""
+        SELECT
+            f.key_taxi_trip,
+            f.key_zone_pickup::BIGINT AS key_zone_pickup,
+            HOUR(f.pickup_time)::INTEGER AS pickup_hour,
+            {logs}
+        FROM {SCHEMA}.{FACT_TABLE} AS f
+        WHERE {where}
+    """
+
+
+def compute_stats(con: duckdb.DuckDBPyConnection) -> int:
+    """(Ri)crea dm_trip_outlier_stats: zona x ora, più le righe per ora (key_zone_pickup NULL)."""
+    aggregates = ",\n            ".join(
+        f"COUNT({name}) AS {name}_n, median({name}) AS {name}_median, mad({name}) AS {name}_mad"
+        for name in METRICS
+    )
+    fact_rows = con.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{FACT_TABLE}").fetchone()[0]
+    con.execute(f"""
+        CREATE OR REPLACE TABLE {SCHEMA}.{STATS_TABLE} AS
+        SELECT
+            key_zone_pickup,
+            pickup_hour,
+            {aggregates},
+            {fact_rows}::BIGINT AS fact_rows,
+            current_timestamp AS computed_at
+        FROM ({_metrics_select("TRUE")})
+        GROUP BY GROUPING SETS ((key_zone_pickup, pickup_hour), (pickup_hour))
+        ORDER BY key_zone_pickup NULLS FIRST, pickup_hour
+    """)
+    return fact_rows
+
+
+def stats_outdated(con: duckdb.DuckDBPyConnection) -> bool:
+    exists = con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?",
+        [SCHEMA, STATS_TABLE],
+    ).fetchone()[0]
+    if not exists:
+        return True
+    computed_on = con.execute(f"SELECT MAX(fact_rows) FROM {SCHEMA}.{STATS_TABLE}").fetchone()[0] or 0
+    fact_rows = con.execute(f"SELECT COUNT(*) FROM {SCHEMA}.{FACT_TABLE}").fetchone()[0]
+    return fact_rows > computed_on * (1 + STATS_REFRESH_GROWTH)
+
+
+@dataclass
+class RobustStats:
+    """Mediana e MAD per (indice zona, ora, misura); l'ultima "zona" è il fallback per ora."""
+    zone_keys: np.ndarray  # chiavi ordinate, per np.searchsorted
+    median: np.ndarray     # (zone + 1, 24, misure)
+    mad: np.ndarray
+
+    @classmethod
+    def load(cls, con: duckdb.DuckDBPyConnection, min_group_trips: int = MIN_GROUP_TRIPS) -> "RobustStats":
+        df = con.execute(f"SELECT * FROM {SCHEMA}.{STATS_TABLE}").df()
+        by_hour = df[df["key_zone_pickup"].isna()].set_index("pickup_hour")
+        zones = df[df["key_zone_pickup"].notna()]
+        zone_keys = np.sort(zones["key_zone_pickup"].astype(np.int64).unique())
+        fallback = len(zone_keys)
+
+        median = np.full((fallback + 1, 24, len(METRICS)), np.nan)
+        mad = np.full_like(median, np.nan)
+        z_idx = np.searchsorted(zone_keys, zones["key_zone_pickup"].astype(np.int64).to_numpy())
+        hours = zones["pickup_hour"].to_numpy(dtype=np.int64)
+        h_idx = by_hour.index.to_numpy(dtype=np.int64)
+        for m, name in enumerate(METRICS):
+            median[fallback, h_idx, m] = by_hour[f"{name}_median"].to_numpy(dtype=float)
+            mad[fallback, h_idx, m] = by_hour[f"{name}_mad"].to_numpy(dtype=float)
+            enough = zones[f"{name}_n"].to_numpy() >= min_group_trips
+            median[z_idx, hours, m] = np.where(
+                enough, zones[f"{name}_median"].to_numpy(dtype=float), median[fallback, hours, m]
+            )
+            mad[z_idx, hours, m] = np.where(
+                enough, zones[f"{name}_mad"].to_numpy(dtype=float), mad[fallback, hours, m]
+            )
+        # coppie zona x ora senza trip: statistiche dell'ora
+        missing = np.isnan(median[:fallback])
+        median[:fallback][missing] = np.broadcast_to(median[fallback], median[:fallback].shape)[missing]
+        mad[:fallback][missing] = np.broadcast_to(mad[fallback], mad[:fallback].shape)[missing]
+        return cls(zone_keys=zone_keys, median=median, mad=np.maximum(mad, MAD_FLOOR))
+
+    def zone_index(self, keys: np.ndarray) -> np.ndarray:
+        """Indice di ogni chiave di zona; le zone assenti dalle statistiche vanno sul fallback."""
+        idx = np.searchsorted(self.zone_keys, keys)
+        found = idx < len(self.zone_keys)
+        found[found] = self.zone_keys[idx[found]] == keys[found]
+        return np.where(found, idx, len(self.zone_keys))
+
+
+# ----------------------------
+# PUNTEGGIO
+# ----------------------------
+
+def score_batch(batch: Dict[str, np.ndarray], stats: RobustStats, threshold: float = Z_THRESHOLD) -> np.ndarray:
+    """outlier_flags di un blocco di trip (colonne di _metrics_select)."""
+    zone = stats.zone_index(batch["key_zone_pickup"].astype(np.int64))
+    hour = batch["pickup_hour"].astype(np.int64)
+    flags = np.zeros(len(zone), dtype=np.uint8)
+    # fetchnumpy restituisce array mascherati dove ci sono NULL
+    values_of = {name: np.ma.filled(batch[name].astype(float), np.nan) for name in METRICS}
+    for m, (name, (bit, _)) in enumerate(METRICS.items()):
+        values = values_of[name]
+        z = 0.6745 * (values - stats.median[zone, hour, m]) / stats.mad[zone, hour, m]
+        # NaN (misura non definita o ora senza statistiche) -> confronto falso, nessun flag
+        flags[np.abs(z) > threshold] |= bit
+    flags[values_of["speed_mph"] > np.log(MAX_SPEED_MPH)] |= FLAG_SPEED
+    flags[values_of["duration_min"] > np.log(MAX_DURATION_MIN)] |= FLAG_DURATION
+    return flags
+
+
+def _has_table(con: duckdb.DuckDBPyConnection, table: str) -> bool:
+    return con.execute(
+        "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = ? AND table_name = ?", [SCHEMA, table]
+    ).fetchone()[0] > 0
+
+
+def score_outliers(
+    db_path: Path = DB_PATH,
+    rescore: bool = False,
+    refresh_stats: bool = False,
+    threshold: float = Z_THRESHOLD,
+    batch_rows: int = BATCH_ROWS,
+) -> Dict[str, int]:
+    """Valuta i trip senza outlier_flags (tutti con rescore=True); ritorna i conteggi per flag."""
+    t0 = time.perf_counter()
+    con = duckdb.connect(str(db_path))
+    try:
+        pending = "TRUE" if rescore else "f.outlier_flags IS NULL"
+        lo, hi = con.execute(f"""
+            SELECT MIN(key_taxi_trip), MAX(key_taxi_trip) FROM {SCHEMA}.{FACT_TABLE} AS f WHERE {pending}
+        """).fetchone()
+        if lo is None:
+            print("Nessun trip da valutare.")
+            return {"scored": 0, "outliers": 0}
+
+        if rescore or refresh_stats or stats_outdated(con):
+            rows = compute_stats(con)
+            print(f"Statistiche robuste ricalcolate su {rows:,} trip.")
+        stats = RobustStats.load(con)
+
+        # blocchi per intervallo di chiave: la fact è accodata in ordine di key_taxi_trip
+        scored = 0
+        flagged_keys, flagged_values = [], []
+        for start in range(lo, hi + 1, batch_rows):
+            end = min(start + batch_rows - 1, hi)
+            batch = con.execute(_metrics_select(
+                f"f.key_taxi_trip BETWEEN {start} AND {end} AND {pending}"
+            )).fetchnumpy()
+            if len(batch["key_taxi_trip"]) == 0:
+                continue
+            flags = score_batch(batch, stats, threshold)
+            hit = flags != 0
+            flagged_keys.append(np.asarray(batch["key_taxi_trip"])[hit])
+            flagged_values.append(flags[hit])
+            scored += len(flags)
+
+        flagged = pd.DataFrame({
+            "key_taxi_trip": np.concatenate(flagged_keys) if flagged_keys else np.zeros(0, dtype=np.int64),
+            "outlier_flags": np.concatenate(flagged_values) if flagged_values else np.zeros(0, dtype=np.uint8),
+        })
+        con.register("flagged_trips", flagged)
+        # solo l'intervallo letto: trip accodati nel frattempo restano NULL per il run successivo
+        tables = [FACT_TABLE] + ([NARROW_TABLE] if _has_table(con, NARROW_TABLE) else [])
+        con.execute("BEGIN TRANSACTION")
+        try:
+            for table in tables:
+                con.execute(f"""
+                    UPDATE {SCHEMA}.{table} AS f SET outlier_flags = 0
+                    WHERE f.key_taxi_trip BETWEEN {lo} AND {hi} AND {pending}
+                """)
+                con.execute(f"""
+                    UPDATE {SCHEMA}.{table} AS f SET outlier_flags = o.outlier_flags
+                    FROM flagged_trips AS o
+                    WHERE f.key_taxi_trip = o.key_taxi_trip
+                """)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        con.close()
+
+    values = flagged["outlier_flags"].to_numpy()
+    result = {
+        "scored": scored,
+        "outliers": len(flagged),
+        "speed": int((values & FLAG_SPEED).astype(bool).sum()),
+        "fare_per_mile": int((values & FLAG_FARE_PER_MILE).astype(bool).sum()),
+        "duration": int((values & FLAG_DURATION).astype(bool).sum()),
+    }
+    share = result["outliers"] / scored if scored else 0.0
+    print(f"{scored:,} trip valutati, {result['outliers']:,} outlier ({share:.2%}: "
+          f"velocità {result['speed']:,}, tariffa/miglio {result['fare_per_mile']:,}, "
+          f"durata {result['duration']:,}) in {time.perf_counter() - t0:.1f}s.")
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Segnala i trip con velocità, tariffa per miglio o durata anomale.")
+    parser.add_argument("--db", type=Path, default=DB_PATH)
+    parser.add_argument("--rescore", action="store_true", help="rivaluta tutta la fact con statistiche nuove")
+    parser.add_argument("--refresh-stats", action="store_true", help="ricalcola le statistiche prima del punteggio")
+    parser.add_argument("--threshold", type=float, default=Z_THRESHOLD, help="soglia del modified z-score")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    args = parser.parse_args()
+    score_outliers(args.db, args.rescore, args.refresh_stats, args.threshold, args.batch_rows)
+
+
+if __name__ == "__main__":
+    main()